@@ -1,6 +1,20 @@
-import keras
+import os
+import shutil
+import tempfile
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
+try:
+    import keras
+    Sequence = keras.utils.Sequence
+except ImportError:
+    # Only fit_generator() needs a keras Sequence; without keras, e.g. in
+    #   bench.py, the generators are plain sequences
+    Sequence = object
+
+# Names of the ArrayGenerator arrays that share() moves to memory-mapped files
+SHARED_ARRAYS = ['uid', 'jid', 'rating', 'indexes']
 
 MAX_UID = 73421
 MAX_JID = 100
@@ -11,7 +25,7 @@ np.random.seed(9999)
 
 # Original code by Afshine Amidi & Shervine Amidi from
 #   https://stanford.edu/~shervine/blog/keras-how-to-generate-data-on-the-fly
-class DataGenerator(keras.utils.Sequence):
+class DataGenerator(Sequence):
     'Generate data batch by batch for 73,421 categorical input NN'
     def __init__(self, train, batch_size=4096, shuffle=True):
         'Initialization'
@@ -51,3 +65,135 @@ class DataGenerator(keras.utils.Sequence):
         if self.shuffle == True:
             np.random.shuffle(self.indexes)
 
+
+class ArrayGenerator(Sequence):
+    'Generate batches from contiguous uID, jID, and rating arrays'
+    def __init__(self, train, batch_size=4096, shuffle=True, prefetch=0,
+                 keep_tail=False):
+        """
+        Arguments:
+            - train: pandas.dataframe
+                Dataframe that contains the training set in the n x 3 format.
+            - batch_size: int, default 4096
+                Size of each mini-batch.
+            - shuffle: boolean, default True
+                Whether to shuffle the order of dataset after each epoch.
+            - prefetch: int, default 0
+                Number of upcoming batches to gather on a background thread.
+            - keep_tail: boolean, default False
+                Whether to also yield the last, partial batch. DataGenerator
+                drops it.
+        """
+        self.uid = np.ascontiguousarray(train.uID.values, dtype=np.int32)
+        self.jid = np.ascontiguousarray(train.jID.values, dtype=np.int32)
+        self.rating = np.ascontiguousarray(train.iloc[:, 2].values,
+                                           dtype=np.float32)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.prefetch = prefetch
+        self.keep_tail = keep_tail
+        self.indexes = None
+        self._pool = None
+        self._pending = {}
+        self._dir = None    # directory of the shared arrays; see share()
+        self._owner = True  # whether this copy created the shared arrays
+        self._cleanup = None
+        self.on_epoch_end()
+
+    def __len__(self):
+        'Denotes the number of batches per epoch'
+        if self.keep_tail:
+            return int(np.ceil(len(self.rating) / self.batch_size))
+        return int(np.floor(len(self.rating) / self.batch_size))
+
+    def __getitem__(self, index):
+        'Generate one batch of data'
+        if not self.prefetch:
+            return self._batch(self.indexes, index)
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(1)
+        fut = self._pending.pop(index, None)
+        batch = (fut.result() if fut is not None
+                 else self._batch(self.indexes, index))
+
+        # Queue up the next batches while this one is being trained on
+        for i in range(index + 1, min(index + 1 + self.prefetch, len(self))):
+            if i not in self._pending:
+                self._pending[i] = self._pool.submit(self._batch,
+                                                     self.indexes, i)
+        return batch
+
+    def _batch(self, indexes, index):
+        'Gather batch `index` of the permutation `indexes`'
+        idx = indexes[index*self.batch_size:(index+1)*self.batch_size]
+        return ([np.take(self.uid, idx), np.take(self.jid, idx)],
+                np.take(self.rating, idx))
+
+    def on_epoch_end(self):
+        'Updates indexes after each epoch'
+        # Prefetched batches belong to the old order
+        self._pending = {}
+        if not self._owner:
+            return
+        if self.shuffle == True:
+            indexes = np.random.permutation(len(self.rating)).astype(np.int32)
+        else:
+            indexes = np.arange(len(self.rating), dtype=np.int32)
+
+        if self._dir is None:
+            self.indexes = indexes
+        else:
+            # In place, so the processes attached to it see the new order
+            self.indexes[:] = indexes
+            self.indexes.flush()
+
+    def share(self):
+        """
+        Move the arrays to memory-mapped files, in shared memory (/dev/shm)
+        when available, so that copies of this generator made by pickling,
+        e.g. for fit_generator(use_multiprocessing=True) workers, attach to
+        the same pages instead of holding their own copy of the data. It is
+        done on the first pickle if it was not called before.
+        """
+        if self._dir is not None:
+            return
+
+        self._dir = tempfile.mkdtemp(prefix='mlp_gen_',
+                                     dir='/dev/shm' if os.path.isdir('/dev/shm')
+                                     else None)
+        for name in SHARED_ARRAYS:
+            fn = os.path.join(self._dir, name + '.npy')
+            np.save(fn, getattr(self, name))
+            setattr(self, name, np.load(fn, mmap_mode='r'))
+        # The order is rewritten every epoch
+        self.indexes = np.load(os.path.join(self._dir, 'indexes.npy'),
+                               mmap_mode='r+')
+
+        # Remove the files once this generator is gone, at the latest when
+        #   the process exits.
+        self._cleanup = weakref.finalize(self, shutil.rmtree, self._dir, True)
+
+    def close(self):
+        'Remove the shared arrays, if this copy created them'
+        if self._cleanup is not None:
+            self._cleanup()
+
+    def __getstate__(self):
+        # Threads do not pickle; workers start their own on first use
+        self.share()
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        state['_pending'] = {}
+        state['_cleanup'] = None
+        for name in SHARED_ARRAYS:
+            state[name] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Attach to the arrays of the generator this one was pickled from
+        self._owner = False
+        for name in SHARED_ARRAYS:
+            setattr(self, name, np.load(os.path.join(self._dir, name + '.npy'),
+                                        mmap_mode='r'))
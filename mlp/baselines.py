@@ -0,0 +1,166 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+# Comparison estimates of format.py for the test users, from one pass over
+#   the ratings,
+#
+#   python3 baselines.py SOURCE ... [--out ../data]
+#
+#   - unif: a uniform random rating in [-10, 10] for every joke, seeded
+#   - tavg: the mean of all ratings
+#   - uavg: the mean of the test user's ratings, or tavg for a test user
+#     without any
+#
+# written in the layout of jester-data-testing.csv to the COMPARE files of
+#   format.py. A SOURCE is a directory of ingest.py, a wide Jester CSV, or a
+#   split CSV of cvout, e.g. a training set; the ratings of all the SOURCEs
+#   are streamed once, keeping running sums of all of them and of each test
+#   user, so memory does not grow with the number of users or ratings.
+
+FILES = {'unif': 'compare_uniform.csv',
+         'tavg': 'compare_totalAVG.csv',
+         'uavg': 'compare_userAVG.csv'}
+DECIMALS = {'unif': 2, 'tavg': 3, 'uavg': 4}
+CHUNK_ROWS = 1000000
+
+class RunningMeans(object):
+    'Running sums of the ratings overall and of each test user'
+    def __init__(self, uIDs):
+        """
+        Arguments:
+            - uIDs: np.array
+                uIDs of the test users.
+        """
+        self.uIDs = np.asarray(uIDs)
+        self.sums = np.zeros(len(self.uIDs))
+        self.counts = np.zeros(len(self.uIDs), dtype=np.int64)
+        self.total = 0.
+        self.n = 0
+        # Lookup table from uID to test user, -1 for the others; grown to
+        #   the largest uID seen, ~300KB for all 73,421 uIDs
+        self.table = np.full(self.uIDs.max() + 1, -1, dtype=np.int32)
+        self.table[self.uIDs] = np.arange(len(self.uIDs))
+
+    def update(self, uIDs, ratings):
+        'Add a chunk of ratings of `uIDs`'
+        ratings = np.asarray(ratings, dtype=float)
+        self.total += ratings.sum()
+        self.n += len(ratings)
+
+        top = uIDs.max() if len(uIDs) else 0
+        if top >= len(self.table):
+            self.table = np.concatenate([
+                self.table, np.full(top + 1 - len(self.table), -1,
+                                    dtype=np.int32)])
+        i = self.table[uIDs]
+        test = i >= 0
+        self.sums += np.bincount(i[test], ratings[test], len(self.uIDs))
+        self.counts += np.bincount(i[test], minlength=len(self.uIDs))
+
+    def mean(self):
+        return self.total / self.n
+
+    def user_means(self):
+        'Mean of every test user; mean() for the ones without ratings'
+        means = np.full(len(self.uIDs), self.mean())
+        rated = self.counts > 0
+        means[rated] = self.sums[rated] / self.counts[rated]
+        return means
+
+def _kind(fn):
+    'Kind of a SOURCE: ingest, split or wide'
+    if os.path.isdir(fn):
+        return 'ingest'
+    with open(fn) as f:
+        header = f.readline()
+    return 'split' if header.lstrip('"').startswith('uID') else 'wide'
+
+def _chunks(sources, chunk_rows=CHUNK_ROWS):
+    """
+    Arguments:
+        - sources: list
+            SOURCEs; see above. Wide CSVs are numbered from uID 1 together,
+            in the order given, as by ingest.py.
+    Returns:
+        - generator of (uIDs, ratings) of every chunk of their ratings, with
+          the +10 shift of cvout undone.
+    """
+    from ingest import read_blocks, shards
+    from cvcache import load_arrays
+
+    kinds = [_kind(fn) for fn in sources]
+    for fn, kind in zip(sources, kinds):
+        if kind == 'ingest':
+            for s in shards(fn):
+                yield np.asarray(s['uID']), np.asarray(s['rating'])
+        elif kind == 'split':
+            cols = load_arrays(fn)
+            for lo in range(0, len(cols['uID']), chunk_rows):
+                yield (np.asarray(cols['uID'][lo:lo + chunk_rows]),
+                       np.asarray(cols['rating'][lo:lo + chunk_rows]))
+
+    wide = [fn for fn, kind in zip(sources, kinds) if kind == 'wide']
+    for uIDs, R in read_blocks(wide):
+        rated = ~np.isnan(R)
+        yield np.repeat(uIDs, rated.sum(1)), R[rated]
+
+def compute(sources, testing300='../data/jester-data-testing.csv',
+            seed=9999):
+    """
+    Arguments:
+        - sources: list
+            SOURCEs to stream the ratings of; see _chunks().
+        - testing300: str, default '../data/jester-data-testing.csv'
+            CSV of the test users; their uIDs are its UserIDs plus 1.
+        - seed: int, default 9999
+            Seed of unif.
+    Returns:
+        - tuple (userIDs, comps) of the sorted UserIDs of testing300, and
+          {'unif', 'tavg', 'uavg'} of the n_test x n_jokes estimates.
+    """
+    true = pd.read_csv(testing300)
+    userIDs = np.sort(true.UserID.values)
+    shape = (len(userIDs), true.shape[1] - 1)
+
+    means = RunningMeans(userIDs + 1)
+    for uIDs, ratings in _chunks(sources):
+        means.update(uIDs, ratings)
+
+    rs = np.random.RandomState(seed)
+    comps = {'unif': rs.uniform(-10, 10, shape),
+             'tavg': np.full(shape, means.mean()),
+             'uavg': np.repeat(means.user_means()[:, np.newaxis], shape[1], 1)}
+    return userIDs, comps
+
+def matrix_csv(fn, userIDs, mtx, decimals):
+    'Write a users x jokes matrix in the format of jester-data-testing.csv'
+    df = pd.DataFrame(np.round(mtx, decimals),
+                      columns=['J{}'.format(j + 1)
+                               for j in range(mtx.shape[1])])
+    df.insert(0, 'UserID', userIDs)
+    df.to_csv(fn, index=False)
+
+def write(out, userIDs, comps):
+    'Write the estimates of compute() as the COMPARE files of format.py'
+    os.makedirs(out, exist_ok=True)
+    for n, mtx in comps.items():
+        matrix_csv(os.path.join(out, FILES[n]), userIDs, mtx, DECIMALS[n])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sources', nargs='+',
+                        help='ingest.py directories, wide CSVs, or cvout '
+                             'split CSVs')
+    parser.add_argument('--testing', default='../data/jester-data-testing.csv',
+                        help='CSV of the test users')
+    parser.add_argument('--out', default='../data')
+    parser.add_argument('--seed', type=int, default=9999)
+    a = parser.parse_args()
+
+    userIDs, comps = compute(a.sources, a.testing, a.seed)
+    write(a.out, userIDs, comps)
+    print('tavg: {:.3f}\tuavg: {:.3f} to {:.3f}'
+          .format(comps['tavg'][0, 0], comps['uavg'].min(),
+                  comps['uavg'].max()))
@@ -0,0 +1,1309 @@
+import os
+import sys
+import time
+import numpy as np
+
+# Benchmarks for the slow parts of the MLP pipeline. Each bench_* function
+#   prints a small table and returns the measurements.
+#
+# `python3 bench.py suite` times the hot paths on synthetic Jester-shaped
+#   data, so it runs without the LFS cvout files; see SUITE. Every run is
+#   saved as JSON in bench/, and compared against bench/baseline.json: a
+#   case whose best time grew by more than the threshold is a regression,
+#   and the exit status is 1. The committed baseline was recorded on the
+#   machine in its 'meta'; timings depend on the machine, so on another one
+#   record a local baseline first with --save-baseline. Without a baseline
+#   the exit status is 2.
+#
+# `python3 bench.py check` runs the equivalence checks of check.py instead.
+
+def bench_pairs(p, n_epoch, workers=(1, 2, 4), threads=None):
+    """
+    Wall-clock time of training all pairs of `p` against the number of
+    worker processes; check.check_pairs() checks that they agree.
+
+    Arguments:
+        - p: int
+            Proportion of training set to run. Must be 30, 60, or 90.
+        - n_epoch: int
+            Number of epochs to train.
+        - workers: tuple, default (1, 2, 4)
+            Worker counts to time.
+        - threads: int, default None
+            Max number of TF/BLAS threads per worker; see run_pairs().
+    Returns:
+        - dict {workers: seconds}
+    """
+    import tempfile
+    from cube import create_cube
+    from train_mlp import pair_prefixes, run_pairs
+
+    pfs = pair_prefixes(p)
+    times = {}
+    for w in workers:
+        with tempfile.TemporaryDirectory() as dn:
+            cube = os.path.join(dn, 'ests.npy')
+            create_cube(cube, n_epoch)
+            t0 = time.perf_counter()
+            run_pairs(pfs, n_epoch, cube, w, threads)
+            times[w] = time.perf_counter() - t0
+        print('workers: {:>2}\ttime: {:8.1f}s\tspeedup: {:5.2f}'
+              .format(w, times[w], times[workers[0]] / times[w]))
+
+    return times
+
+def bench_report(n_repeat=20, seed=9999):
+    """
+    Time of the report of format.py for 300 x 100 estimates, with
+    genReport() against the per-row loops it replaced; check.check_report()
+    checks that both give the same matrices.
+
+    Arguments:
+        - n_repeat: int, default 20
+            Number of reports timed.
+    Returns:
+        - dict {'loop': seconds, 'genReport': seconds} per report
+    """
+    from format import genReport
+    from check import report_loop, synth_report
+
+    ests, true, comps = synth_report(seed)
+    t0 = time.perf_counter()
+    for k in range(n_repeat):
+        report_loop(ests, true, comps)
+    t1 = time.perf_counter()
+    for k in range(n_repeat):
+        genReport(ests, true, comps)
+    t2 = time.perf_counter()
+
+    print('loop: {:.4f}s\tgenReport: {:.4f}s'
+          .format((t1 - t0) / n_repeat, (t2 - t1) / n_repeat))
+    return {'loop': (t1 - t0) / n_repeat, 'genReport': (t2 - t1) / n_repeat}
+
+def synth_ratings(n_rows, n_users=73421, n_jokes=100, seed=9999):
+    """
+    Random training set in the n x 3 (uID, jID, rating) format of cvout.
+    """
+    import pandas as pd
+
+    rs = np.random.RandomState(seed)
+    return pd.DataFrame({'uID': rs.randint(1, n_users + 1, n_rows),
+                         'jID': rs.randint(1, n_jokes + 1, n_rows),
+                         'rating': rs.uniform(-10, 10, n_rows)})
+
+def bench_generator(n_rows=1000000, batch_size=4096, prefetch=(0, 2),
+                    n_pass=3):
+    """
+    Batches/sec of DataGenerator and ArrayGenerator over full epochs;
+    check.check_generator() checks that they give the same batches.
+
+    Arguments:
+        - n_rows: int, default 1000000
+            Number of training ratings.
+        - batch_size: int, default 4096
+            Size of each mini-batch.
+        - prefetch: tuple, default (0, 2)
+            ArrayGenerator prefetch depths to time.
+        - n_pass: int, default 3
+            Number of epochs to iterate for each generator.
+    Returns:
+        - dict {generator name: batches/sec}
+    """
+    from DataGenerator import DataGenerator, ArrayGenerator
+
+    tr = synth_ratings(n_rows)
+    gens = [('DataGenerator', DataGenerator(tr, batch_size))]
+    gens += [('ArrayGenerator(prefetch={})'.format(n),
+              ArrayGenerator(tr, batch_size, prefetch=n)) for n in prefetch]
+
+    rates = {}
+    for name, gen in gens:
+        n = 0
+        t0 = time.perf_counter()
+        for k in range(n_pass):
+            for i in range(len(gen)):
+                gen[i]
+                n += 1
+            gen.on_epoch_end()
+        rates[name] = n / (time.perf_counter() - t0)
+        print('{:<28}{:10.1f} batches/sec'.format(name, rates[name]))
+
+    return rates
+
+def rss_kb(fields=('VmRSS', 'RssAnon', 'RssFile', 'RssShmem')):
+    'Resident memory of this process in kB from /proc/self/status (Linux)'
+    rss = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            k, v = line.split(':', 1)
+            if k in fields:
+                rss[k] = int(v.split()[0])
+    return rss
+
+def _worker_rss(gen):
+    'Iterate a few batches of an unpickled generator; return its memory'
+    for i in range(min(10, len(gen))):
+        gen[i]
+    return rss_kb()
+
+def bench_shared(sizes=(1000000, 4000000, 16000000), batch_size=4096,
+                 max_growth_kb=16384):
+    """
+    Memory of a spawned worker that receives a pickled ArrayGenerator, as the
+    training set grows. The worker's private memory (RssAnon) must not grow
+    with the size, since it attaches to the shared arrays; a copy of the 16M
+    rows would add ~190MB.
+
+    Arguments:
+        - sizes: tuple, default (1M, 4M, 16M)
+            Numbers of training ratings.
+        - batch_size: int, default 4096
+            Size of each mini-batch.
+        - max_growth_kb: int, default 16384
+            Largest RssAnon growth over the smallest size that passes.
+    Returns:
+        - dict {size: worker memory in kB, see rss_kb()}
+    """
+    import multiprocessing as mp
+    from DataGenerator import ArrayGenerator
+
+    out = {}
+    for n in sizes:
+        gen = ArrayGenerator(synth_ratings(n), batch_size)
+        with mp.get_context('spawn').Pool(1) as pool:
+            out[n] = pool.apply(_worker_rss, (gen,))
+        gen.close()
+        print('rows: {:>10}\tworker RssAnon: {:>8} kB\tRssShmem: {:>8} kB'
+              .format(n, out[n].get('RssAnon'), out[n].get('RssShmem')))
+
+    anon = [out[n]['RssAnon'] for n in sizes]
+    assert(max(anon) - anon[0] < max_growth_kb)
+    return out
+
+def bench_cvcache(n_rows=2000000, n_load=5):
+    """
+    Load time of a synthetic split CSV with pd.read_csv against the binary
+    cache of cvcache.py; check.check_cvcache() checks that both load the
+    same ratings.
+
+    Arguments:
+        - n_rows: int, default 2000000
+            Number of ratings in the split.
+        - n_load: int, default 5
+            Number of loads to average over.
+    Returns:
+        - dict {'csv': seconds, 'build': seconds, 'cache': seconds} per load
+    """
+    import tempfile
+    import pandas as pd
+    from cvcache import build, load_split
+
+    out = {}
+    with tempfile.TemporaryDirectory() as dn:
+        fn = os.path.join(dn, '90_1_train.csv')
+        tr = synth_ratings(n_rows)
+        tr.rating = (tr.rating + 10).round(2)   # shifted as in NMF
+        tr.to_csv(fn, index=False)
+
+        t0 = time.perf_counter()
+        for k in range(n_load):
+            df = pd.read_csv(fn)
+            df.rating -= 10
+        t1 = time.perf_counter()
+        build(fn)
+        t2 = time.perf_counter()
+        for k in range(n_load):
+            cached = load_split(fn)
+        t3 = time.perf_counter()
+
+        out = {'csv': (t1 - t0) / n_load, 'build': t2 - t1,
+               'cache': (t3 - t2) / n_load}
+        print('rows: {}\tcsv: {:.3f}s\tbuild: {:.3f}s\tcache: {:.4f}s\t'
+              'speedup: {:.0f}x'
+              .format(n_rows, out['csv'], out['build'], out['cache'],
+                      out['csv'] / out['cache']))
+
+    return out
+
+class SynthModel(object):
+    'Stand-in for a served model: dot products of random embeddings'
+    def __init__(self, n_users=73421, n_jokes=100, dim=16, seed=9999):
+        rng = np.random.RandomState(seed)
+        from vocab import identity
+        self.U = rng.randn(n_users + 1, dim).astype(np.float32)
+        self.J = rng.randn(n_jokes + 1, dim).astype(np.float32)
+        self.vocabs = identity(n_users + 1, n_jokes + 1)  # IDs start from 1
+
+    def predict(self, X, batch_size=None):
+        uIDs, jIDs = X
+        return np.sum(self.U[uIDs] * self.J[jIDs], 1, keepdims=True)
+
+def bench_serve(url=None, n_requests=5000, concurrency=8, n_users=1000,
+                n=10):
+    """
+    Load test of the recommendation service of serve.py: p50/p99 latency and
+    requests/sec of `concurrency` clients on keep-alive connections.
+
+    Arguments:
+        - url: str, default None
+            URL of a running service, e.g. 'http://127.0.0.1:8000'. None
+            serves a SynthModel in this process.
+        - n_requests: int, default 5000
+            Total number of requests.
+        - concurrency: int, default 8
+            Number of client threads.
+        - n_users: int, default 1000
+            Number of distinct uIDs requested, uniformly at random; fewer
+            users means more cache hits.
+        - n: int, default 10
+            Number of jokes per request.
+    Returns:
+        - dict {'p50', 'p99', 'mean'} in ms, {'rps'}, and {'errors'}.
+    """
+    import threading
+    import http.client
+    from urllib.parse import urlparse
+
+    server = None
+    if url is None:
+        from serve import Recommender, start
+        server = start(Recommender(None, load=lambda fn: SynthModel()))
+        url = 'http://{}:{}'.format(*server.server_address)
+    host = urlparse(url).netloc
+
+    uIDs = np.random.RandomState(9999).randint(1, n_users + 1, n_requests)
+    lat = np.zeros(n_requests)
+    errors = []
+
+    def client(k):
+        conn = http.client.HTTPConnection(host)
+        for i in range(k, n_requests, concurrency):
+            t0 = time.perf_counter()
+            conn.request('GET', '/recommend?uid={}&n={}'.format(uIDs[i], n))
+            res = conn.getresponse()
+            res.read()
+            lat[i] = time.perf_counter() - t0
+            if res.status != 200:
+                errors.append(res.status)
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(k,))
+               for k in range(concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    if server is not None:
+        server.shutdown()
+
+    out = {'p50': np.percentile(lat, 50) * 1000,
+           'p99': np.percentile(lat, 99) * 1000,
+           'mean': lat.mean() * 1000, 'rps': n_requests / elapsed,
+           'errors': len(errors)}
+    print('requests: {}\tclients: {}\tusers: {}\tp50: {:.2f}ms\t'
+          'p99: {:.2f}ms\trps: {:.0f}\terrors: {}'
+          .format(n_requests, concurrency, n_users, out['p50'], out['p99'],
+                  out['rps'], out['errors']))
+
+    return out
+
+def synth_npmlp(dn, n_users=73421, n_jokes=100, layer_sizes=[(16, 3), 200, 100],
+                seed=9999):
+    'Write an npmlp export with random weights of the default Mlp shape'
+    from npmlp import save
+
+    rng = np.random.RandomState(seed)
+    du, dj = layer_sizes[0]
+    sizes = [du + dj] + list(layer_sizes[1:]) + [1]
+    dense = [{'W': rng.randn(a, b) / np.sqrt(a), 'b': rng.randn(b) * .1,
+              'acts': [['leaky_relu', .3]]}
+             for a, b in zip(sizes, sizes[1:])]
+    dense[-1]['acts'] = []
+    save(dn, rng.randn(n_users + 1, du), rng.randn(n_jokes + 1, dj), dense)
+
+def _import_time(module):
+    'Seconds to start a fresh interpreter and import `module`'
+    import subprocess
+    t0 = time.perf_counter()
+    subprocess.check_call([sys.executable, '-c', 'import ' + module],
+                          stderr=subprocess.DEVNULL)
+    return time.perf_counter() - t0
+
+def bench_npmlp(fn=None, n_users=10000, batch_size=65536):
+    """
+    Import time and all jokes x n_users prediction time of the NumPy export
+    of npmlp.py against Keras, and the largest difference of their
+    predictions, which must be under 1e-4. check.check_export() checks the
+    BatchNormalization folding of export() without keras.
+
+    Arguments:
+        - fn: str, default None
+            .h5 file of a trained Mlp.model. None times the NumPy side only,
+            on random weights.
+        - n_users: int, default 10000
+            Number of users to score all jokes of.
+        - batch_size: int, default 65536
+            Batch size of both predict()s.
+    Returns:
+        - dict of seconds, and 'max_diff' when `fn` is given.
+    """
+    import tempfile
+    from npmlp import NpMlp, export
+
+    out = {'import_numpy': _import_time('npmlp')}
+    with tempfile.TemporaryDirectory() as dn:
+        if fn is None:
+            synth_npmlp(dn)
+        else:
+            export(fn, dn)
+        m = NpMlp(dn)
+        uIDs = m.vocabs['uID'].ids[:n_users]
+        jIDs = m.vocabs['jID'].ids
+        X = [np.repeat(uIDs, len(jIDs)), np.tile(jIDs, len(uIDs))]
+
+        t0 = time.perf_counter()
+        pred = m.predict(X, batch_size)
+        t1 = time.perf_counter()
+        grid = m.predict_grid(uIDs, jIDs, batch_size)
+        t2 = time.perf_counter()
+        out.update({'numpy': t1 - t0, 'numpy_grid': t2 - t1})
+        assert(np.allclose(pred.reshape(grid.shape), grid, atol=1e-4))
+
+        if fn is not None:
+            import keras
+            out['import_keras'] = _import_time('keras')
+            model = keras.models.load_model(fn)
+            t0 = time.perf_counter()
+            ref = model.predict(X, batch_size=batch_size)
+            out['keras'] = time.perf_counter() - t0
+            out['max_diff'] = float(np.abs(ref - pred).max())
+            assert(out['max_diff'] < 1e-4)
+
+    print('  '.join('{}: {:.4g}'.format(k, v) for k, v in out.items()))
+    return out
+
+def pss_kb():
+    'Proportional set size of this process in kB; shared pages are split'
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1])
+
+def _quant_worker(dn, mmap, barrier, q):
+    from npmlp import NpMlp
+    before = pss_kb()
+    m = NpMlp(dn, mmap)
+    # Touch every row, as a worker scoring all users would
+    m.lookup(np.arange(m.n_users), np.arange(m.n_jokes))
+    barrier.wait()     # measure while every worker has the model open
+    q.put(pss_kb() - before)
+    barrier.wait()
+
+def bench_quant(fn=None, n_users=10000, workers=4):
+    """
+    Memory and latency of the float and quantized exports of npmlp.py, and
+    how far their predictions are from the float export's.
+
+    Memory is the increase of the total PSS of `workers` processes that
+    each open the export, so a memory mapped table shared by all of them
+    counts once.
+
+    Arguments:
+        - fn: str, default None
+            .h5 file of a trained Mlp.model. None uses random weights.
+        - n_users: int, default 10000
+            Number of users to score all jokes of.
+        - workers: int, default 4
+            Number of processes that open the export at the same time.
+    Returns:
+        - dict {config: {'pss_kb', 'seconds', 'max_diff', 'mean_diff'}}
+    """
+    import tempfile
+    import multiprocessing as mp
+    from npmlp import NpMlp, export, quantize
+
+    out = {}
+    with tempfile.TemporaryDirectory() as dn:
+        fdn = os.path.join(dn, 'float32')
+        if fn is None:
+            synth_npmlp(fdn)
+        else:
+            export(fn, fdn)
+        quantize(fdn, os.path.join(dn, 'int8'), 'int8')
+        quantize(fdn, os.path.join(dn, 'int8_f16'), 'float16')
+
+        ref = None
+        for name, mmap in [('float32', False), ('float32', True),
+                           ('int8', True), ('int8_f16', True)]:
+            path = os.path.join(dn, name)
+            ctx = mp.get_context('spawn')
+            barrier, q = ctx.Barrier(workers), ctx.Queue()
+            procs = [ctx.Process(target=_quant_worker,
+                                 args=(path, mmap, barrier, q))
+                     for k in range(workers)]
+            for p in procs:
+                p.start()
+            pss = sum(q.get() for p in procs)
+            for p in procs:
+                p.join()
+
+            m = NpMlp(path, mmap)
+            uIDs = m.vocabs['uID'].ids[:n_users]
+            t0 = time.perf_counter()
+            pred = m.predict_grid(uIDs)
+            t = time.perf_counter() - t0
+            ref = pred if ref is None else ref
+            diff = np.abs(pred - ref)
+
+            key = name + ('_mmap' if mmap else '')
+            out[key] = {'pss_kb': pss, 'seconds': t,
+                        'max_diff': float(diff.max()),
+                        'mean_diff': float(diff.mean())}
+            print('{:<14}workers: {}\tPSS: {:7d} kB\tpredict: {:.3f}s\t'
+                  'max diff: {:.4f}\tmean diff: {:.5f}'
+                  .format(key, workers, pss, t, diff.max(), diff.mean()))
+
+    return out
+
+def bench_vocab(n_users=5000, n_rows=1000000, dim=16, n_steps=20):
+    """
+    Embedding rows and Adam step time of the uID embedding, sized by the
+    largest uID or by the vocabulary of vocab.py, on a split of `n_users`
+    random users out of all 73,421. Keras 2's Adam updates its moment tables
+    densely, so each step touches every row; the step is timed in NumPy.
+
+    Arguments:
+        - n_users: int, default 5000
+            Number of users in the split.
+        - n_rows: int, default 1000000
+            Number of ratings in the split.
+        - dim: int, default 16
+            Embedding dimension.
+        - n_steps: int, default 20
+            Number of Adam steps timed.
+    Returns:
+        - dict {'max_id', 'vocab'} of (rows, seconds per step), and
+          'transform', the seconds of vocab.transform() of the split.
+    """
+    import vocab
+
+    rs = np.random.RandomState(9999)
+    users = np.sort(rs.choice(73421, n_users, replace=False) + 1)
+    tr = synth_ratings(n_rows)
+    tr['uID'] = users[rs.randint(n_users, size=n_rows)]
+
+    t0 = time.perf_counter()
+    vocabs = vocab.fit(tr)
+    vocab.transform(tr, vocabs)
+    out = {'transform': time.perf_counter() - t0}
+
+    def adam_step(rows):
+        w, m, v = [np.zeros((rows, dim), np.float32) for _ in range(3)]
+        g = np.full((rows, dim), 1e-3, np.float32)
+        t0 = time.perf_counter()
+        for _ in range(n_steps):
+            m *= 0.9
+            m += 0.1 * g
+            v *= 0.999
+            v += 0.001 * g * g
+            w -= 0.1 * m / (np.sqrt(v) + 1e-7)
+        return (time.perf_counter() - t0) / n_steps
+
+    for name, rows in [('max_id', tr['uID'].max() + 1),
+                       ('vocab', len(vocabs['uID']))]:
+        out[name] = (int(rows), adam_step(rows))
+        print('{}: {} rows, {} params with Adam state, {:.2f}ms per step'
+              .format(name, rows, 3 * rows * dim, 1000 * out[name][1]))
+    print('transform: {:.3f}s'.format(out['transform']))
+
+    return out
+
+def bench_sweep(n_configs=81, max_epoch=81, eta=3, seed=9999):
+    """
+    Epochs trained and best MAE found by the Hyperband sweep of sweep.py
+    against a grid search that trains every config for max_epoch epochs,
+    on simulated learning curves: each config decays to its own final MAE
+    at its own rate, with noise.
+
+    Arguments:
+        - n_configs: int, default 81
+            Size of the grid.
+        - max_epoch: int, default 81
+            Epochs of a full training run.
+        - eta: int, default 3
+            See sweep.successive_halving().
+        - seed: int, default 9999
+    Returns:
+        - dict {'grid', 'sweep'} of (best MAE, epochs trained).
+    """
+    from sweep import hyperband
+
+    rng = np.random.RandomState(seed)
+    final = 0.8 + 0.15 * rng.rand(n_configs)
+    tau = 3 + 20 * rng.rand(n_configs)
+    noise = 0.003 * rng.randn(n_configs, max_epoch)
+
+    def curve(c, epochs):
+        e = np.arange(epochs)
+        return final[c] + 0.6 * np.exp(-e / tau[c]) + noise[c, :epochs]
+
+    trained = {}
+    def run(trials, epochs):
+        for t in trials:
+            trained[t['trial']] = epochs   # trials continue between rungs
+        return [curve(t['config']['c'], epochs) for t in trials]
+
+    best = hyperband({'c': list(range(n_configs))}, 1, max_epoch, eta, run)
+    grid = min(curve(c, max_epoch).min() for c in range(n_configs))
+
+    out = {'grid': (grid, n_configs * max_epoch),
+           'sweep': (best['mae'], sum(trained.values()))}
+    print('grid: MAE {:.4f} in {} epochs\tsweep: MAE {:.4f} in {} epochs '
+          '({:.0%} of the grid)'
+          .format(out['grid'][0], out['grid'][1], out['sweep'][0],
+                  out['sweep'][1], out['sweep'][1] / out['grid'][1]))
+
+    return out
+
+def synth_wide(dn, n_users, n_jokes=100, seed=9999):
+    """
+    Random wide Jester CSV of `n_users` users, each rating 15 to all of the
+    jokes, and a jester-data-testing.csv of 300 of them who rated every joke.
+
+    Returns:
+        - tuple (csv, testing300) of their paths.
+    """
+    import pandas as pd
+
+    rs = np.random.RandomState(seed)
+    R = np.round(rs.uniform(-10, 10, (n_users, n_jokes)), 2)
+    n_rated = rs.randint(15, n_jokes + 1, n_users)
+    test = np.sort(rs.choice(n_users, 300, replace=False))
+    n_rated[test] = n_jokes
+    unrated = np.argsort(rs.rand(n_users, n_jokes), 1) >= n_rated[:, None]
+    R[unrated] = 99
+
+    csv = os.path.join(dn, 'jester-data-1.csv')
+    pd.DataFrame(np.hstack([n_rated[:, None], R])).to_csv(
+        csv, header=False, index=False)
+    testing300 = os.path.join(dn, 'jester-data-testing.csv')
+    df = pd.DataFrame(R[test], columns=['J{}'.format(j + 1)
+                                        for j in range(n_jokes)])
+    df.insert(0, 'UserID', test)    # UserIDs start from 0
+    df.to_csv(testing300, index=False)
+    return csv, testing300
+
+def cv_loop(csv, testuIDs, p, seed=9999):
+    """
+    Port of nmf/CV.R's loop over users, appending to lists instead of
+    rbind(), for comparison with cvsplit.py.
+
+    Returns:
+        - list of (train, test) lists of (uID, jID, rating) of every pair.
+    """
+    import pandas as pd
+    from cvsplit import N_PAIRS
+    from ingest import UNRATED
+
+    rs = np.random.RandomState(seed)
+    R = pd.read_csv(csv, header=None).values[:, 1:]
+    testuIDs = set(testuIDs.tolist())
+    n_pairs = N_PAIRS[p]
+    pairs = [([], []) for _ in range(n_pairs)]
+    for u in range(len(R)):
+        jIDs = np.flatnonzero(R[u] != UNRATED)
+        rows = [(u + 1, j + 1, R[u, j] + 10) for j in jIDs]
+        n_rated = len(rows)
+        if p < 50:
+            n_train = int(round(p / 100. * n_rated))
+            idx = rs.permutation(n_rated)
+            train1, train2 = idx[:n_train], idx[n_train:2 * n_train]
+            pairs[0][0].extend(rows[i] for i in sorted(train1))
+            pairs[1][0].extend(rows[i] for i in sorted(train2))
+            if u + 1 in testuIDs:
+                in1 = set(train1.tolist())
+                pairs[0][1].extend(r for i, r in enumerate(rows)
+                                   if i not in in1)
+                pairs[1][1].extend(rows[i] for i in sorted(train1))
+            continue
+        n_test = int(np.floor(round((1 - p / 100.) * 100 * n_rated + 50, 2)
+                              / 100))
+        for j in range(n_pairs):
+            held = ([i for i in range(n_rated) if (i + 1) % n_pairs == j]
+                    if u + 1 in testuIDs else [])
+            pool = [i for i in range(n_rated) if i not in held]
+            train = rs.choice(pool, n_rated - n_test, replace=False)
+            pairs[j][0].extend(rows[i] for i in sorted(train))
+            pairs[j][1].extend(rows[i] for i in held)
+    return pairs
+
+def bench_cvsplit(n_users=20000, ps=(30, 60, 90), seed=9999):
+    """
+    Time of cvsplit.split() against cv_loop() on a synth_wide() CSV, and
+    checks of the splits it wrote: their sizes are the ones of CV.R, the
+    training sets of p = 30 are disjoint, the test sets of p = 60, 90
+    partition the test users' ratings, and a second run with the same seed
+    writes the same files.
+
+    Arguments:
+        - n_users: int, default 20000
+            Number of users.
+        - ps: tuple, default (30, 60, 90)
+        - seed: int, default 9999
+    Returns:
+        - dict {'split', 'loop'} of seconds, and 'rows', the number of rows
+          written.
+    """
+    import tempfile
+    import filecmp
+    import pandas as pd
+    import cvsplit
+    from ingest import UNRATED
+
+    with tempfile.TemporaryDirectory() as dn:
+        csv, testing300 = synth_wide(dn, n_users, seed=seed)
+        testuIDs = pd.read_csv(testing300).UserID.values + 1
+        n_rated = (pd.read_csv(csv, header=None).values[:, 1:]
+                   != UNRATED).sum(1)
+
+        out = {}
+        for run in ['a', 'b']:
+            r = cvsplit.split([csv], testing300, os.path.join(dn, run), ps,
+                              seed)
+        out['split'], out['rows'] = r['seconds'], r['rows']
+        fns = sorted(os.listdir(os.path.join(dn, 'a')))
+        assert(not filecmp.cmpfiles(os.path.join(dn, 'a'),
+                                    os.path.join(dn, 'b'), fns,
+                                    shallow=False)[1])
+
+        is_test = np.isin(np.arange(1, n_users + 1), testuIDs)
+        for p in ps:
+            pairs = [[pd.read_csv(os.path.join(dn, 'a', '{}_{}_{}.csv'
+                                               .format(p, i + 1, kind)))
+                      for kind in ['train', 'test']]
+                     for i in range(cvsplit.N_PAIRS[p])]
+            if p < 50:
+                n_train = np.round(p / 100. * n_rated)
+            else:
+                n_train = n_rated - np.floor(
+                    np.round((1 - p / 100.) * 100 * n_rated + 50, 2) / 100)
+            for train, test in pairs:
+                counts = np.bincount(train.uID, minlength=n_users + 1)[1:]
+                assert((counts == n_train).all())
+                assert(set(test.uID) <= set(testuIDs))
+            # Pairs of p = 30 have disjoint training sets; the test sets of
+            #   every p partition the test users' ratings
+            trains = [set(zip(tr.uID, tr.jID)) for tr, _ in pairs]
+            tests = [set(zip(te.uID, te.jID)) for _, te in pairs]
+            assert(not any(tr & te for tr, te in zip(trains, tests)))
+            if p < 50:
+                assert(not trains[0] & trains[1])
+            assert(sum(map(len, tests)) == len(set.union(*tests))
+                   == n_rated[is_test].sum())
+
+        # The loop, with its sets written as CV.R's CV_2csv() does
+        t0 = time.perf_counter()
+        for p in ps:
+            for i, sets in enumerate(cv_loop(csv, testuIDs, p, seed)):
+                for kind, rows in zip(['train', 'test'], sets):
+                    with open(os.path.join(dn, '{}_{}_{}.csv'
+                                           .format(p, i + 1, kind)), 'w') as f:
+                        f.write('"uID","jID","rating"\n')
+                        f.write(''.join('{},{},{:.2f}\n'.format(*r)
+                                        for r in rows))
+        out['loop'] = time.perf_counter() - t0
+
+    print('users: {}\trows: {}\tsplit: {:.2f}s\tloop: {:.2f}s ({:.0f}x)'
+          .format(n_users, out['rows'], out['split'], out['loop'],
+                  out['loop'] / out['split']))
+    return out
+
+def _ingest_worker(csv, out, block_users):
+    'ingest.ingest() in a fresh process; return its peak memory in kB'
+    from ingest import ingest
+
+    ingest([csv], out, block_users)
+    # Not getrusage(), whose peak is kept across the exec of the worker
+    return rss_kb(('VmHWM',))['VmHWM']
+
+def bench_ingest(sizes=(20000, 80000), block_users=10000,
+                 max_growth_kb=16384):
+    """
+    Rows/sec and peak memory of ingest.py on synth_wide() CSVs of growing
+    size, each in a spawned process. The peak must not grow with the size,
+    as only one block is in memory; check.check_ingest() checks the shards.
+
+    Arguments:
+        - sizes: tuple, default (20000, 80000)
+            Numbers of users.
+        - block_users: int, default 10000
+            See ingest.ingest().
+        - max_growth_kb: int, default 16384
+            Largest peak growth over the smallest size that passes.
+    Returns:
+        - dict {n_users: (rows/sec, peak memory in kB)}
+    """
+    import tempfile
+    import multiprocessing as mp
+
+    out = {}
+    with tempfile.TemporaryDirectory() as dn:
+        for n in sizes:
+            csv, _ = synth_wide(dn, n)
+            t0 = time.perf_counter()
+            with mp.get_context('spawn').Pool(1) as pool:
+                peak = pool.apply(_ingest_worker, (csv, os.path.join(dn, 'i'),
+                                                   block_users))
+            out[n] = (n / (time.perf_counter() - t0), peak)
+            print('users: {:>8}\t{:8.0f} rows/sec\tpeak RSS: {:8.1f} MB'
+                  .format(n, out[n][0], peak / 1024))
+
+    peaks = [out[n][1] for n in sizes]
+    assert(max(peaks) - peaks[0] < max_growth_kb)
+    return out
+
+def bench_baselines(n_rows=10000000, chunk_rows=1000000):
+    """
+    Time of the tavg and uavg estimates of the 300 test users by
+    baselines.RunningMeans over chunks of a training set, against a
+    group-by of the whole table; check.check_baselines() checks that both
+    agree.
+
+    Arguments:
+        - n_rows: int, default 10000000
+            Number of ratings.
+        - chunk_rows: int, default 1000000
+            Ratings per chunk.
+    Returns:
+        - dict {'groupby': seconds, 'running': seconds}
+    """
+    from baselines import RunningMeans
+
+    tr = synth_ratings(n_rows)
+    uIDs = np.sort(np.random.RandomState(0).choice(tr.uID.unique(), 300,
+                                                    replace=False))
+
+    t0 = time.perf_counter()
+    ref = (tr.rating.mean(), tr.groupby('uID').rating.mean().loc[uIDs].values)
+    t1 = time.perf_counter()
+    means = RunningMeans(uIDs)
+    u, r = tr.uID.values, tr.rating.values
+    for lo in range(0, n_rows, chunk_rows):
+        means.update(u[lo:lo + chunk_rows], r[lo:lo + chunk_rows])
+    out = (means.mean(), means.user_means())
+    t2 = time.perf_counter()
+
+    print('rows: {}\tgroupby: {:.2f}s\trunning: {:.2f}s'
+          .format(n_rows, t1 - t0, t2 - t1))
+    return {'groupby': t1 - t0, 'running': t2 - t1}
+
+def bench_evaluate(n_epoch=150, chunk_epochs=(1, 8, 32)):
+    """
+    Time of the per-epoch metrics of evaluate.py over an epoch cube, against
+    a loop that takes each epoch's absolute errors and ternary categories as
+    format.py does; check.check_evaluate() checks that both agree.
+
+    Arguments:
+        - n_epoch: int, default 150
+            Number of epochs of the cube.
+        - chunk_epochs: tuple, default (1, 8, 32)
+            Chunk sizes to time.
+    Returns:
+        - dict {'loop': seconds, chunk_epochs: seconds}
+    """
+    import tempfile
+    from cube import create_cube
+    from evaluate import evaluate
+    from check import evaluate_loop
+
+    rs = np.random.RandomState(9999)
+    true = np.round(rs.uniform(-10, 10, (300, 100)), 2)
+    out = {}
+    with tempfile.TemporaryDirectory() as dn:
+        fn = os.path.join(dn, 'ests.npy')
+        cube = create_cube(fn, n_epoch)
+        cube[:] = true + rs.randn(*cube.shape) * np.linspace(
+            6, 3, n_epoch)[:, None, None]
+        cube.flush()
+
+        t0 = time.perf_counter()
+        evaluate_loop(fn, true)
+        out['loop'] = time.perf_counter() - t0
+
+        for k in chunk_epochs:
+            t0 = time.perf_counter()
+            evaluate(fn, true, k)
+            out[k] = time.perf_counter() - t0
+            print('chunk: {:>3}\t{:.3f}s\tloop: {:.3f}s'
+                  .format(k, out[k], out['loop']))
+
+    return out
+
+def bench_ranking(n_jokes=10000, n_users=300, n_models=8, k=10):
+    """
+    Time of the top-k ranking metrics of ranking.py, taking the top k with
+    np.argpartition, against ranking every joke with a full argsort as
+    format.py does; check.check_ranking() checks that both agree.
+
+    Arguments:
+        - n_jokes: int, default 10000
+            Size of the catalog.
+        - n_users: int, default 300
+        - n_models: int, default 8
+            Number of estimates ranked at once, e.g. epochs.
+        - k: int, default 10
+    Returns:
+        - dict {'argsort': seconds, 'argpartition': seconds}
+    """
+    from ranking import RELEVANT, user_metrics
+    from check import ranking_sort
+
+    rs = np.random.RandomState(9999)
+    true = np.round(rs.uniform(-10, 10, (n_users, n_jokes)), 2)
+    ests = true + rs.randn(n_models, n_users, n_jokes) * 5
+
+    t0 = time.perf_counter()
+    ranking_sort(ests, true, k, RELEVANT)
+    t1 = time.perf_counter()
+    user_metrics(ests, true, k, RELEVANT)
+    t2 = time.perf_counter()
+
+    print('jokes: {}\tk: {}\targsort: {:.2f}s\targpartition: {:.2f}s'
+          .format(n_jokes, k, t1 - t0, t2 - t1))
+    return {'argsort': t1 - t0, 'argpartition': t2 - t1}
+
+def score_loop(m, n):
+    """
+    Top n jIDs and scores of every user of a model, scored and ranked one
+    user at a time as serve.py does, for comparison with score_all.py.
+    """
+    from serve import top_n
+
+    jIDs = m.vocabs['jID'].ids
+    top, scores = [], []
+    for uID in m.vocabs['uID'].ids:
+        s = m.predict([np.full(len(jIDs), uID), jIDs]).ravel()
+        idx = top_n(s, n)
+        top.append(jIDs[idx])
+        scores.append(s[idx])
+    return np.array(top), np.array(scores)
+
+def bench_score_all(n_users=73421, workers=(1, 2), n=10):
+    """
+    Time of score_all.py over every user of a random npmlp export, against
+    score_loop(), and of resuming the last run after removing one of its
+    shards; check.check_score_all() checks that they agree.
+
+    Arguments:
+        - n_users: int, default 73421
+        - workers: tuple, default (1, 2)
+            Numbers of worker processes to time.
+        - n: int, default 10
+            Number of jokes recommended to every user.
+    Returns:
+        - dict {'loop': seconds, workers: seconds, 'resume': seconds}
+    """
+    import shutil
+    import tempfile
+    from npmlp import NpMlp
+    from score_all import score_all, shard_path
+
+    out = {}
+    with tempfile.TemporaryDirectory() as dn:
+        model = os.path.join(dn, 'model')
+        synth_npmlp(model, n_users)
+
+        t0 = time.perf_counter()
+        score_loop(NpMlp(model), n)
+        out['loop'] = time.perf_counter() - t0
+
+        res = os.path.join(dn, 'scores')
+        for w in workers:
+            meta = score_all(model, res, n=n, workers=w)
+            out[w] = meta['seconds']
+            print('workers: {}\t{:.2f}s\t{:.0f} users/sec\tloop: {:.2f}s'
+                  .format(w, out[w], meta['users_per_sec'], out['loop']))
+
+        shutil.rmtree(shard_path(res, 1))
+        meta = score_all(model, res, n=n, resume=True)
+        out['resume'] = meta['seconds']
+        print('resume: {} users\t{:.2f}s'.format(meta['scored'],
+                                                 out['resume']))
+
+    return out
+
+# Sizes of the synthetic data of the suite: a 90% split has ~1.5M training
+#   and ~2,400 validation ratings of the 300 test users; the 30% split has
+#   21,000.
+SUITE_ROWS = 1000000
+SUITE_VAL = 21000
+SUITE_EPOCHS = 10
+BENCH_DIR = 'bench'
+BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+def synth_val(n_rows=SUITE_VAL, n_users=300, n_jokes=100, seed=9999):
+    """
+    Random validation set of `n_users` test users, with no (uID, jID)
+    repeated, like a cvout test split.
+    """
+    import pandas as pd
+
+    rs = np.random.RandomState(seed)
+    uIDs = np.sort(rs.choice(73421, n_users, replace=False) + 1)
+    cells = rs.choice(n_users * n_jokes, n_rows, replace=False)
+    return pd.DataFrame({'uID': uIDs[cells // n_jokes],
+                         'jID': cells % n_jokes + 1,
+                         'rating': rs.uniform(-10, 10, n_rows)})
+
+def synth_format(dn, p=90, n_epoch=SUITE_EPOCHS, ts='bench', seed=9999):
+    """
+    Write the inputs of format.main() to `dn`: the run's pkl/ files, with
+    an epoch cube, and the true ratings and comparison estimates of 300
+    test users.
+
+    Returns:
+        - tuple (testing300, comps) of the paths of the true ratings and the
+          format.COMPARE of the comparison estimates.
+    """
+    import pickle
+    import pandas as pd
+    from cube import create_cube
+    from cvcache import pair_prefixes
+
+    rs = np.random.RandomState(seed)
+    uIDs = np.sort(rs.choice(73421, 300, replace=False) + 1)
+    cols = ['J{}'.format(j) for j in range(1, 101)]
+
+    def write(fn, mtx):
+        df = pd.DataFrame(np.round(mtx, 2), columns=cols)
+        df.insert(0, 'UserID', uIDs)
+        df.to_csv(fn, index=False)
+        return fn
+
+    testing300 = write(os.path.join(dn, 'testing.csv'),
+                       rs.uniform(-10, 10, (300, 100)))
+    comps = {n: write(os.path.join(dn, 'compare_{}.csv'.format(n)),
+                      rs.uniform(-10, 10, (300, 100)))
+             for n in ['unif', 'tavg', 'uavg']}
+
+    os.makedirs(os.path.join(dn, 'pkl'), exist_ok=True)
+    n_pairs = len(pair_prefixes(p))
+    for name in ['mae_tr', 'mae_va']:
+        fn = os.path.join(dn, 'pkl', '{}_{}_{}_{}.pkl'
+                          .format(name, p, n_epoch, ts))
+        with open(fn, 'wb') as f:
+            pickle.dump(rs.uniform(0.7, 1, (n_pairs, n_epoch)), f)
+    cube = create_cube(os.path.join(dn, 'pkl', 'ests_{}_{}_{}.npy'
+                                    .format(p, n_epoch, ts)), n_epoch)
+    cube[:] = rs.uniform(-10, 10, cube.shape)
+    cube.flush()
+
+    return testing300, comps
+
+class _StubMlp(object):
+    'Mlp with a validation set and a predict() that does no work'
+    def __init__(self, va):
+        self.va = va
+        self.preds = np.zeros((len(va), 1), np.float32)
+
+    def predict(self, X, batch_size=None):
+        return self.preds
+
+def suite_generator(dn):
+    'One epoch of batches of DataGenerator and ArrayGenerator'
+    from DataGenerator import DataGenerator, ArrayGenerator
+
+    tr = synth_ratings(SUITE_ROWS)
+    gens = {'DataGenerator': DataGenerator(tr, 4096, True),
+            'ArrayGenerator': ArrayGenerator(tr, 4096, True)}
+
+    def epoch(gen):
+        for i in range(len(gen)):
+            gen[i]
+        gen.on_epoch_end()
+
+    return {name: (lambda gen=gen: epoch(gen)) for name, gen in gens.items()}
+
+def suite_train(dn):
+    'One Mlp.train_model epoch with the default arguments of train_mlp'
+    from mlp import Mlp
+    from train_mlp import MLP_ARGS
+
+    m = Mlp(synth_ratings(SUITE_ROWS), synth_val(), verbose_fit=0,
+            **MLP_ARGS)
+    m.new_model()
+    m.train_model(1)    # compile outside of the timing
+    epochs = iter(range(1, 1000))
+
+    def epoch():
+        e = next(epochs)
+        m.train_model(e + 1, initial_epoch=e)
+
+    return {'epoch': epoch}
+
+def suite_save_results(dn):
+    """
+    SaveResults.on_epoch_end() around a predict() that does no work: finding
+    the cells of the validation set and writing them to the cube.
+    """
+    from cube import create_cube, open_cube
+    from train_mlp import SaveResults
+
+    va = synth_val()
+    uIDs = np.unique(va.uID.values)
+    cube = os.path.join(dn, 'ests.npy')
+    create_cube(cube, SUITE_EPOCHS, len(uIDs))
+    mae = np.zeros([1, SUITE_EPOCHS])
+    logs = {'mean_absolute_error': 0., 'val_mean_absolute_error': 0.}
+    cb = SaveResults(open_cube(cube, 'r+'), mae, mae, uIDs, 0, _StubMlp(va))
+    epochs = iter(range(1000000))
+
+    def on_epoch_end():
+        cb.on_epoch_end(next(epochs) % SUITE_EPOCHS, logs)
+
+    return {'on_epoch_end': on_epoch_end}
+
+def suite_cube(dn, n_epoch=150):
+    """
+    The epoch cube that replaced the ests3 -> ests pivot, over the 150
+    epochs of a default run: SaveResults' writes of a validation set's
+    estimates to every epoch, and the load_epochs() of all of them, as
+    format.main() loads them to select an epoch.
+    """
+    from cube import create_cube, open_cube, load_epochs
+    from pivot import row_index
+
+    va = synth_val()
+    uIDs = np.unique(va.uID.values)
+    fn = os.path.join(dn, 'ests.npy')
+    create_cube(fn, n_epoch, len(uIDs))
+    cube = open_cube(fn, 'r+')
+    # Cells of the validation set, found once as in SaveResults.__init__
+    cells = (row_index(uIDs, va.uID.values), va.jID.values - 1)
+    preds = np.random.RandomState(9999).uniform(-10, 10, len(va))
+
+    def write():
+        for n in range(n_epoch):
+            cube[(n,) + cells] = preds
+            cube.flush()
+
+    return {'write': write,
+            'load_epochs': lambda: load_epochs(fn, slice(None))}
+
+def suite_format(dn):
+    'format.main() of a 90% run, CSVs and report.npz'
+    import format
+
+    testing300, comps = synth_format(dn)
+
+    def main():
+        cwd, compare = os.getcwd(), dict(format.COMPARE)
+        os.chdir(dn)
+        format.COMPARE.update(comps)
+        try:
+            format.main(90, SUITE_EPOCHS, 'bench', testing300)
+        finally:
+            format.COMPARE.update(compare)
+            os.chdir(cwd)
+
+    return {'main': main}
+
+# Cases of the suite: functions of a scratch directory that set up a case
+#   and return {metric: function to time}.
+SUITE = {'generator': suite_generator,
+         'train': suite_train,
+         'save_results': suite_save_results,
+         'cube': suite_cube,
+         'format': suite_format}
+
+def run_suite(names=None, repeat=5):
+    """
+    Time every case of SUITE.
+
+    Arguments:
+        - names: list, default None
+            Cases to run. None runs all of them.
+        - repeat: int, default 5
+            Number of timed calls of each metric, after one warm-up call.
+    Returns:
+        - dict {'meta': {...}, 'results': {'case.metric': {'min', 'median',
+          'runs'}}} in seconds; a case that cannot run, e.g. for lack of
+          tensorflow, has {'skipped': reason} instead.
+    """
+    import tempfile
+    import platform
+
+    results = {}
+    for name in names or list(SUITE):
+        with tempfile.TemporaryDirectory() as dn:
+            try:
+                fns = SUITE[name](dn)
+            except ImportError as e:
+                results[name] = {'skipped': str(e)}
+                print('{:<28}skipped: {}'.format(name, e))
+                continue
+            for metric, fn in fns.items():
+                fn()
+                runs = []
+                for k in range(repeat):
+                    t0 = time.perf_counter()
+                    fn()
+                    runs.append(time.perf_counter() - t0)
+                key = '{}.{}'.format(name, metric)
+                results[key] = {'min': min(runs),
+                                'median': float(np.median(runs)),
+                                'runs': runs}
+                print('{:<28}min: {:9.4f}s\tmedian: {:9.4f}s'
+                      .format(key, min(runs), np.median(runs)))
+
+    meta = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'node': platform.node(),
+            'cpus': os.cpu_count(), 'repeat': repeat}
+    return {'meta': meta, 'results': results}
+
+def compare_suite(run, baseline, threshold=1.2):
+    """
+    Arguments:
+        - run, baseline: dict
+            Results of run_suite().
+        - threshold: float, default 1.2
+            Largest ratio of a metric's best time to the baseline's that is
+            not a regression.
+    Returns:
+        - list of the metrics that regressed.
+    """
+    regressed = []
+    print('{:<28}{:>10}{:>10}{:>8}'.format('', 'baseline', 'run', 'ratio'))
+    for key, r in sorted(run['results'].items()):
+        b = baseline['results'].get(key)
+        if 'min' not in r or b is None or 'min' not in b:
+            continue
+        ratio = r['min'] / b['min']
+        flag = ''
+        if ratio > threshold:
+            regressed.append(key)
+            flag = '  REGRESSION'
+        print('{:<28}{:9.4f}s{:9.4f}s{:8.2f}{}'
+              .format(key, b['min'], r['min'], ratio, flag))
+    return regressed
+
+def suite_main(argv):
+    'Command line of the suite; returns the exit status'
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='bench.py suite')
+    parser.add_argument('cases', nargs='*',
+                        help='cases to run, of {}; all by default'
+                             .format(', '.join(SUITE)))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', default=None,
+                        help='JSON file of the results; default '
+                             'bench/{time-stamp}.json')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='largest time ratio to the baseline that is '
+                             'not a regression')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='also save the results as the baseline')
+    a = parser.parse_args(argv)
+    for c in a.cases:
+        if c not in SUITE:
+            parser.error('unknown case {}'.format(c))
+
+    run = run_suite(a.cases or None, a.repeat)
+
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    out = a.out or os.path.join(BENCH_DIR, '{}.json'
+                                .format(hex(int(time.time()))[2:]))
+    for fn in [out] + ([a.baseline] if a.save_baseline else []):
+        with open(fn, 'w') as f:
+            json.dump(run, f, indent=2)
+    print('Saved to {}'.format(out))
+
+    if a.save_baseline:
+        return 0
+    if not os.path.exists(a.baseline):
+        print('No baseline at {}; nothing was checked for regressions. '
+              'Record one on this machine with --save-baseline.'
+              .format(a.baseline), file=sys.stderr)
+        return 2
+    with open(a.baseline) as f:
+        baseline = json.load(f)
+    regressed = compare_suite(run, baseline, a.threshold)
+    if regressed:
+        print('Regressions: {}'.format(', '.join(regressed)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'suite':
+        sys.exit(suite_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        from check import main
+        sys.exit(main(sys.argv[2:]))
+
+    benches = {'pairs': lambda: bench_pairs(int(sys.argv[2]),
+                                            int(sys.argv[3]),
+                                            [int(w) for w in sys.argv[4:]]
+                                            or (1, 2, 4)),
+               'report': lambda: bench_report(
+                   *[int(a) for a in sys.argv[2:3]]),
+               'generator': lambda: bench_generator(
+                   *[int(a) for a in sys.argv[2:]]),
+               'shared': lambda: bench_shared([int(a) for a in sys.argv[2:]]
+                                              or (1000000, 4000000, 16000000)),
+               'cvcache': lambda: bench_cvcache(*[int(a) for a in sys.argv[2:]]),
+               'npmlp': lambda: bench_npmlp(
+                   *[None if a == '-' else a for a in sys.argv[2:3]],
+                   *[int(a) for a in sys.argv[3:]]),
+               'quant': lambda: bench_quant(
+                   *[None if a == '-' else a for a in sys.argv[2:3]],
+                   *[int(a) for a in sys.argv[3:]]),
+               'vocab': lambda: bench_vocab(*[int(a) for a in sys.argv[2:]]),
+               'sweep': lambda: bench_sweep(*[int(a) for a in sys.argv[2:]]),
+               'cvsplit': lambda: bench_cvsplit(
+                   *[int(a) for a in sys.argv[2:3]]),
+               'ingest': lambda: bench_ingest([int(a) for a in sys.argv[2:]]
+                                              or (20000, 80000)),
+               'baselines': lambda: bench_baselines(
+                   *[int(a) for a in sys.argv[2:]]),
+               'evaluate': lambda: bench_evaluate(
+                   *[int(a) for a in sys.argv[2:3]]),
+               'ranking': lambda: bench_ranking(
+                   *[int(a) for a in sys.argv[2:]]),
+               'score_all': lambda: bench_score_all(
+                   *[int(a) for a in sys.argv[2:3]],
+                   workers=[int(a) for a in sys.argv[3:]] or (1, 2)),
+               'serve': lambda: bench_serve(
+                   *[None if a == '-' else a for a in sys.argv[2:3]],
+                   *[int(a) for a in sys.argv[3:]])}
+    if len(sys.argv) < 2 or sys.argv[1] not in benches:
+        print('Must follow the following format:')
+        print('python3 bench.py suite [{case} ...] [--baseline FILE] '
+              '[--threshold RATIO] [--save-baseline]')
+        print('python3 bench.py check [{check} ...]')
+        print('python3 bench.py pairs {30, 60, 90} {n_epoch} [{workers} ...]')
+        print('python3 bench.py report [{n_repeat}]')
+        print('python3 bench.py generator [{n_rows}] [{batch_size}]')
+        print('python3 bench.py shared [{n_rows} ...]')
+        print('python3 bench.py cvcache [{n_rows}]')
+        print('python3 bench.py npmlp [{model.h5, -}] [{n_users}]')
+        print('python3 bench.py quant [{model.h5, -}] [{n_users}] '
+              '[{workers}]')
+        print('python3 bench.py vocab [{n_users}] [{n_rows}] [{dim}]')
+        print('python3 bench.py sweep [{n_configs}] [{max_epoch}] [{eta}]')
+        print('python3 bench.py cvsplit [{n_users}]')
+        print('python3 bench.py ingest [{n_users} ...]')
+        print('python3 bench.py baselines [{n_rows}] [{chunk_rows}]')
+        print('python3 bench.py evaluate [{n_epoch}]')
+        print('python3 bench.py ranking [{n_jokes}] [{n_users}] '
+              '[{n_models}] [{k}]')
+        print('python3 bench.py score_all [{n_users}] [{workers} ...]')
+        print('python3 bench.py serve [{url, -}] [{n_requests}] '
+              '[{concurrency}] [{n_users}] [{n}]')
+    else:
+        benches[sys.argv[1]]()
@@ -0,0 +1,530 @@
+import os
+import sys
+import traceback
+import numpy as np
+
+# Checks that the rewritten hot paths of the MLP pipeline give the results
+#   of the code they replaced, on small synthetic data, so they run in
+#   seconds and without the timing workloads of bench.py,
+#
+#   python3 check.py [{check} ...]
+#
+# Every check_* function asserts that both sides agree. A check that cannot
+#   run, e.g. for lack of tensorflow, is skipped; the exit status is 1 if
+#   any check failed.
+
+def check_pairs(p=30, n_epoch=2, workers=(1, 2), n_users=2000):
+    """
+    run_pairs() gives the estimates and MAEs of the serial run with any
+    number of workers, on a synth.py dataset.
+    """
+    import tempfile
+    from synth import generate
+    from cube import create_cube, load_epochs
+    from cvcache import pair_prefixes
+    from train_mlp import run_pairs
+
+    with tempfile.TemporaryDirectory() as dn:
+        generate(dn, n_users, ps=(p,))
+        pfs = [os.path.join(dn, f) for f in pair_prefixes(p)]
+        ref = None
+        for w in workers:
+            cube = os.path.join(dn, 'ests_{}.npy'.format(w))
+            create_cube(cube, n_epoch)
+            mae_tr, mae_va = run_pairs(pfs, n_epoch, cube, w)
+            out = (load_epochs(cube, slice(None)), mae_tr, mae_va)
+            ref = out if ref is None else ref
+            assert(all(np.array_equal(a, b) for a, b in zip(ref, out)))
+
+def pivot_loop(ests3, uIDs):
+    'The per-row np.where pivot of train_mlp.main that pivot.pivot() replaced'
+    ests = [np.zeros([len(uIDs), 100]) for n in range(len(ests3))]
+    for n in range(len(ests3)):
+        mtx3 = ests3[n]
+        for i in range(mtx3.shape[0]):
+            (u, j, r) = mtx3[i, :]
+            u = np.where(uIDs == u)[0][0]
+            ests[n][u, int(j) - 1] = r
+    return ests
+
+def check_pivot(n_epoch=3, seed=9999):
+    """
+    pivot.pivot() gives the matrices of pivot_loop() for 3-column estimates
+    in the shuffled layout of SaveResults, and pivot.reorder() the rows of
+    format.py's per-row reordering.
+    """
+    from pivot import pivot, reorder
+
+    rs = np.random.RandomState(seed)
+    uIDs = np.sort(rs.choice(73421, 300, replace=False) + 1)
+    u, j = np.meshgrid(uIDs, np.arange(1, 101), indexing='ij')
+    perm = rs.permutation(u.size)
+    u, j = u.ravel()[perm], j.ravel()[perm]
+    ests3 = [np.column_stack([u, j, rs.uniform(-10, 10, u.size)])
+             for n in range(n_epoch)]
+    ests = pivot(ests3, uIDs)
+    assert(np.array_equal(ests, pivot_loop(ests3, uIDs)))
+
+    order = np.argsort(-ests[0])
+    ref = ests[0].copy()
+    for i in range(len(ref)):
+        ref[i, ] = ref[i, order[i]]
+    assert(np.array_equal(reorder(ests[0], order), ref))
+    assert(np.array_equal(reorder(ests, order)[0], ref))
+
+def check_generator(n_rows=100000, batch_size=4096, prefetch=(0, 2)):
+    """
+    Unshuffled, ArrayGenerator gives the batches of DataGenerator at every
+    prefetch depth, over two epochs.
+    """
+    from bench import synth_ratings
+    from DataGenerator import DataGenerator, ArrayGenerator
+
+    tr = synth_ratings(n_rows)
+    ref = DataGenerator(tr, batch_size, shuffle=False)
+    for n in prefetch:
+        gen = ArrayGenerator(tr, batch_size, shuffle=False, prefetch=n)
+        assert(len(gen) == len(ref))
+        for k in range(2):
+            for i in range(len(ref)):
+                (u, j), r = gen[i]
+                (ru, rj), rr = ref[i]
+                assert(np.array_equal(u, ru) and np.array_equal(j, rj)
+                       and np.allclose(r, rr, atol=1e-5))
+            gen.on_epoch_end()
+        gen.close()
+
+def check_cvcache(n_rows=100000):
+    """
+    The cache of cvcache.py loads the ratings of pd.read_csv, shifted or
+    not, and is rebuilt when its CSV changes.
+    """
+    import tempfile
+    import pandas as pd
+    from bench import synth_ratings
+    from cvcache import SHIFT, is_fresh, load_split
+
+    with tempfile.TemporaryDirectory() as dn:
+        fn = os.path.join(dn, '90_1_train.csv')
+        for seed in [1, 2]:
+            tr = synth_ratings(n_rows, seed=seed)
+            tr.rating = (tr.rating + SHIFT).round(2)
+            tr.to_csv(fn, index=False)
+            assert(not is_fresh(fn))
+            ref = pd.read_csv(fn)
+            for unshift in [True, False]:
+                df = load_split(fn, unshift)
+                assert(np.array_equal(df.uID, ref.uID)
+                       and np.array_equal(df.jID, ref.jID)
+                       and np.allclose(df.rating + SHIFT * unshift,
+                                       ref.rating, atol=1e-5))
+            assert(is_fresh(fn))
+
+def report_loop(ests, true, comps):
+    'The per-row loops of format.py that genReport() replaced'
+    true = np.array(true)
+    order = np.argsort(-ests)
+
+    def genAE(ests, true):
+        mtx = np.abs(ests - true)
+        for i in range(len(mtx)):
+            mtx[i, ] = mtx[i, order[i]]
+        return mtx
+
+    def genTCV(ae):
+        return np.where(ae < 3, 'a', np.where(ae < 6, 'b', 'c'))
+
+    report = {'recommendation': order + 1,
+              'EST_mlp': np.sort(-ests) * (-1),
+              'AE_mlp': genAE(ests, true)}
+    # Reordered in place, so the comparisons' errors below are taken
+    #   against the true values in recommendation order
+    for i in range(len(true)):
+        true[i, ] = true[i, order[i]]
+    report['TRUE_mlp'] = true
+    for n, mtx in comps.items():
+        report['AE_' + n] = genAE(mtx, true)
+    for n in ['mlp'] + list(comps):
+        report['TCV_' + n] = genTCV(report['AE_' + n])
+    return report
+
+def synth_report(seed=9999):
+    """
+    Random estimates, true ratings and comparison estimates of 300 test
+    users, as given to format.genReport().
+    """
+    rs = np.random.RandomState(seed)
+    true = np.round(rs.uniform(-10, 10, (300, 100)), 2)
+    ests = true + rs.randn(300, 100) * 4
+    comps = {'unif': np.round(rs.uniform(-10, 10, (300, 100)), 2),
+             'tavg': np.full((300, 100), 0.822),
+             'uavg': np.repeat(np.round(true.mean(1), 4)[:, None], 100, 1)}
+    return ests, true, comps
+
+def check_report():
+    """
+    format.genReport() gives the matrices of the per-row loops it replaced,
+    without changing its inputs.
+    """
+    from format import genReport
+
+    ests, true, comps = synth_report()
+    before = (ests.copy(), true.copy())
+    ref = report_loop(ests, true, comps)
+    out = genReport(ests, true, comps)
+    assert(np.array_equal(before[0], ests) and np.array_equal(before[1], true))
+    assert(sorted(ref) == sorted(out))
+    assert(all(np.array_equal(ref[n], out[n]) for n in ref))
+
+class _Layer(object):
+    'Keras layer of the graph of check_export(); subclassed per layer type'
+    def __init__(self, name, inbound=(), weights=(), **config):
+        from types import SimpleNamespace
+        self.name = name
+        self._inbound_nodes = [SimpleNamespace(inbound_layers=list(inbound))]
+        self.weights = list(weights)
+        self.config = config
+
+    def get_weights(self):
+        return list(self.weights)
+
+    def get_config(self):
+        return dict(self.config)
+
+class _Model(object):
+    'Keras model of the layers of check_export()'
+    def __init__(self, layers):
+        self.layers = layers
+
+    def get_layer(self, name):
+        return next(l for l in self.layers if l.name == name)
+
+def check_export(n_users=500, n_jokes=100, layer_sizes=[(16, 3), 20, 10],
+                 alpha=.3, eps=1e-3, seed=9999):
+    """
+    npmlp.export() of the graph of Mlp.new_model() with BatchNormalization
+    and dropout predicts as a forward pass that applies every
+    BatchNormalization as it is; the graph is made of stand-ins of the
+    Keras layers, so keras is not needed.
+    """
+    import tempfile
+    import vocab
+    from npmlp import NpMlp, export
+
+    rs = np.random.RandomState(seed)
+    kinds = {k: type(k, (_Layer,), {})
+             for k in ['Embedding', 'BatchNormalization', 'Flatten',
+                       'Concatenate', 'Dense', 'LeakyReLU', 'Dropout']}
+
+    def bn_weights(d):
+        return [rs.uniform(.5, 2, d), rs.randn(d), rs.randn(d),
+                rs.uniform(.1, 3, d)]
+
+    def bn(x, w):
+        gamma, beta, mean, var = w
+        return (x - mean) / np.sqrt(var + eps) * gamma + beta
+
+    layers, flat = [], []
+    for name, n, d in [('embedding_uid', n_users, layer_sizes[0][0]),
+                       ('embedding_jid', n_jokes, layer_sizes[0][1])]:
+        emb = kinds['Embedding'](name, weights=[rs.randn(n + 1, d)])
+        norm = kinds['BatchNormalization'](name + '_bn', [emb],
+                                           bn_weights(d), scale=True,
+                                           center=True, epsilon=eps)
+        flat.append(kinds['Flatten'](name + '_flat', [norm]))
+        layers += [emb, norm, flat[-1]]
+    layer = kinds['Concatenate']('concat', flat)
+    layers.append(layer)
+
+    sizes = [sum(layer_sizes[0])] + list(layer_sizes[1:])
+    hidden = []
+    for i, (a, b) in enumerate(zip(sizes, sizes[1:])):
+        dense = kinds['Dense']('hidden_{}'.format(i + 1), [layer],
+                               [rs.randn(a, b) / np.sqrt(a), rs.randn(b)],
+                               activation='linear')
+        act = kinds['LeakyReLU']('act_{}'.format(i + 1), [dense],
+                                 alpha=alpha)
+        norm = kinds['BatchNormalization']('bn_{}'.format(i + 1), [act],
+                                           bn_weights(b), scale=True,
+                                           center=True, epsilon=eps)
+        layer = kinds['Dropout']('dropout_{}'.format(i + 1), [norm])
+        layers += [dense, act, norm, layer]
+        hidden.append((dense.weights, norm.weights))
+    out = kinds['Dense']('output', [layer],
+                         [rs.randn(sizes[-1], 1), rs.randn(1)],
+                         activation='linear')
+    layers.append(out)
+
+    uIDs = rs.randint(1, n_users + 1, 2000)
+    jIDs = rs.randint(1, n_jokes + 1, 2000)
+    h = np.hstack([bn(layers[0].weights[0][uIDs], layers[1].weights),
+                   bn(layers[3].weights[0][jIDs], layers[4].weights)])
+    for (W, b), norm in hidden:
+        z = h @ W + b
+        h = bn(np.where(z > 0, z, alpha * z), norm)
+    ref = h @ out.weights[0] + out.weights[1]
+
+    with tempfile.TemporaryDirectory() as dn:
+        export(_Model(layers), dn, vocab.identity(n_users + 1, n_jokes + 1))
+        pred = NpMlp(dn).predict([uIDs, jIDs])
+    assert(np.abs(pred - ref).max() < 1e-4)
+
+def check_ingest(n_users=3000, block_users=1000):
+    """
+    The shards of ingest.py hold the rows of melting the whole matrix at
+    once, as nmf.R's dataProcessing() does, for the raw and the testing
+    layouts of a synth_wide() CSV.
+    """
+    import tempfile
+    import pandas as pd
+    import ingest
+    from bench import synth_wide
+
+    with tempfile.TemporaryDirectory() as dn:
+        csv, testing300 = synth_wide(dn, n_users)
+        for fn, testing in [(csv, False), (testing300, True)]:
+            out = os.path.join(dn, 'ingest')
+            ingest.ingest([fn], out, block_users)
+            wide = pd.read_csv(fn, header=0 if testing else None)
+            uIDs = (wide.values[:, 0] + 1 if testing
+                    else np.arange(1, len(wide) + 1))
+            wide = wide.iloc[:, 1:]
+            wide.columns = np.arange(1, wide.shape[1] + 1)
+            ref = wide.stack().rename('rating').reset_index()
+            ref = ref[ref.rating != ingest.UNRATED]
+            df = ingest.load(out)
+            assert(np.array_equal(df.uID, uIDs[ref.level_0])
+                   and np.array_equal(df.jID, ref.level_1)
+                   and np.allclose(df.rating, ref.rating, atol=1e-5))
+            n_rated = ref.groupby('level_0').size().values
+            assert(np.array_equal(df.nRated, np.repeat(n_rated, n_rated)))
+
+        # A directory that is not one of ingest() is not replaced
+        try:
+            ingest.ingest([csv], dn, block_users)
+        except ValueError:
+            pass
+        else:
+            assert(False)
+        assert(os.path.exists(csv))
+
+def check_baselines(n_rows=200000, chunk_rows=30000):
+    """
+    baselines.RunningMeans over chunks of a training set gives the mean and
+    the test users' means of a group-by of the whole table; a test user
+    without ratings gets the mean, and uIDs past the first chunk's largest
+    grow its table.
+    """
+    from bench import synth_ratings
+    from baselines import RunningMeans
+
+    tr = synth_ratings(n_rows).sort_values('uID', kind='stable')
+    rs = np.random.RandomState(0)
+    # Test users of the first uIDs, so the table must grow, and uID 0,
+    #   which is never rated
+    first = tr.uID.unique()[:20000]
+    uIDs = np.sort(np.append(rs.choice(first, 299, replace=False), 0))
+    means = RunningMeans(uIDs)
+    u, r = tr.uID.values, tr.rating.values
+    for lo in range(0, n_rows, chunk_rows):
+        means.update(u[lo:lo + chunk_rows], r[lo:lo + chunk_rows])
+
+    ref = tr.groupby('uID').rating.mean().reindex(uIDs)
+    assert(np.isclose(means.mean(), tr.rating.mean()))
+    assert(np.allclose(means.user_means(),
+                       ref.fillna(tr.rating.mean()).values))
+
+def evaluate_loop(fn, true):
+    """
+    MAE and ternary categories of every epoch of a cube, one epoch at a
+    time as format.py takes them, for comparison with evaluate.evaluate().
+    """
+    from cube import open_cube, load_epochs
+    from outputs import TCV_BINS, TCV_LABELS
+
+    mae, tcv = [], []
+    for n in range(open_cube(fn).shape[0]):
+        ae = np.abs(load_epochs(fn, n) - true)
+        labels = TCV_LABELS[np.digitize(ae, TCV_BINS)]
+        mae.append(ae.mean())
+        tcv.append([np.sum(labels == c) for c in TCV_LABELS])
+    return mae, tcv
+
+def check_evaluate(n_epoch=12, predict_every=5, chunk_epochs=(1, 5, 32)):
+    """
+    evaluate.evaluate() gives the metrics of evaluate_loop() at any chunk
+    size, and the epochs ranked for a run of `predict_every` are the ones
+    written to its cube: the zero epochs between them, with their low MAE
+    against ratings near 0, are never picked.
+    """
+    import pickle
+    import tempfile
+    from cube import create_cube, run_epochs
+    from evaluate import SELECT, evaluate, best_epoch
+
+    rs = np.random.RandomState(9999)
+    true = np.round(rs.uniform(-1, 1, (300, 100)), 2)
+    with tempfile.TemporaryDirectory() as dn:
+        fn = os.path.join(dn, 'ests_90_{}_ts.npy'.format(n_epoch))
+        cube = create_cube(fn, n_epoch)
+        predicted = [4, 9, 11]
+        for n in predicted:
+            cube[n] = true + rs.randn(300, 100) * 3
+        cube.flush()
+        with open(os.path.join(dn, 'epochs_90_{}_ts.pkl'.format(n_epoch)),
+                  'wb') as f:
+            pickle.dump({'best_epoch': None, 'stop_epoch': None,
+                         'predict_every': predict_every}, f)
+
+        mae, tcv = evaluate_loop(fn, true)
+        for k in chunk_epochs:
+            m = evaluate(fn, true, k)
+            assert(np.allclose(mae, m['mae'])
+                   and np.array_equal(tcv, m['tcv']))
+
+        assert(run_epochs(fn) == predicted)
+        assert(best_epoch(m) not in predicted)
+        for s in SELECT:
+            assert(best_epoch(m, s, run_epochs(fn)) in predicted)
+
+def ranking_sort(ests, true, k, relevant):
+    'precision, ndcg and map @k from a full argsort of every row'
+    from cvcache import SHIFT
+
+    top = np.argsort(-ests, -1, kind='stable')[..., :k]
+    top_true = np.take_along_axis(np.broadcast_to(true, ests.shape), top, -1)
+    rel = top_true >= relevant
+    disc = np.log2(np.arange(2, k + 2))
+    ideal = ((-np.sort(-true, -1)[:, :k] + SHIFT) / disc).sum(-1)
+    n_rel = (true >= relevant).sum(-1)
+    ap = np.full(ests.shape[:-1], np.nan)
+    for i in np.ndindex(*ests.shape[:-1]):
+        if n_rel[i[-1]]:
+            hit = np.flatnonzero(rel[i])
+            prec = (np.arange(len(hit)) + 1.) / (hit + 1)
+            ap[i] = prec.sum() / min(k, n_rel[i[-1]])
+    return {'precision': rel.mean(-1),
+            'ndcg': ((top_true + SHIFT) / disc).sum(-1) / ideal,
+            'map': ap}
+
+def check_ranking(n_jokes=500, n_users=300, n_models=3, ks=(1, 10, 600)):
+    """
+    ranking.user_metrics() gives the metrics of ranking_sort(), including
+    users without a relevant joke and a k over the number of jokes, and
+    ranking.best_epochs() picks among the epochs given: the zero epochs of
+    a cube, which rank the jokes in column order, beat estimates that rank
+    them worst first.
+    """
+    from ranking import RELEVANT, user_metrics, evaluate, best_epochs
+
+    rs = np.random.RandomState(9999)
+    true = np.round(rs.uniform(-10, 10, (n_users, n_jokes)), 2)
+    true[:10] = np.minimum(true[:10], RELEVANT - 1)    # nothing relevant
+    ests = true + rs.randn(n_models, n_users, n_jokes) * 5
+    for k in ks:
+        ref = ranking_sort(ests, true, min(k, n_jokes), RELEVANT)
+        out = user_metrics(ests, true, k, RELEVANT)
+        assert(all(np.allclose(ref[m], out[m], equal_nan=True) for m in ref))
+
+    cube = np.zeros((6, n_users, n_jokes))
+    predicted = [1, 3, 5]
+    cube[predicted] = -true
+    res = evaluate(cube, true, (5, 10), RELEVANT)
+    assert(all(e not in predicted for e in best_epochs(res).values()))
+    assert(all(e in predicted
+               for e in best_epochs(res, predicted).values()))
+
+def check_score_all(n_users=3000, n_jokes=150, n=10, chunk_users=700):
+    """
+    score_all.py gives the top n of score_loop() with 1 and 2 workers and
+    after resuming a job with a missing shard, for a model whose jIDs are
+    not 1 to 100; it refuses to replace a directory that is not a job's.
+    """
+    import shutil
+    import tempfile
+    import vocab
+    from bench import synth_npmlp, score_loop
+    from npmlp import NpMlp
+    from score_all import score_all, load, shard_path
+
+    with tempfile.TemporaryDirectory() as dn:
+        model = os.path.join(dn, 'model')
+        synth_npmlp(model, n_users, n_jokes)
+        vocab.save(model, {'uID': vocab.Vocab(np.arange(1, n_users + 1)),
+                           'jID': vocab.Vocab(np.arange(1, n_jokes + 1)
+                                              * 3)})
+        ref = score_loop(NpMlp(model), n)
+
+        def same(res):
+            out = load(res)
+            # predict_grid() sums in another order, so jokes tied to
+            #   float32 precision may swap; their scores still agree
+            return (np.allclose(out['score'], ref[1], atol=1e-5)
+                    and np.all(np.isin(out['jID'], ref[0]))
+                    and np.mean(out['jID'] == ref[0]) > .99
+                    and np.array_equal(np.sort(out['uID']),
+                                       np.arange(1, n_users + 1)))
+
+        res = os.path.join(dn, 'scores')
+        for w in [1, 2]:
+            score_all(model, res, n=n, chunk_users=chunk_users, workers=w)
+            assert(same(res))
+        shutil.rmtree(shard_path(res, 1))
+        meta = score_all(model, res, n=n, chunk_users=chunk_users,
+                         resume=True)
+        assert(meta['scored'] == chunk_users and same(res))
+
+        try:
+            score_all(model, model, n=n)
+        except ValueError:
+            pass
+        else:
+            assert(False)
+        assert(os.path.exists(os.path.join(model, 'vocab_jID.npy')))
+
+# Checks by name, in the order of the requests that added them
+CHECKS = {'pairs': check_pairs,
+          'pivot': check_pivot,
+          'generator': check_generator,
+          'cvcache': check_cvcache,
+          'report': check_report,
+          'export': check_export,
+          'ingest': check_ingest,
+          'baselines': check_baselines,
+          'evaluate': check_evaluate,
+          'ranking': check_ranking,
+          'score_all': check_score_all}
+
+def main(names):
+    """
+    Run checks of CHECKS and print one line for each.
+
+    Arguments:
+        - names: list
+            Checks to run. Empty runs all of them.
+    Returns:
+        - int exit status: 1 if any check failed, 2 if a name is unknown,
+          else 0.
+    """
+    unknown = [n for n in names if n not in CHECKS]
+    if unknown:
+        print('Unknown checks: {}; must be of {}'
+              .format(', '.join(unknown), ', '.join(CHECKS)))
+        return 2
+    failed = []
+    for name in names or list(CHECKS):
+        try:
+            CHECKS[name]()
+        except ImportError as e:
+            print('{:<12}skipped: {}'.format(name, e))
+            continue
+        except AssertionError:
+            failed.append(name)
+            print('{:<12}FAILED'.format(name))
+            traceback.print_exc()
+            continue
+        print('{:<12}ok'.format(name))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
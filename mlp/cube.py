@@ -0,0 +1,113 @@
+import os
+import pickle
+import numpy as np
+
+# On-disk epoch cube of estimates: a float32 .npy array of shape
+#   (n_epoch, n_users, n_jokes), where cube[n] is the `ests` matrix of epoch n.
+#
+# The cube is created once and filled in place as epochs finish, so training
+#   never holds more than one epoch of estimates in memory. Readers open it
+#   with memory mapping and only the epochs they index are read from disk.
+
+def create_cube(path, n_epoch, n_users=300, n_jokes=100):
+    """
+    Create a zero-filled cube file.
+
+    Arguments:
+        - path: str
+            Path of the .npy file.
+        - n_epoch: int
+            Number of epochs.
+        - n_users: int, default 300
+            Number of test users.
+        - n_jokes: int, default 100
+            Number of jokes.
+    Returns:
+        - np.memmap of the cube opened for writing.
+    """
+    cube = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                     shape=(n_epoch, n_users, n_jokes))
+    cube.flush()
+    return cube
+
+def open_cube(path, mode='r'):
+    """
+    Open an existing cube file with memory mapping.
+
+    Arguments:
+        - path: str
+            Path of the .npy file.
+        - mode: str, default 'r'
+            'r' to read, 'r+' to fill in epochs.
+    Returns:
+        - np.memmap of shape (n_epoch, n_users, n_jokes).
+    """
+    return np.load(path, mmap_mode=mode)
+
+def load_epochs(path, epochs):
+    """
+    Read some epochs of a cube into memory as float64.
+
+    Arguments:
+        - path: str
+            Path of the .npy file.
+        - epochs: int or slice
+            Epoch index, or slice of epochs, to read.
+    Returns:
+        - np.array of shape (n_users, n_jokes) for an int, otherwise
+          (n_epochs, n_users, n_jokes).
+    """
+    return np.array(open_cube(path)[epochs], dtype=np.float64)
+
+def predict_due(epoch, n_epoch, predict_every):
+    """
+    Whether the estimates of an epoch are predicted by SaveResults: every
+    `predict_every` epochs, and always at the last epoch.
+    """
+    return (epoch + 1) % predict_every == 0 or epoch == n_epoch - 1
+
+def predicted_epochs(n_epoch, predict_every=1, stop_epoch=None,
+                     best_epoch=None):
+    """
+    Epochs of a run of train_mlp.py whose estimates are in its cube; the
+    others are left zero.
+
+    Arguments:
+        - n_epoch: int
+        - predict_every: int, default 1
+        - stop_epoch: int, default None
+            Epoch training stopped at early, if it did.
+        - best_epoch: int, default None
+            Best epoch of an early stopped run, whose estimates are saved
+            even when it is not a `predict_every` epoch.
+    Returns:
+        - list of the epochs, in increasing order.
+    """
+    last = n_epoch - 1 if stop_epoch is None else stop_epoch
+    epochs = {e for e in range(last + 1)
+              if predict_due(e, n_epoch, predict_every)}
+    if best_epoch is not None:
+        epochs.add(best_epoch)
+    return sorted(epochs)
+
+def run_epochs(path):
+    """
+    predicted_epochs() of the run of train_mlp.py that filled a cube, from
+    the epochs_*.pkl it saved next to it.
+
+    Arguments:
+        - path: str
+            Path of the cube, e.g. 'pkl/ests_90_150_ts.npy'.
+    Returns:
+        - list of the epochs, in increasing order; every epoch of the cube
+          if there is no epochs_*.pkl.
+    """
+    n_epoch = open_cube(path).shape[0]
+    dn, fn = os.path.split(path)
+    pkl = os.path.join(dn, 'epochs' + fn[len('ests'):-len('.npy')] + '.pkl')
+    if not (fn.startswith('ests_') and os.path.exists(pkl)):
+        return list(range(n_epoch))
+    with open(pkl, 'rb') as f:
+        epochs = pickle.load(f)
+    return predicted_epochs(n_epoch, epochs.get('predict_every', 1),
+                            epochs['stop_epoch'], epochs['best_epoch'])
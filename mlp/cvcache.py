@@ -0,0 +1,135 @@
+import os
+import sys
+import glob
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+# Binary columnar cache of the cvout/{p}_{i}_{train,test}.csv splits.
+#
+# Each CSV is converted once into a directory of .npy columns next to it,
+#
+#   cvout/cache/30_1_train/
+#     |____ uID.npy      int32
+#     |____ jID.npy      int16
+#     |____ rating.npy   float32, with the NMF shift of +10 already undone
+#     |____ source.json  size and mtime of the CSV it was made from
+#
+# and loaded with memory mapping afterwards. The cache is rebuilt whenever
+#   the size or mtime of the CSV no longer match source.json.
+
+CACHE_DIR = 'cache'
+DTYPES = {'uID': np.int32, 'jID': np.int16, 'rating': np.float32}
+SHIFT = 10  # rating shift done in NMF
+
+def cache_path(fn):
+    """
+    Arguments:
+        - fn: str
+            Path of a split CSV, e.g. 'cvout/30_1_train.csv'.
+    Returns:
+        - str path of its cache directory.
+    """
+    dn, base = os.path.split(fn)
+    return os.path.join(dn, CACHE_DIR, os.path.splitext(base)[0])
+
+def _source(fn):
+    st = os.stat(fn)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def is_fresh(fn):
+    'Whether the cache of CSV `fn` exists and was made from its current version'
+    try:
+        with open(os.path.join(cache_path(fn), 'source.json')) as f:
+            return json.load(f) == _source(fn)
+    except (OSError, ValueError):
+        return False
+
+def build(fn):
+    """
+    Convert a split CSV into its cache directory.
+
+    Arguments:
+        - fn: str
+            Path of a split CSV.
+    """
+    src = _source(fn)
+    df = pd.read_csv(fn)
+    df.rating -= SHIFT
+
+    dn = cache_path(fn)
+    tmp = dn + '.tmp{}'.format(os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for col, dtype in DTYPES.items():
+        np.save(os.path.join(tmp, col + '.npy'), df[col].values.astype(dtype))
+    # Written last, so a half-built cache is never taken as fresh
+    with open(os.path.join(tmp, 'source.json'), 'w') as f:
+        json.dump(src, f)
+
+    shutil.rmtree(dn, ignore_errors=True)
+    os.rename(tmp, dn)
+
+def pair_prefixes(p):
+    """
+    Arguments:
+        - p: int
+            Proportion of training set to run. Must be 30, 60, or 90.
+    Returns:
+        - list of the file prefixes of every pair, e.g. 'cvout/30_1'.
+    """
+    assert(p in [30, 60, 90])
+    n_pairs = {'30':2, '60':3, '90':12}[str(p)]
+    return ['cvout/{}_{}'.format(p, i+1) for i in range(n_pairs)]
+
+def load_arrays(fn, mmap=True):
+    """
+    Load the columns of a split, building or rebuilding its cache first if
+    needed.
+
+    Arguments:
+        - fn: str
+            Path of a split CSV, e.g. 'cvout/30_1_train.csv'.
+        - mmap: boolean, default True
+            Whether to memory map the columns instead of reading them.
+    Returns:
+        - dict {'uID', 'jID', 'rating'} of np.array; ratings are unshifted.
+    """
+    if not is_fresh(fn):
+        build(fn)
+    dn = cache_path(fn)
+    return {col: np.load(os.path.join(dn, col + '.npy'),
+                         mmap_mode='r' if mmap else None)
+            for col in DTYPES}
+
+def load_split(fn, unshift=True):
+    """
+    Load a split as the n x 3 dataframe the training code uses.
+
+    Arguments:
+        - fn: str
+            Path of a split CSV, e.g. 'cvout/30_1_train.csv'.
+        - unshift: boolean, default True
+            Whether to undo the +10 rating shift done in NMF. False gives the
+            ratings as they are in the CSV.
+    Returns:
+        - pandas.dataframe with columns uID, jID, rating.
+    """
+    cols = load_arrays(fn)
+    df = pd.DataFrame({col: np.asarray(v) for col, v in cols.items()},
+                      columns=list(DTYPES))
+    if not unshift:
+        df.rating += SHIFT
+    return df
+
+if __name__ == '__main__':
+    # Build the cache of every split up front
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    fns = sys.argv[1:] or sorted(glob.glob('cvout/*_t*.csv'))
+    for fn in fns:
+        if is_fresh(fn):
+            print('{}: up to date'.format(fn))
+        else:
+            build(fn)
+            print('{}: built'.format(fn))
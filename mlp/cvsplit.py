@@ -0,0 +1,230 @@
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from cvcache import SHIFT
+from ingest import BLOCK_USERS, read_blocks
+
+# Training and test sets of nmf/CV.R, written to cvout/ from the wide Jester
+#   CSVs without R,
+#
+#   python3 cvsplit.py ../data/jester-data-{1,2,3}.csv [--out cvout]
+#
+# The CSVs are read as by ingest.py, in either of its layouts. The test users
+#   are the UserIDs of jester-data-testing.csv plus 1, as in nmf.R.
+#
+# The pairs of each p follow CV.R:
+#   - p = 30: two disjoint 30% samples of every user's ratings are the
+#     training sets; the test users' ratings outside the first one are test
+#     set 1, and the ones in it test set 2.
+#   - p = 60, 90: every training set is a random (1-p) hold-out of every
+#     user's ratings. For test users, the ratings of pair j's test set are
+#     their i-th rated jokes with i % n_pairs == j - 1, and the training set
+#     is sampled from the others.
+#   Ratings in cvout are shifted by +10 as NMF did; every file is sorted by
+#   uID and jID.
+#
+# Instead of CV.R's loop over users, which grows every set with rbind() and
+#   takes hours, each chunk of BLOCK_USERS users is split at once: a user's
+#   random sample is the cells of the smallest random keys in its row. The
+#   sizes of the sets are CV.R's; the samples are not R's, since the RNGs
+#   differ. Every chunk has its own stream, seeded from the chunk's index, so
+#   the output depends on the seed and the chunk size only.
+
+N_PAIRS = {30: 2, 60: 3, 90: 12}
+
+def _ranks(keys):
+    'Rank of every entry within its row, 0 for the smallest'
+    order = np.argsort(keys, 1, kind='stable')
+    ranks = np.empty_like(order)
+    cols = np.broadcast_to(np.arange(keys.shape[1]), keys.shape)
+    np.put_along_axis(ranks, order, cols, 1)
+    return ranks
+
+def _masked_sample(rs, pool, n):
+    """
+    Arguments:
+        - rs: np.random.RandomState
+        - pool: np.array
+            m x n_jokes booleans of the cells each row samples from.
+        - n: np.array
+            Number of cells to sample in each row.
+    Returns:
+        - m x n_jokes booleans of min(n, pool size) random cells of every
+          row's pool.
+    """
+    keys = rs.rand(*pool.shape)
+    keys[~pool] = np.inf
+    return (_ranks(keys) < n[:, np.newaxis]) & pool
+
+def pair_masks(rs, p, rated, is_test):
+    """
+    Training and test cells of every pair of p for a chunk of users; see the
+    pair structure above.
+
+    Arguments:
+        - rs: np.random.RandomState
+        - p: int
+            Must be 30, 60, or 90.
+        - rated: np.array
+            m x n_jokes booleans of the rated cells of every user.
+        - is_test: np.array
+            m booleans of which users are test users.
+    Returns:
+        - list of (train, test) m x n_jokes boolean masks of every pair.
+    """
+    n_pairs = N_PAIRS[p]
+    n_rated = rated.sum(1)
+    test = rated & is_test[:, np.newaxis]
+
+    if p < 50:
+        n_train = np.round(p / 100. * n_rated).astype(int)
+        keys = rs.rand(*rated.shape)
+        keys[~rated] = np.inf
+        rank = _ranks(keys)
+        train1 = rank < n_train[:, np.newaxis]
+        train2 = ~train1 & (rank < 2 * n_train[:, np.newaxis]) & rated
+        return [(train1, test & ~train1), (train2, test & train1)]
+
+    # Rounding of CV.R
+    n_test = np.floor(np.round((1 - p / 100.) * 100 * n_rated + 50, 2) / 100)
+    n_train = (n_rated - n_test).astype(int)
+    # 1-based position of every rated joke among the user's rated jokes
+    pos = np.cumsum(rated, 1)
+    pairs = []
+    for j in range(n_pairs):
+        held = test & (pos % n_pairs == j)
+        pairs.append((_masked_sample(rs, rated & ~held, n_train), held))
+    return pairs
+
+# Text of every shifted rating, 0.00 to 20.00, and of the jIDs; a row is the
+#   sum of three looked up strings, which is ~2x faster than formatting it,
+#   and writing takes most of the time of a split.
+RATING_STR = np.array(['{:.2f}\n'.format(c / 100.) for c in range(2001)],
+                      dtype=object)
+JID_STR = np.array(['{},'.format(j) for j in range(1001)], dtype=object)
+
+def _write(f, uIDs, mask, cents):
+    """
+    Append the cells of `mask`, in uID and jID order, to a split CSV.
+
+    Arguments:
+        - f: file
+        - uIDs: np.array
+            uID of every row of the chunk.
+        - mask: np.array
+            Booleans of the cells to write; at most 1,000 jokes.
+        - cents: np.array
+            Shifted ratings of the chunk in hundredths, 0 to 2000.
+    """
+    u, j = np.nonzero(mask)
+    uID_str = np.array(['{},'.format(i) for i in uIDs.tolist()],
+                       dtype=object)
+    f.write(''.join(uID_str[u] + JID_STR[j + 1] + RATING_STR[cents[u, j]]))
+
+def open_splits(dn, ps):
+    """
+    Arguments:
+        - dn: str
+            Directory of the splits, created if needed.
+        - ps: tuple
+            Training sizes to write the pairs of.
+    Returns:
+        - dict {(p, pair index, 'train' or 'test'): file} of every split CSV,
+          with its header written.
+    """
+    os.makedirs(dn, exist_ok=True)
+    files = {}
+    for p in ps:
+        for i in range(N_PAIRS[p]):
+            for kind in ['train', 'test']:
+                f = open(os.path.join(dn, '{}_{}_{}.csv'.format(p, i + 1,
+                                                                 kind)), 'w')
+                f.write('"uID","jID","rating"\n')   # as R's write.table
+                files[p, i, kind] = f
+    return files
+
+def write_pairs(files, rs, ps, uIDs, rated, is_test, cents):
+    """
+    Split a chunk of users into every pair of `ps` and append it to `files`
+    of open_splits().
+
+    Arguments:
+        - rs: np.random.RandomState
+            Stream of the chunk.
+        - uIDs: np.array
+            m uIDs of the chunk, increasing.
+        - rated, is_test:
+            See pair_masks().
+        - cents: np.array
+            m x n_jokes shifted ratings in hundredths, 0 to 2000.
+    Returns:
+        - int, the number of rows written.
+    """
+    n_rows = 0
+    for p in ps:
+        for i, (train, test) in enumerate(pair_masks(rs, p, rated, is_test)):
+            _write(files[p, i, 'train'], uIDs, train, cents)
+            _write(files[p, i, 'test'], uIDs, test, cents)
+            n_rows += int(train.sum() + test.sum())
+    return n_rows
+
+def split(csvs, testing300='../data/jester-data-testing.csv', out='cvout',
+          ps=(30, 60, 90), seed=9999, chunk_users=BLOCK_USERS):
+    """
+    Arguments:
+        - csvs: list
+            Paths of the wide Jester CSVs, in uID order.
+        - testing300: str, default '../data/jester-data-testing.csv'
+            CSV of the test users; uIDs are its UserIDs plus 1.
+        - out: str, default 'cvout'
+            Directory of the split CSVs.
+        - ps: tuple, default (30, 60, 90)
+            Training sizes to write the pairs of.
+        - seed: int, default 9999
+        - chunk_users: int, default BLOCK_USERS
+            Number of users split at a time.
+    Returns:
+        - dict {'users', 'ratings', 'rows', 'seconds'} of the number of
+          users and ratings read, the number of rows written, and the time
+          taken.
+    """
+    t0 = time.perf_counter()
+    testuIDs = np.sort(pd.read_csv(testing300).UserID.values + 1)
+
+    files = open_splits(out, ps)
+    n_users, n_ratings, n_rows = 0, 0, 0
+    try:
+        for k, (uIDs, R) in enumerate(read_blocks(csvs, chunk_users)):
+            rated = ~np.isnan(R)
+            cents = np.rint((np.where(rated, R, 0) + SHIFT) * 100).astype(int)
+            n_rows += write_pairs(files, np.random.RandomState([seed, k]), ps,
+                                  uIDs, rated, np.isin(uIDs, testuIDs), cents)
+            n_users += len(uIDs)
+            n_ratings += int(rated.sum())
+    finally:
+        for f in files.values():
+            f.close()
+
+    seconds = time.perf_counter() - t0
+    print('users: {}\tratings: {}\trows written: {}\ttime: {:.1f}s\t'
+          '{:.0f} rows/sec'.format(n_users, n_ratings, n_rows, seconds,
+                                   n_rows / seconds))
+    return {'users': n_users, 'ratings': n_ratings, 'rows': n_rows,
+            'seconds': seconds}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('csvs', nargs='+', help='wide Jester CSVs')
+    parser.add_argument('--testing', default='../data/jester-data-testing.csv',
+                        help='CSV of the test users')
+    parser.add_argument('--out', default='cvout')
+    parser.add_argument('--p', type=int, nargs='+', choices=[30, 60, 90],
+                        default=[30, 60, 90])
+    parser.add_argument('--seed', type=int, default=9999)
+    parser.add_argument('--chunk-users', type=int, default=BLOCK_USERS,
+                        help='users split at a time')
+    a = parser.parse_args()
+
+    split(a.csvs, a.testing, a.out, tuple(a.p), a.seed, a.chunk_users)
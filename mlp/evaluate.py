@@ -0,0 +1,147 @@
+import argparse
+import numpy as np
+from outputs import TCV_BINS, TCV_LABELS
+
+# Metrics of every epoch of an epoch cube against the true ratings of the
+#   test users, so that epochs can be compared, and selected, without running
+#   format.py once per epoch,
+#
+#   python3 evaluate.py CUBE [--testing ../data/jester-data-testing.csv]
+#                            [--by mae] [--out metrics.npz] [--all-epochs]
+#
+#   - mae, rmse: (n_epoch,) errors over every estimate of the epoch
+#   - tcv: (n_epoch, 3) number of the ternary categories 'a', 'b', 'c' of
+#     the absolute errors, as in TCV_mlp of format.py
+#   - user_mae, user_rmse, user_max: (n_epoch, n_users) errors of every
+#     test user
+#
+# Epochs are ranked among the ones whose estimates are in the cube, as read
+#   by cube.run_epochs() from the run's epochs_*.pkl; the others are zero.
+#
+# The absolute errors of CHUNK_EPOCHS epochs are taken at once, broadcasting
+#   the true matrix over the epochs, so memory is bounded by the chunk and
+#   not the number of epochs.
+
+CHUNK_EPOCHS = 8
+
+# Score of every epoch by each metric, lower being better
+SELECT = {'mae': lambda m: m['mae'],
+          'rmse': lambda m: m['rmse'],
+          'a': lambda m: -m['tcv'][:, 0],
+          'c': lambda m: m['tcv'][:, 2],
+          'user_mae_median': lambda m: np.median(m['user_mae'], 1),
+          'user_mae_max': lambda m: m['user_mae'].max(1)}
+
+def evaluate(cube, true, chunk_epochs=CHUNK_EPOCHS):
+    """
+    Arguments:
+        - cube: str or np.array
+            Path of an epoch cube of cube.py, or the (n_epoch, n_users,
+            n_jokes) estimates.
+        - true: np.array
+            n_users x n_jokes true ratings.
+        - chunk_epochs: int, default CHUNK_EPOCHS
+            Number of epochs evaluated at a time.
+    Returns:
+        - dict of the metrics of every epoch; see above.
+    """
+    if isinstance(cube, str):
+        from cube import open_cube
+        cube = open_cube(cube)
+    true = np.asarray(true, dtype=np.float64)
+    n_epoch, n_users, n_jokes = cube.shape
+
+    out = {'mae': np.empty(n_epoch), 'rmse': np.empty(n_epoch),
+           'tcv': np.empty((n_epoch, len(TCV_LABELS)), dtype=np.int64),
+           'user_mae': np.empty((n_epoch, n_users)),
+           'user_rmse': np.empty((n_epoch, n_users)),
+           'user_max': np.empty((n_epoch, n_users))}
+    for lo in range(0, n_epoch, chunk_epochs):
+        e = slice(lo, min(lo + chunk_epochs, n_epoch))
+        ae = np.abs(np.asarray(cube[e], dtype=np.float64) - true)
+
+        out['user_mae'][e] = ae.mean(2)
+        out['user_rmse'][e] = np.sqrt((ae * ae).mean(2))
+        out['user_max'][e] = ae.max(2)
+        out['mae'][e] = out['user_mae'][e].mean(1)
+        out['rmse'][e] = np.sqrt((out['user_rmse'][e] ** 2).mean(1))
+
+        # Number of errors under every bound; a category is the difference
+        #   of two
+        below = np.stack([np.zeros(len(ae), dtype=np.int64)]
+                         + [(ae < b).sum((1, 2)) for b in TCV_BINS]
+                         + [np.full(len(ae), n_users * n_jokes)], 1)
+        out['tcv'][e] = np.diff(below, axis=1)
+    return out
+
+def best_epoch(metrics, by='mae', epochs=None):
+    """
+    Arguments:
+        - metrics: dict
+            Metrics of evaluate().
+        - by: str, default 'mae'
+            Name of a score of SELECT.
+        - epochs: list, default None
+            Epochs to choose from, e.g. cube.predicted_epochs(); the others
+            of a cube are zero. None is every epoch.
+    Returns:
+        - int, the epoch with the lowest score.
+    """
+    score = SELECT[by](metrics)
+    if epochs is None:
+        return int(np.argmin(score))
+    epochs = np.asarray(epochs)
+    return int(epochs[np.argmin(score[epochs])])
+
+def save(fn, metrics):
+    'Save the metrics of evaluate() as a .npz file'
+    np.savez(fn, **metrics)
+
+def load(fn):
+    'Metrics saved by save()'
+    with np.load(fn) as npz:
+        return {n: npz[n] for n in npz.files}
+
+def summarize(metrics, by='mae', top=10, epochs=None):
+    """
+    Print the best epochs by `by`, and the best epoch by every score, among
+    `epochs`; see best_epoch().
+    """
+    epochs = np.arange(len(metrics['mae'])) if epochs is None else epochs
+    epochs = np.asarray(epochs)
+    order = epochs[np.argsort(SELECT[by](metrics)[epochs], kind='stable')]
+    order = order[:top]
+    print('{:>6}{:>10}{:>10}{:>8}{:>8}{:>8}{:>12}'
+          .format('epoch', 'MAE', 'RMSE', 'a', 'b', 'c', 'worst user'))
+    for n in order:
+        print('{:>6}{:>10.4f}{:>10.4f}{:>8}{:>8}{:>8}{:>12.4f}'
+              .format(n, metrics['mae'][n], metrics['rmse'][n],
+                      *metrics['tcv'][n], metrics['user_mae'][n].max()))
+    print()
+    best = ['{}: {}'.format(s, best_epoch(metrics, s, epochs))
+            for s in SELECT]
+    print('Best epoch by ' + ', '.join(best))
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cube', help='epoch cube, e.g. pkl/ests_90_150_ts.npy')
+    parser.add_argument('--testing', default='../data/jester-data-testing.csv',
+                        help='true ratings')
+    parser.add_argument('--by', choices=sorted(SELECT), default='mae')
+    parser.add_argument('--chunk-epochs', type=int, default=CHUNK_EPOCHS)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--out', default=None, help='.npz of the metrics')
+    parser.add_argument('--all-epochs', action='store_true',
+                        help='rank every epoch, not only the ones predicted '
+                             'by the run')
+    a = parser.parse_args()
+
+    from cube import run_epochs
+    metrics = evaluate(a.cube, pd.read_csv(a.testing).values[:, 1:],
+                       a.chunk_epochs)
+    summarize(metrics, a.by, a.top, None if a.all_epochs
+              else run_epochs(a.cube))
+    if a.out:
+        save(a.out, metrics)
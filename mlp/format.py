@@ -3,9 +3,13 @@ import numpy as np
 import pickle
 import os
 import sys
+from pivot import reorder
+from cube import load_epochs, predicted_epochs
+from evaluate import SELECT, evaluate, best_epoch
+from outputs import TCV_LABELS, TCV_BINS, FORMATS, write_outputs
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))    # Set path
-np.set_printoptions(linewidth=200, threshold=np.nan, suppress=True)
+np.set_printoptions(linewidth=200, threshold=sys.maxsize, suppress=True)
 
 # Produce outputs with specified formats for each training size.
 #
@@ -50,16 +54,90 @@ np.set_printoptions(linewidth=200, threshold=np.nan, suppress=True)
 #  7   x    x    x    x   ...   x
 # ...
 
-def main(p, n_epoch, ts, testing300 = '../data/jester-data-testing.csv'):
+def genTCV(ae):
+    """
+    Ternary categorical variables of absolute errors.
+
+    Arguments:
+        - ae: np.array
+            Absolute errors, of any shape.
+    Returns:
+        - np.array of 'a' (< 3), 'b' ([3, 6)), or 'c' (>= 6) of the same
+          shape.
+    """
+    return TCV_LABELS[np.digitize(ae, TCV_BINS)]
+
+def genReport(ests, true, comps):
+    """
+    Compute the content of every output file.
+
+    The recommendation order is computed once and applied to the estimates,
+    the true values, and the absolute errors of every estimator.
+
+    Note: the absolute errors of the comparison estimators are taken against
+    the true values in recommendation order, not the original order, which
+    is what the output files have always contained.
+
+    Arguments:
+        - ests: np.array
+            300 x 100 matrix of estimates.
+        - true: np.array
+            300 x 100 matrix of true ratings.
+        - comps: dict
+            {name: 300 x 100 matrix} of comparison estimates, e.g. 'unif'.
+    Returns:
+        - dict {file name without .csv: 300 x 100 matrix}
+    """
+    # negative b/c argsort gives increasing order
+    order = np.argsort(-ests)
+    true_ord = reorder(true, order)
+
+    names = list(comps)
+    comps = np.stack([comps[n] for n in names])
+    # mlp first, then the comparison estimators in one batch
+    ae = np.concatenate([reorder(np.abs(ests - true), order)[np.newaxis],
+                         reorder(np.abs(comps - true_ord), order)])
+    tcv = genTCV(ae)
+
+    report = {'recommendation': order + 1,  # add 1 b/c jID starts from 1
+              'EST_mlp': reorder(ests, order),
+              'TRUE_mlp': true_ord}
+    for i, n in enumerate(['mlp'] + names):
+        report['AE_' + n] = ae[i]
+        report['TCV_' + n] = tcv[i]
+
+    return report
+
+def nABC(tcv):
+    'Print the number of each ternary category'
+    print('Ternary Count: a: {}\tb: {}\tc: {}'
+          .format(*[np.sum(tcv == c) for c in TCV_LABELS]))
+
+# Comparison estimators and their files
+COMPARE = {'unif': '../data/compare_uniform.csv',
+           'tavg': '../data/compare_totalAVG.csv',
+           'uavg': '../data/compare_userAVG.csv'}
+
+def loadInputs(testing300='../data/jester-data-testing.csv'):
+    """
+    Arguments:
+        - testing300: str, default '../data/jester-data-testing.csv'
+            True ratings of the test users.
+    Returns:
+        - tuple (mtx_true, testuIDs, comps) of the 300 x 100 true ratings,
+          the sorted test uIDs, and the `comps` of genReport().
+    """
     mtx_true = pd.read_csv(testing300)
     testuIDs = np.sort(mtx_true.UserID.unique())
-    testuIDs = testuIDs.reshape([1, 300])
     mtx_true = mtx_true.values[:, 1:]
 
-    # Comparison files
-    tavg = pd.read_csv('../data/compare_totalAVG.csv').values
-    unif = pd.read_csv('../data/compare_uniform.csv').values
-    uavg = pd.read_csv('../data/compare_userAVG.csv').values
+    comps = {n: pd.read_csv(fn).values[:, 1:] for n, fn in COMPARE.items()}
+
+    return mtx_true, testuIDs, comps
+
+def main(p, n_epoch, ts, testing300 = '../data/jester-data-testing.csv',
+         out='both', select=None):
+    mtx_true, testuIDs, comps = loadInputs(testing300)
 
     # Number of ratings in each pair
     n_ratings = {'30': np.matrix([21000, 9000]),
@@ -67,43 +145,50 @@ def main(p, n_epoch, ts, testing300 = '../data/jester-data-testing.csv'):
                  '90': np.matrix([2400, 2700, 2700, 2700, 2700, 2400,
                                   2400, 2400, 2400, 2400, 2400, 2400])}[str(p)]
 
-    with open('pkl/ests_{}_{}_{}.pkl'.format(p, n_epoch, ts), 'rb') as f:
-        ests = pickle.load(f)
     with open('pkl/mae_tr_{}_{}_{}.pkl'.format(p, n_epoch, ts), 'rb') as f:
         mae_tr = pickle.load(f)
     with open('pkl/mae_va_{}_{}_{}.pkl'.format(p, n_epoch, ts), 'rb') as f:
         mae_va = pickle.load(f)
 
-    # Find optimal epoch
-    epoch = np.matmul(n_ratings, mae_va).argmin()
+    # Runs from before the epoch cube have all epochs pickled instead.
+    fn = 'pkl/ests_{}_{}_{}'.format(p, n_epoch, ts)
+    if os.path.exists(fn + '.npy'):
+        cube = fn + '.npy'
+    else:
+        with open(fn + '.pkl', 'rb') as f:
+            cube = np.asarray(pickle.load(f))
+
+    # Newer runs of train_mlp record the optimal epoch along with the epoch
+    #   training stopped at and predict_every.
+    fn = 'pkl/epochs_{}_{}_{}.pkl'.format(p, n_epoch, ts)
+    epochs = None
+    if os.path.exists(fn):
+        with open(fn, 'rb') as f:
+            epochs = pickle.load(f)
+
+    # Find optimal epoch: by a metric of evaluate.py if `select` is given,
+    #   over the epochs whose estimates are in the cube
+    if select is not None:
+        predicted = None
+        if epochs is not None:
+            predicted = predicted_epochs(n_epoch,
+                                         epochs.get('predict_every', 1),
+                                         epochs['stop_epoch'],
+                                         epochs['best_epoch'])
+        epoch = best_epoch(evaluate(cube, mtx_true), select, predicted)
+    elif epochs is not None:
+        epoch = epochs['best_epoch']
+        if epochs['stop_epoch'] is not None:
+            print('Stopped at Epoch:', epochs['stop_epoch'])
+    else:
+        epoch = np.matmul(n_ratings, mae_va).argmin()
     print('Optimal Epoch:', epoch)
-    ests = ests[epoch]
-
-    # Generate absolute error matrix
-    def genAE(ests, true, cols):
-        mtx = np.abs(ests - true)
-        # order them the same way as recoms
-        for i in range(300):
-            ind = recoms.values[i, 1:101] - 1
-            mtx[i, ] = mtx[i, ind]
-
-        dt = pd.DataFrame(mtx)
-        dt.insert(0, '_', testuIDs[0])
-        dt.columns = cols
-
-        return dt
-
-    def genTCV(ae):
-        tcv = ae.copy()
-        tcv[tcv[tcv.columns[1:]] < 3] = -1
-        tcv[(tcv[tcv.columns[1:]] >= 3) & (tcv[tcv.columns[1:]] < 6)] = -2
-        tcv[tcv[tcv.columns[1:]] >= 6] = -3
-        tcv.replace(-1, 'a', inplace=True)
-        tcv.replace(-2, 'b', inplace=True)
-        tcv.replace(-3, 'c', inplace=True)
-        assert(np.all(tcv[tcv.columns[1:]].isin(['a','b','c']).all()))
-
-        return tcv
+
+    # Only the optimal epoch is read from the epoch cube.
+    if isinstance(cube, str):
+        ests = load_epochs(cube, epoch)
+    else:
+        ests = cube[epoch]
 
     def safe_mkdir(dn):
         try:
@@ -117,78 +202,22 @@ def main(p, n_epoch, ts, testing300 = '../data/jester-data-testing.csv'):
     dn = '{}/{}_{}/'.format(dn, p, epoch)
     safe_mkdir(dn)
 
-    cols = ['uID'] + ['rec' + str(i+1) for i in range(100)]
-
-    # recommendations.csv
-    # negative b/c argsort gives increasing order; add 1 b/c jID starts from 1
-    recoms = np.argsort(-ests) + 1
-    recoms = np.hstack((testuIDs.T, recoms))
-    recoms = pd.DataFrame(recoms, columns=cols)
-    recoms.to_csv(dn + 'recommendation.csv', sep=',', index=False)
-
-    # AE_mlp.csv
-    ae_mlp = genAE(ests, mtx_true, cols)
-    ae_mlp.to_csv(dn + 'AE_mlp.csv', sep=',', index=False)
-
-    # EST_mlp.csv
-    # Negative b/c argsort gives increasing order; * (-1) to restore the signs
-    est_mlp = np.sort(-ests) * (-1)
-    est_mlp = pd.DataFrame(est_mlp)
-    est_mlp.insert(0, '_', testuIDs[0])
-    est_mlp.columns = cols
-    est_mlp.to_csv(dn + 'EST_mlp.csv', sep=',', index=False)
-
-    # TRUE_mlp.csv
-    true_mlp = mtx_true
-    # order them the same way as recoms
-    for i in range(300):
-        ind = recoms.values[i, 1:101] - 1
-        true_mlp[i, ] = true_mlp[i, ind]
-    true_mlp = pd.DataFrame(true_mlp)
-    true_mlp.insert(0, '_', testuIDs[0])
-    true_mlp.columns = cols
-    true_mlp.to_csv(dn + 'TRUE_mlp.csv', sep=',', index=False)
-
-    # TCV_mlp.csv
-    tcv_mlp = genTCV(ae_mlp)
-    tcv_mlp.to_csv(dn + 'TCV_mlp.csv', sep=',', index=False)
-
-    # AE_unif.csv
-    ae_unif = genAE(unif[:, 1:101], mtx_true, cols)
-    ae_unif.to_csv(dn + 'AE_unif.csv', sep=',', index=False)
-
-    # AE_tavg.csv
-    ae_tavg = genAE(tavg[:, 1:101], mtx_true, cols)
-    ae_tavg.to_csv(dn + 'AE_tavg.csv', sep=',', index=False)
-
-    # AE_uavg.csv
-    ae_uavg = genAE(uavg[:, 1:101], mtx_true, cols)
-    ae_uavg.to_csv(dn + 'AE_uavg.csv', sep=',', index=False)
-
-    # TCV_unif.csv
-    tcv_unif = genTCV(ae_unif)
-    tcv_unif.to_csv(dn + 'TCV_unif.csv', sep=',', index=False)
-
-    # TCV_tavg.csv
-    tcv_tavg = genTCV(ae_tavg)
-    tcv_tavg.to_csv(dn + 'TCV_tavg.csv', sep=',', index=False)
-
-    # TCV_uavg.csv
-    tcv_uavg = genTCV(ae_uavg)
-    tcv_uavg.to_csv(dn + 'TCV_uavg.csv', sep=',', index=False)
-
-    def nABC(tcv):
-        print('Ternary Count: a: {}\tb: {}\tc: {}'
-                 .format(np.sum(np.sum(tcv[cols[1:]] == 'a')),
-                         np.sum(np.sum(tcv[cols[1:]] == 'b')),
-                         np.sum(np.sum(tcv[cols[1:]] == 'c'))))
-    nABC(tcv_mlp)
+    report = genReport(ests, mtx_true, comps)
+
+    # report.npz and/or the CSVs; see outputs.py
+    write_outputs(dn, report, testuIDs, out)
+
+    nABC(report['TCV_mlp'])
 
 if __name__ == '__main__':
-    if len(sys.argv) != 4:
+    if (len(sys.argv) not in [4, 5, 6]
+            or (len(sys.argv) >= 5 and sys.argv[4] not in FORMATS)
+            or (len(sys.argv) == 6 and sys.argv[5] not in SELECT)):
         print('Must follow the following format:')
-        print('python3 train_mlp.py {30, 60, 90} '
-              '{n_epoch} {timestamp, \"current\"}')
+        print('python3 format.py {30, 60, 90} '
+              '{n_epoch} {timestamp, \"current\"} [{npz, csv, both}] '
+              '[{' + ', '.join(sorted(SELECT)) + '}]')
     else:
-        main(int(sys.argv[1]), int(sys.argv[2]), sys.argv[3])
-
+        main(int(sys.argv[1]), int(sys.argv[2]), sys.argv[3],
+             out=(sys.argv[4:] or ['both'])[0],
+             select=(sys.argv[5:] or [None])[0])
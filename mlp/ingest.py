@@ -0,0 +1,212 @@
+import os
+import re
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+
+# Wide Jester rating matrices to long binary shards, BLOCK_USERS users at a
+#   time, so memory does not grow with the size of the CSVs,
+#
+#   python3 ingest.py ../data/jester-data-{1,2,3}.csv [--out ingest]
+#
+#   ingest/
+#     |____ shard00000/
+#     |       |____ uID.npy      int32
+#     |       |____ jID.npy      int16
+#     |       |____ rating.npy   float32, unshifted
+#     |       |____ users.npy    int32, uIDs of the block's users
+#     |       |____ nRated.npy   int16, number of ratings of each of them
+#     |____ shard00001/ ...
+#     |____ meta.json            sources, counts, and dtypes of the shards
+#
+# Two layouts of CSV are read:
+#   - raw: no header, every row a user with the number of jokes rated and
+#     then the rating of every joke; uIDs count from 1 across the files, as
+#     in nmf.R's dataProcessing().
+#   - testing: a header of UserID, J1, J2, ..., like jester-data-testing.csv;
+#     uIDs are the UserIDs plus 1, as in nmf.R.
+# In both, 99 is unrated; the unrated cells are dropped, and the counts of
+#   the raw layout's first column are recomputed. Rows of a shard are in the
+#   order of the CSV's rows and then by jID, like the rows of cvout.
+#
+# meta.json is written last, so a half-written directory is never taken as
+#   complete. Only a directory of shards and meta.json is replaced, so a
+#   mistyped --out never deletes another directory. The peak memory is that of a block: see fix_mmap_threshold().
+
+BLOCK_USERS = 20000
+UNRATED = 99
+DTYPES = {'uID': np.int32, 'jID': np.int16, 'rating': np.float32}
+COUNT_DTYPES = {'users': np.int32, 'nRated': np.int16}
+M_MMAP_THRESHOLD = -3           # mallopt() parameter of glibc's malloc.h
+MMAP_THRESHOLD = 128 * 1024     # its initial value
+
+def is_testing(fn):
+    'Whether a CSV has the header of jester-data-testing.csv'
+    with open(fn) as f:
+        return f.readline().startswith('UserID')
+
+def read_blocks(csvs, block_users=BLOCK_USERS):
+    """
+    Stream the users of wide Jester CSVs of either layout.
+
+    Arguments:
+        - csvs: list
+            Paths of the CSVs, in uID order.
+        - block_users: int, default BLOCK_USERS
+            Number of users per block.
+    Returns:
+        - generator of (uIDs, ratings) of every block: m uIDs and the m x
+          n_jokes ratings, with NaN for unrated.
+    """
+    lo = 0
+    for fn in csvs:
+        testing = is_testing(fn)
+        # Every column as float64, so the block is copied out of the
+        #   parser's columns once, and not again by astype()
+        for df in pd.read_csv(fn, header=0 if testing else None,
+                              chunksize=block_users, dtype=np.float64):
+            X = df.to_numpy()
+            R = X[:, 1:]
+            R[R == UNRATED] = np.nan
+            if testing:
+                uIDs = X[:, 0].astype(int) + 1
+            else:
+                uIDs = np.arange(lo + 1, lo + len(R) + 1)
+            yield uIDs, R
+            lo += len(R)
+
+def to_long(uIDs, R):
+    """
+    Arguments:
+        - uIDs: np.array
+            m uIDs.
+        - R: np.array
+            m x n_jokes ratings, with NaN for unrated.
+    Returns:
+        - dict {'uID', 'jID', 'rating'} of the rated cells, row by row, and
+          {'users', 'nRated'} of the number of ratings of every user.
+    """
+    rated = ~np.isnan(R)
+    u, j = np.nonzero(rated)
+    cols = {'uID': uIDs[u], 'jID': j + 1, 'rating': R[u, j]}
+    cols = {c: v.astype(DTYPES[c]) for c, v in cols.items()}
+    cols['users'] = uIDs.astype(COUNT_DTYPES['users'])
+    cols['nRated'] = rated.sum(1).astype(COUNT_DTYPES['nRated'])
+    return cols
+
+def fix_mmap_threshold(nbytes=MMAP_THRESHOLD):
+    """
+    Keep glibc's malloc from raising its mmap threshold, so every buffer of
+    a block over `nbytes` is mapped on its own and returned to the OS when
+    freed. By default the threshold rises to the size of the largest buffer
+    freed, the next blocks' buffers are carved from the heap instead, and
+    its fragmentation makes the peak memory grow with the number of blocks.
+    Does nothing on other C libraries.
+    """
+    import ctypes
+    try:
+        ctypes.CDLL('libc.so.6').mallopt(M_MMAP_THRESHOLD, nbytes)
+    except (OSError, AttributeError):
+        pass
+
+def shard_path(dn, k):
+    return os.path.join(dn, 'shard{:05d}'.format(k))
+
+def ingest(csvs, out='ingest', block_users=BLOCK_USERS):
+    """
+    Arguments:
+        - csvs: list
+            Paths of the wide CSVs, in uID order.
+        - out: str, default 'ingest'
+            Directory of the shards; replaced if it is one of an earlier
+            ingest(). Any other directory must be empty or not exist.
+        - block_users: int, default BLOCK_USERS
+            Number of users per block, and so per shard.
+    Returns:
+        - dict of meta.json: 'shards', 'users', 'ratings', 'seconds', and
+          'rows_per_sec', the wide rows read per second.
+    """
+    t0 = time.perf_counter()
+    fix_mmap_threshold()
+    if os.path.isdir(out) and not all(re.match(r'shard\d{5}$|meta.json$', fn)
+                                      for fn in os.listdir(out)):
+        raise ValueError('{} is not a directory of ingest(); not replacing '
+                         'it'.format(out))
+    shutil.rmtree(out, ignore_errors=True)
+    os.makedirs(out)
+
+    n_users, n_ratings, k = 0, 0, 0
+    for uIDs, R in read_blocks(csvs, block_users):
+        dn = shard_path(out, k)
+        os.makedirs(dn)
+        cols = to_long(uIDs, R)
+        for c, v in cols.items():
+            np.save(os.path.join(dn, c + '.npy'), v)
+        n_users += len(uIDs)
+        n_ratings += len(cols['uID'])
+        k += 1
+
+    seconds = time.perf_counter() - t0
+    meta = {'sources': [os.path.abspath(fn) for fn in csvs], 'shards': k,
+            'users': n_users, 'ratings': n_ratings,
+            'dtypes': {c: np.dtype(t).name
+                       for c, t in list(DTYPES.items())
+                       + list(COUNT_DTYPES.items())},
+            'seconds': seconds, 'rows_per_sec': n_users / seconds}
+    with open(os.path.join(out, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    print('users: {}\tratings: {}\tshards: {}\ttime: {:.1f}s\t'
+          '{:.0f} rows/sec\t{:.0f} ratings/sec'
+          .format(n_users, n_ratings, k, seconds, n_users / seconds,
+                  n_ratings / seconds))
+    return meta
+
+def shards(dn='ingest', mmap=True):
+    """
+    Arguments:
+        - dn: str, default 'ingest'
+            Directory of ingest().
+        - mmap: boolean, default True
+            Whether to memory map the columns instead of reading them.
+    Returns:
+        - generator of the dict {'uID', 'jID', 'rating', 'users', 'nRated'}
+          of np.array of every shard.
+    """
+    with open(os.path.join(dn, 'meta.json')) as f:
+        meta = json.load(f)
+    for k in range(meta['shards']):
+        yield {c: np.load(os.path.join(shard_path(dn, k), c + '.npy'),
+                          mmap_mode='r' if mmap else None)
+               for c in list(DTYPES) + list(COUNT_DTYPES)}
+
+def load(dn='ingest'):
+    """
+    Load every shard as the long table of nmf.R's dataProcessing().
+
+    Arguments:
+        - dn: str, default 'ingest'
+            Directory of ingest().
+    Returns:
+        - pandas.dataframe with columns uID, jID, rating, nRated; ratings are
+          unshifted.
+    """
+    dfs = []
+    for s in shards(dn, mmap=False):
+        n = np.repeat(s['nRated'], s['nRated'])
+        dfs.append(pd.DataFrame({'uID': s['uID'], 'jID': s['jID'],
+                                 'rating': s['rating'], 'nRated': n}))
+    return pd.concat(dfs, ignore_index=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('csvs', nargs='+', help='wide Jester CSVs')
+    parser.add_argument('--out', default='ingest')
+    parser.add_argument('--block-users', type=int, default=BLOCK_USERS,
+                        help='users per block and shard')
+    a = parser.parse_args()
+
+    ingest(a.csvs, a.out, a.block_users)
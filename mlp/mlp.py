@@ -1,4 +1,5 @@
 import os
+import sys
 from datetime import datetime
 import numpy as np
 from tensorflow import set_random_seed
@@ -12,6 +13,7 @@ from keras.regularizers import l2
 import keras.backend as K
 
 from DataGenerator import *
+import vocab
 
 np.random.seed(9999)
 set_random_seed(9999)
@@ -20,7 +22,7 @@ logging.set_verbosity(logging.ERROR)        # suppress TF warnings
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'    # suppress TF warnings
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))    # Set path
-np.set_printoptions(linewidth=250, threshold=np.nan, suppress=True)
+np.set_printoptions(linewidth=250, threshold=sys.maxsize, suppress=True)
 
 # Reference:
 #   - https://github.com/hexiangnan/neural_collaborative_filtering
@@ -30,7 +32,7 @@ class Mlp(object):
     def __init__(self, train, val, lr, batch_size=4096, activation=LeakyReLU,
                  layer_sizes=[(16, 3), 200, 100], dropout=False, bNorm=True,
                  regularizer=None, verbose=False, verbose_fit=1, useGen=False,
-                 shuffle=False):
+                 shuffle=False, arrayGen=False, prefetch=0, keepTail=False):
         """
         Initialize parameters required for training and testing the network.
         Structure:
@@ -85,11 +87,26 @@ class Mlp(object):
                 fit_generator() is used if True; otherwise, fit() is used.
             - shuffle: boolean, default False
                 Whether to shuffle the order of dataset.
+            - arrayGen: boolean, default False
+                Use ArrayGenerator instead of DataGenerator with useGen.
+            - prefetch: int, default 0
+                Number of batches ArrayGenerator prefetches on a thread.
+            - keepTail: boolean, default False
+                Whether ArrayGenerator yields the last, partial batch.
+
+        The uIDs and jIDs are fed to the network as their dense indices in
+        self.vocabs, the vocabularies of `train`; see vocab.py. Use predict()
+        to predict with IDs.
+
         Returns:
             - None
         """
         self.tr = train
         self.va = val
+        self.vocabs = vocab.fit(train)
+        # Same sets with the IDs as indices, which the network is fitted on
+        self.tr_idx = vocab.transform(train, self.vocabs)
+        self.va_idx = vocab.transform(val, self.vocabs)
         self.lr = lr
         self.bs = batch_size
         self.a = activation
@@ -103,7 +120,11 @@ class Mlp(object):
         self.shuffle = shuffle
 
         self.model = None
-        self.trGen = DataGenerator(train, batch_size, shuffle)
+        if arrayGen:
+            self.trGen = ArrayGenerator(self.tr_idx, batch_size, shuffle,
+                                        prefetch, keepTail)
+        else:
+            self.trGen = DataGenerator(self.tr_idx, batch_size, shuffle)
 
     def new_model(self):
         """
@@ -115,11 +136,11 @@ class Mlp(object):
         input_uid = Input(shape=(1,), dtype='int32', name='input_uid')
         input_jid = Input(shape=(1,), dtype='int32', name='input_jid')
 
-        embedding_uid = Embedding(input_dim=self.tr['uID'].max() + 1,
+        embedding_uid = Embedding(input_dim=len(self.vocabs['uID']),
                                   output_dim=emb_dim[0], input_length=1,
                                   embeddings_regularizer=self.reg,
                                   name='embedding_uid')
-        embedding_jid = Embedding(input_dim=self.tr['jID'].max() + 1,
+        embedding_jid = Embedding(input_dim=len(self.vocabs['jID']),
                                   output_dim=emb_dim[1], input_length=1,
                                   embeddings_regularizer=self.reg,
                                   name='embedding_jid')
@@ -159,15 +180,23 @@ class Mlp(object):
         self.model = Model(inputs=[input_uid, input_jid], outputs=out)
 
 
-    def train_model(self, n_epoch=150, callbacks=None):
+    def train_model(self, n_epoch=150, callbacks=None, initial_epoch=0):
         """
         Train self.model with dataset stored in attributes.
         Arguments:
             - n_epoch: int, default 150
-                Number of epochs to train.
+                Index of the epoch to stop training at, i.e. the number of
+                epochs when starting from 0.
             - callbacks: list, default None
                 List of keras.callbacks.Callback objects to run
+            - initial_epoch: int, default 0
+                Epoch to start from. The model is compiled only when it is 0,
+                so calling this again with initial_epoch = the previous
+                n_epoch continues training with the same optimizer state.
         """
+        if initial_epoch > 0:
+            self.fit(n_epoch, callbacks, initial_epoch)
+            return
 
         if self.verbose:
             print("Learning Rate:\t", self.lr)
@@ -185,21 +214,59 @@ class Mlp(object):
         self.model.compile(optimizer=Adam(lr=self.lr, decay=.001),
                            loss='mean_squared_error', metrics=['mae'])
 
-        valX = [self.va.uID, self.va.jID]
-        valy = self.va.iloc[:, 2]
+        self.fit(n_epoch, callbacks)
+
+    def fit(self, n_epoch, callbacks=None, initial_epoch=0):
+        """
+        Run Keras fit() or fit_generator() on the compiled self.model.
+        Arguments are the same as train_model().
+        """
+        valX = [self.va_idx.uID, self.va_idx.jID]
+        valy = self.va_idx.iloc[:, 2]
 
         if self.useGen:
+            if isinstance(self.trGen, ArrayGenerator):
+                # Workers attach to the arrays instead of copying them
+                self.trGen.share()
             self.hist = self.model.fit_generator(generator=self.trGen,
                                                  validation_data=(valX, valy),
                                                  epochs=n_epoch,
                                                  verbose=self.verbose_fit,
                                                  use_multiprocessing=True,
                                                  workers=5,
-                                                 callbacks=callbacks)
+                                                 callbacks=callbacks,
+                                                 initial_epoch=initial_epoch)
         else:
-            self.hist = self.model.fit([self.tr.uID, self.tr.jID],
-                                       self.tr.iloc[:, 2], epochs=n_epoch,
+            self.hist = self.model.fit([self.tr_idx.uID, self.tr_idx.jID],
+                                       self.tr_idx.iloc[:, 2], epochs=n_epoch,
                                        verbose=self.verbose_fit,
                                        validation_data=(valX, valy),
                                        batch_size=self.bs,
-                                       callbacks=callbacks)
+                                       callbacks=callbacks,
+                                       initial_epoch=initial_epoch)
+
+    def predict(self, X, batch_size=None):
+        """
+        Arguments:
+            - X: list
+                [uIDs, jIDs]; IDs not in the training set get the OOV rows.
+            - batch_size: int, default None
+                Batch size of Keras predict(). None uses its default of 32.
+        Returns:
+            - np.array of shape n x 1 of estimated ratings.
+        """
+        return self.model.predict(vocab.index(X, self.vocabs),
+                                  batch_size=batch_size)
+
+    def save(self, fn):
+        'Save self.model to a .h5 file, with its vocabularies'
+        self.model.save(fn)
+        vocab.save(fn, self.vocabs)
+
+    def close(self):
+        """
+        Release what was set up for training, i.e. the shared arrays of an
+        ArrayGenerator. Call it once done training.
+        """
+        if isinstance(self.trGen, ArrayGenerator):
+            self.trGen.close()
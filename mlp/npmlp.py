@@ -0,0 +1,440 @@
+import os
+import json
+import numpy as np
+import vocab
+
+# NumPy inference of the model built by Mlp.new_model(), so that scoring does
+#   not need keras/tensorflow.
+#
+# export() walks the Keras graph and folds every BatchNormalization into the
+#   weights next to it:
+#   - after an embedding: into the embedding table, E' = E * s + t,
+#   - after a hidden layer's activation: into the next Dense layer,
+#     W' = s[:, None] * W and b' = b + t @ W,
+#   where s = gamma / sqrt(var + eps) and t = beta - mean * s; Dropout and
+#   Flatten are dropped. What is left is written to a directory,
+#
+#   model/
+#     |____ model.json    layer activations and array shapes
+#     |____ emb_uid.npy   float32 n_users x d_uid, row = uID index
+#     |____ emb_jid.npy   float32 n_jokes x d_jid, row = jID index
+#     |____ W0.npy, b0.npy, W1.npy, b1.npy, ...   Dense layers
+#     |____ vocab_uID.npy, vocab_jID.npy   vocabularies; see vocab.py
+#
+# which NpMlp opens with memory mapping. NpMlp takes IDs, like Mlp.predict(),
+#   and looks up their indices in the vocabularies.
+#
+# quantize() converts an export to a smaller one with the same layout:
+#   - emb_*.npy as int8 with a float32 scale per row in emb_*_scale.npy,
+#   - W*.npy as int8 with a float32 scale per output column in W*_scale.npy,
+#     or as float16,
+#   and 'quant' in model.json. Every process that opens the same export
+#   with memory mapping shares one page-cache copy of the embedding tables,
+#   the only large arrays; rows are dequantized as they are looked up. The
+#   dense weights are dequantized to float32 once at load, as they are
+#   ~100KB and matmul is much faster on float32.
+
+SPEC = 'model.json'
+
+def _inbound(layer):
+    'Layers that feed `layer`, for both Keras 2.0 and 2.2 attribute names'
+    nodes = getattr(layer, '_inbound_nodes', None)
+    if nodes is None:
+        nodes = layer.inbound_nodes
+    return [l for node in nodes for l in node.inbound_layers]
+
+def _act_spec(layer):
+    """
+    Returns:
+        - list [name, alpha] of an activation layer or of the activation of
+          a Dense layer; None if it is linear.
+    """
+    kind = type(layer).__name__
+    cfg = layer.get_config()
+    if kind == 'LeakyReLU':
+        return ['leaky_relu', float(cfg['alpha'])]
+    if kind == 'ELU':
+        return ['elu', float(cfg['alpha'])]
+    name = cfg['activation']
+    if name == 'linear':
+        return None
+    if name not in ['relu', 'elu', 'tanh', 'sigmoid']:
+        raise ValueError('Cannot export activation {}'.format(name))
+    return [name, 1.]
+
+def _bn(layer):
+    'Scale and shift of a BatchNormalization layer at inference'
+    cfg = layer.get_config()
+    w = list(layer.get_weights())
+    gamma = w.pop(0) if cfg['scale'] else 1.
+    beta = w.pop(0) if cfg['center'] else 0.
+    mean, var = w
+    s = gamma / np.sqrt(var + cfg['epsilon'])
+    return s, beta - mean * s
+
+def export(model, dn, vocabs=None):
+    """
+    Export a Keras model built by Mlp.new_model() with BatchNormalization
+    folded in.
+
+    Arguments:
+        - model: keras.models.Model or str
+            The model, e.g. Mlp.model, or the path of its .h5 file.
+        - dn: str
+            Output directory.
+        - vocabs: dict, default None
+            Vocabularies of the model, e.g. Mlp.vocabs. None reads them from
+            the .h5 file, or takes the IDs as the indices if there are none.
+    """
+    if isinstance(model, str):
+        import keras
+        if vocabs is None:
+            vocabs = vocab.load(model)
+        model = keras.models.load_model(model)
+    if vocabs is None:
+        vocabs = vocab.keras_identity(model)
+
+    consumers = {}
+    for l in model.layers:
+        for src in _inbound(l):
+            consumers.setdefault(src.name, []).append(l)
+
+    def after(layer):
+        'Layers after `layer` in the chain, up to the model output'
+        out = []
+        while layer.name in consumers:
+            layer = consumers[layer.name][0]
+            out.append(layer)
+        return out
+
+    # Embedding -> [BatchNormalization] -> Flatten -> Concatenate
+    embs = []
+    for name in ['embedding_uid', 'embedding_jid']:
+        layer = model.get_layer(name)
+        E = layer.get_weights()[0]
+        for l in after(layer):
+            kind = type(l).__name__
+            if kind == 'Concatenate':
+                break
+            elif kind == 'BatchNormalization':
+                s, t = _bn(l)
+                E = E * s + t
+            elif kind != 'Flatten':
+                raise ValueError('Cannot export layer {}'.format(l.name))
+        embs.append(E)
+
+    # Concatenate -> (Dense -> [activation] -> [BatchNormalization]
+    #   -> [Dropout]) x n -> Dense
+    concat = [l for l in model.layers if type(l).__name__ == 'Concatenate']
+    dense = []
+    bn = None   # scale and shift to fold into the next Dense layer
+    bn_name = None
+    for l in after(concat[0]):
+        kind = type(l).__name__
+        if kind == 'Dense':
+            W, b = l.get_weights()
+            if bn is not None:
+                b = b + bn[1] @ W
+                W = bn[0][:, np.newaxis] * W
+                bn = None
+            act = _act_spec(l)
+            dense.append({'W': W, 'b': b, 'acts': [act] if act else []})
+        elif kind in ['LeakyReLU', 'ELU', 'Activation']:
+            if bn is not None:
+                raise ValueError('Cannot fold {} across {}'
+                                 .format(bn_name, l.name))
+            act = _act_spec(l)
+            if act:
+                dense[-1]['acts'].append(act)
+        elif kind == 'BatchNormalization':
+            s, t = _bn(l)
+            bn = (s, t) if bn is None else (bn[0] * s, bn[1] * s + t)
+            bn_name = l.name
+        elif kind not in ['Dropout', 'Flatten']:
+            raise ValueError('Cannot export layer {}'.format(l.name))
+    if bn is not None:
+        raise ValueError('Cannot fold {} after the last Dense layer'
+                         .format(bn_name))
+
+    save(dn, embs[0], embs[1], dense, vocabs)
+
+def save(dn, emb_uid, emb_jid, dense, vocabs=None):
+    """
+    Write an exported model.
+
+    Arguments:
+        - dn: str
+            Output directory.
+        - emb_uid, emb_jid: np.array
+            Embedding tables with BatchNormalization folded in.
+        - dense: list
+            {'W', 'b', 'acts'} of every Dense layer in order, where acts is
+            a list of [name, alpha] applied after it.
+        - vocabs: dict, default None
+            Vocabularies of the embedding rows. None takes the IDs as the
+            indices.
+    """
+    arrays = {'emb_uid': emb_uid, 'emb_jid': emb_jid}
+    for i, d in enumerate(dense):
+        arrays['W{}'.format(i)] = d['W']
+        arrays['b{}'.format(i)] = d['b']
+    arrays = {n: np.asarray(a, np.float32) for n, a in arrays.items()}
+
+    _write(dn, arrays, {'acts': [d['acts'] for d in dense]})
+    if vocabs is not None:
+        vocab.save(dn, vocabs)
+
+def _write(dn, arrays, spec):
+    'Write the arrays of an export as they are, and its model.json'
+    os.makedirs(dn, exist_ok=True)
+    for name, a in arrays.items():
+        np.save(os.path.join(dn, name + '.npy'), a)
+
+    spec = dict(spec, shapes={n: list(a.shape) for n, a in arrays.items()},
+                dtypes={n: a.dtype.name for n, a in arrays.items()})
+    with open(os.path.join(dn, SPEC), 'w') as f:
+        json.dump(spec, f, indent=2)
+
+def quantize_rows(X):
+    """
+    Symmetric int8 quantization of every row of a matrix.
+
+    Returns:
+        - tuple (q, scale) of the int8 matrix and the float32 scale of every
+          row, so that X ~= q * scale[:, None].
+    """
+    X = np.asarray(X, np.float32)
+    scale = np.abs(X).max(1) / 127
+    scale[scale == 0] = 1
+    q = np.round(X / scale[:, np.newaxis]).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+def quantize(src, dn, dense='int8'):
+    """
+    Write a quantized copy of an export.
+
+    Arguments:
+        - src: str
+            Directory written by export().
+        - dn: str
+            Output directory.
+        - dense: str, default 'int8'
+            Format of the dense weights: 'int8' with a scale per output
+            column, or 'float16'.
+    """
+    assert(dense in ['int8', 'float16'])
+    m = NpMlp(src, mmap=False)
+    if m.quant:
+        raise ValueError('{} is quantized already'.format(src))
+
+    arrays = {}
+    for name in ['emb_uid', 'emb_jid']:
+        arrays[name], arrays[name + '_scale'] = quantize_rows(getattr(m, name))
+    for i, (W, b) in enumerate(zip(m.W, m.b)):
+        name = 'W{}'.format(i)
+        if dense == 'int8':
+            q, arrays[name + '_scale'] = quantize_rows(W.T)
+            arrays[name] = np.ascontiguousarray(q.T)
+        else:
+            arrays[name] = W.astype(np.float16)
+        arrays['b{}'.format(i)] = b
+
+    _write(dn, arrays, {'acts': m.acts,
+                        'quant': {'emb': 'int8', 'dense': dense}})
+    vocab.save(dn, m.vocabs)
+
+def _activate(h, act):
+    'Apply an activation [name, alpha] in place where possible'
+    name, alpha = act
+    if name == 'relu':
+        np.maximum(h, 0, out=h)
+    elif name == 'leaky_relu' and 0 <= alpha <= 1:
+        np.maximum(h, alpha * h, out=h)
+    elif name == 'leaky_relu':
+        h = np.where(h > 0, h, alpha * h)
+    elif name == 'elu':
+        h = np.where(h > 0, h, alpha * np.expm1(np.minimum(h, 0)))
+    elif name == 'tanh':
+        np.tanh(h, out=h)
+    elif name == 'sigmoid':
+        h = 1 / (1 + np.exp(-h))
+    return h
+
+class NpMlp(object):
+    """
+    Exported model; see export().
+    """
+    def __init__(self, dn, mmap=True):
+        """
+        Arguments:
+            - dn: str
+                Directory written by export().
+            - mmap: boolean, default True
+                Whether to memory map the arrays instead of reading them.
+        """
+        with open(os.path.join(dn, SPEC)) as f:
+            self.spec = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(dn, name + '.npy'),
+                           mmap_mode='r' if mmap else None)
+
+        self.acts = self.spec['acts']
+        self.quant = self.spec.get('quant', {})
+
+        self.emb_uid = load('emb_uid')
+        self.emb_jid = load('emb_jid')
+        self.scale = None
+        if self.quant:
+            self.scale = {n: load(n + '_scale') for n in ['emb_uid', 'emb_jid']}
+
+        # The dense weights are small; read them as float32 so matmul gets
+        #   plain arrays
+        self.W, self.b = [], []
+        for i in range(len(self.acts)):
+            W = np.array(load('W{}'.format(i)), np.float32)
+            if self.quant.get('dense') == 'int8':
+                W *= load('W{}_scale'.format(i))
+            self.W.append(W)
+            self.b.append(np.array(load('b{}'.format(i))))
+        self.n_users = self.emb_uid.shape[0]
+        self.n_jokes = self.emb_jid.shape[0]
+        self.vocabs = (vocab.load(dn)
+                       or vocab.identity(self.n_users, self.n_jokes))
+
+    def _head(self, h, start=1):
+        'Activations of the first Dense layer through the output'
+        for act in self.acts[0]:
+            h = _activate(h, act)
+        for W, b, acts in zip(self.W[start:], self.b[start:],
+                              self.acts[start:]):
+            h = h @ W
+            h += b
+            for act in acts:
+                h = _activate(h, act)
+        return h
+
+    def lookup(self, uIDs, jIDs):
+        'Rows of the embedding tables at indices, not IDs, as float32'
+        eu, ej = self.emb_uid[uIDs], self.emb_jid[jIDs]
+        if self.scale is not None:
+            eu = eu * self.scale['emb_uid'][uIDs, np.newaxis]
+            ej = ej * self.scale['emb_jid'][jIDs, np.newaxis]
+        return eu, ej
+
+    def predict(self, X, batch_size=65536):
+        """
+        Arguments:
+            - X: list
+                [uIDs, jIDs] as given to Keras predict().
+            - batch_size: int, default 65536
+                Number of rows computed at a time; bounds the memory used.
+        Returns:
+            - np.array of shape n x 1 of estimated ratings.
+        """
+        uIDs, jIDs = vocab.index([np.asarray(x).ravel() for x in X],
+                                 self.vocabs)
+        batch_size = batch_size or 65536
+
+        out = np.empty((len(uIDs), 1), np.float32)
+        for i in range(0, len(uIDs), batch_size):
+            eu, ej = self.lookup(uIDs[i:i+batch_size], jIDs[i:i+batch_size])
+            h = np.concatenate([eu, ej], 1) @ self.W[0]
+            h += self.b[0]
+            out[i:i+batch_size] = self._head(h)
+        return out
+
+    def predict_grid(self, uIDs, jIDs=None, batch_size=65536):
+        """
+        Estimates of every pair of users and jokes.
+
+        The first Dense layer is split into its user and joke halves, so the
+        users' and the jokes' parts are each computed once and only added
+        for every pair.
+
+        Arguments:
+            - uIDs: np.array
+                User IDs.
+            - jIDs: np.array, default None
+                Joke IDs. None is every joke in the vocabulary.
+            - batch_size: int, default 65536
+                Number of pairs computed at a time.
+        Returns:
+            - np.array of shape len(uIDs) x len(jIDs).
+        """
+        if jIDs is None:
+            jIDs = self.vocabs['jID'].ids
+        uIDs, jIDs = vocab.index([np.asarray(uIDs).ravel(),
+                                  np.asarray(jIDs).ravel()], self.vocabs)
+
+        d = self.emb_uid.shape[1]
+        Wu, Wj = self.W[0][:d], self.W[0][d:]
+        hj = self.lookup(uIDs[:0], jIDs)[1] @ Wj + self.b[0]
+
+        out = np.empty((len(uIDs), len(jIDs)), np.float32)
+        step = max(1, batch_size // len(jIDs))
+        for i in range(0, len(uIDs), step):
+            hu = self.lookup(uIDs[i:i+step], jIDs[:0])[0] @ Wu
+            h = (hu[:, np.newaxis, :] + hj).reshape(-1, hj.shape[1])
+            out[i:i+step] = self._head(h).reshape(len(hu), len(jIDs))
+        return out
+
+def mae_report(dns, splits):
+    """
+    MAE of exported models on split CSVs, e.g. a float export and its
+    quantized copies on the cvout test split of the pair they were trained on.
+
+    Arguments:
+        - dns: list
+            Export directories; the first is the reference.
+        - splits: list
+            Paths of split CSVs, e.g. 'cvout/90_1_test.csv'.
+    Returns:
+        - dict {split: [MAE of each model]}
+    """
+    from cvcache import load_arrays
+
+    models = [NpMlp(dn) for dn in dns]
+    print('split\t' + '\t'.join(os.path.basename(os.path.normpath(dn))
+                                  for dn in dns) + '\tdelta')
+    out = {}
+    for fn in splits:
+        cols = load_arrays(fn)     # ratings unshifted
+        maes = [float(np.mean(np.abs(m.predict([cols['uID'], cols['jID']])
+                                     .ravel() - cols['rating'])))
+                for m in models]
+        out[fn] = maes
+        print('{}\t{}\t{}'.format(
+            fn, '\t'.join('{:.4f}'.format(e) for e in maes),
+            '\t'.join('{:+.5f}'.format(e - maes[0]) for e in maes[1:])))
+
+    return out
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='cmd')
+    p = sub.add_parser('export', help='export a Keras .h5 model')
+    p.add_argument('model')
+    p.add_argument('dn')
+    p = sub.add_parser('quantize', help='quantize an export')
+    p.add_argument('src')
+    p.add_argument('dn')
+    p.add_argument('--dense', choices=['int8', 'float16'], default='int8')
+    p = sub.add_parser('report', help='MAE of exports on split CSVs')
+    p.add_argument('dns', nargs='+', help='exports; the first is the reference')
+    p.add_argument('--splits', nargs='+', required=True,
+                   help='e.g. cvout/90_1_test.csv')
+    a = parser.parse_args()
+
+    if a.cmd == 'export':
+        export(a.model, a.dn)
+    elif a.cmd == 'quantize':
+        quantize(a.src, a.dn, a.dense)
+    elif a.cmd == 'report':
+        mae_report(a.dns, a.splits)
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,131 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Writers and readers of the format.py outputs of one (p, epoch).
+#
+# The outputs are written to output/{p}_{epoch}/ as
+#   - report.npz: a single compressed bundle with every matrix, and/or
+#   - one CSV per matrix, e.g. AE_mlp.csv; see format.py for their layout.
+#
+# In the bundle, the ternary categories are stored as int8 codes into
+#   TCV_LABELS, so they can be counted without parsing any text.
+
+BUNDLE = 'report.npz'
+
+# Column names of every output CSV
+COLS = ['uID'] + ['rec' + str(i+1) for i in range(100)]
+
+# Output files in the order they are written
+REPORT_FILES = ['recommendation', 'AE_mlp', 'EST_mlp', 'TRUE_mlp', 'TCV_mlp',
+                'AE_unif', 'AE_tavg', 'AE_uavg',
+                'TCV_unif', 'TCV_tavg', 'TCV_uavg']
+
+# Ternary categories, and the upper bounds of the absolute errors of 'a' and
+#   'b'; anything from the last bound up is 'c'.
+TCV_LABELS = np.array(['a', 'b', 'c'])
+TCV_BINS = [3, 6]
+
+FORMATS = ['npz', 'csv', 'both']
+
+def toFrame(mtx, uIDs):
+    'Output dataframe of a 300 x 100 matrix: uID, rec1, ..., rec100'
+    dt = pd.DataFrame(mtx)
+    dt.insert(0, '_', uIDs)
+    dt.columns = COLS
+
+    return dt
+
+def write_bundle(fn, report, uIDs):
+    """
+    Arguments:
+        - fn: str
+            Path of the .npz bundle.
+        - report: dict
+            {file name without .csv: 300 x 100 matrix}, as made by
+            format.genReport().
+        - uIDs: np.array
+            Test user IDs of the rows.
+    """
+    arrays = {'uID': uIDs}
+    for name, mtx in report.items():
+        if name.startswith('TCV_'):
+            mtx = np.searchsorted(TCV_LABELS, mtx).astype(np.int8)
+        arrays[name] = mtx
+    np.savez_compressed(fn, **arrays)
+
+def write_csvs(dn, report, uIDs, workers=4):
+    """
+    Write every matrix of a report to its own CSV, concurrently.
+
+    Arguments:
+        - dn: str
+            Output directory.
+        - report, uIDs:
+            See write_bundle().
+        - workers: int, default 4
+            Number of writer threads.
+    """
+    def write(name):
+        toFrame(report[name], uIDs).to_csv(os.path.join(dn, name + '.csv'),
+                                           sep=',', index=False)
+
+    with ThreadPoolExecutor(workers) as pool:
+        # list() to raise the first error of any writer
+        list(pool.map(write, [n for n in REPORT_FILES if n in report]))
+
+def write_outputs(dn, report, uIDs, fmt='both'):
+    """
+    Arguments:
+        - dn: str
+            Output directory.
+        - report, uIDs:
+            See write_bundle().
+        - fmt: str, default 'both'
+            'npz' for the bundle only, 'csv' for the CSVs only, or 'both'.
+    """
+    assert(fmt in FORMATS)
+    if fmt in ['npz', 'both']:
+        write_bundle(os.path.join(dn, BUNDLE), report, uIDs)
+    if fmt in ['csv', 'both']:
+        write_csvs(dn, report, uIDs)
+
+def load_bundle(fn, names=None):
+    """
+    Arguments:
+        - fn: str
+            Path of a .npz bundle, or of the directory that contains it.
+        - names: list, default None
+            Matrices to load. None loads all of them.
+    Returns:
+        - dict {name: matrix} with 'uID' as well; TCV matrices are decoded to
+          'a', 'b', and 'c'.
+    """
+    if os.path.isdir(fn):
+        fn = os.path.join(fn, BUNDLE)
+    with np.load(fn) as npz:
+        names = npz.files if names is None else ['uID'] + list(names)
+        out = {n: npz[n] for n in names}
+    for n in out:
+        if n.startswith('TCV_'):
+            out[n] = TCV_LABELS[out[n]]
+
+    return out
+
+def tcv_counts(fn, name='TCV_mlp'):
+    """
+    Number of each ternary category in a bundle.
+
+    Arguments:
+        - fn: str
+            Path of a .npz bundle, or of the directory that contains it.
+        - name: str, default 'TCV_mlp'
+            TCV matrix to count.
+    Returns:
+        - np.array of the counts of 'a', 'b', and 'c'.
+    """
+    if os.path.isdir(fn):
+        fn = os.path.join(fn, BUNDLE)
+    with np.load(fn) as npz:
+        return np.bincount(npz[name].ravel(), minlength=len(TCV_LABELS))
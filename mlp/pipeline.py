@@ -0,0 +1,379 @@
+import os
+import ast
+import json
+import shutil
+import argparse
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+from store import ArtifactStore
+from cube import create_cube, load_epochs
+from cvcache import load_arrays, pair_prefixes
+from pivot import row_index
+from format import COMPARE, loadInputs, genReport, nABC
+from outputs import BUNDLE, TCV_LABELS, write_outputs, tcv_counts
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))    # Set path
+
+# Build graph from the cvout splits to the figures of the report, with the
+#   artifact of every stage kept in an ArtifactStore (see store.py) in place
+#   of the time-stamped pickles of train_mlp.py.
+#
+#   train_pair (p, 1) ─┐
+#   train_pair (p, 2) ─┼─> pivot (p) ──> format (p) ─┐
+#          ...        ─┘                             ├─> plot
+#                              (other p) ... ────────┘
+#
+#   - train_pair: one pair's validation uID.npy and jID.npy, ests.npy of
+#     shape n_epoch x len(uID) (see SaveResults), mae_tr.npy, and mae_va.npy.
+#   - pivot: every pair of a p merged into the epoch cube ests.npy (see
+#     cube.py), with uID.npy, mae_tr.npy, mae_va.npy, n_ratings.npy, and
+#     epochs.json as train_mlp.py writes it.
+#   - format: the outputs of format.py for the best epoch; copied to
+#     output/{p}_{epoch}/.
+#   - plot: the MLP MAE vs Epoch figures, copied to ../tex/fig/, and the
+#     ternary counts of every p in abc.json.
+#
+# A stage is keyed on its parameters and the digests of its inputs, the code
+#   of code_files() among them, and only runs if the store has no artifact
+#   under its key. Stages key on the content digest of upstream artifacts,
+#   so e.g. a pivot that is rebuilt with the same result does not rerun
+#   format.
+#
+# The artifacts of the latest run of each p are listed in MANIFEST, which
+#   tex/plot.py reads, and are never evicted.
+
+STORE = 'store'
+MANIFEST = 'output/pipeline.json'
+
+# Code that each stage runs; the local modules it imports are added by
+#   code_files()
+CODE = {'train_pair': ['train_mlp.py'],
+        'pivot': ['pipeline.py', 'pivot.py', 'cube.py'],
+        'format': ['format.py'],
+        'plot': ['pipeline.py', 'plots.py', 'outputs.py']}
+
+TESTING300 = '../data/jester-data-testing.csv'
+
+def local_imports(fn):
+    'Files of the modules of this directory that `fn` imports anywhere'
+    with open(fn) as f:
+        tree = ast.parse(f.read(), fn)
+    mods = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            mods.update(a.name for a in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            mods.add(node.module)
+    return sorted(m + '.py' for m in mods if os.path.exists(m + '.py'))
+
+def code_files(stage):
+    """
+    Files of the code of a stage: its files in CODE and every local module
+    they import, transitively. pipeline.py imports the code of all the
+    stages, so its own imports are not followed.
+    """
+    files, todo = set(), list(CODE[stage])
+    while todo:
+        fn = todo.pop()
+        if fn not in files:
+            files.add(fn)
+            if fn != 'pipeline.py':
+                todo += local_imports(fn)
+    return sorted(files)
+
+def stage_key(store, stage, params, inputs):
+    """
+    Arguments:
+        - store: ArtifactStore
+        - stage: str
+            Name of the stage, one of CODE.
+        - params: dict
+            Parameters of the stage.
+        - inputs: list
+            Digests of its inputs other than code.
+    Returns:
+        - str key of the stage.
+    """
+    code = [store.file_digest(fn) for fn in code_files(stage)]
+    return store.key(stage, params, list(inputs) + code)
+
+def run_stage(store, key, name, build, *args):
+    """
+    Run `build(dn, *args)` to write the artifact of a stage into dn, unless
+    the store has it already.
+
+    Returns:
+        - str directory of the artifact.
+    """
+    dn = store.get(key)
+    if dn is not None:
+        print('{}: up to date'.format(name))
+        return dn
+
+    print('{}: running'.format(name))
+    with store.put(key) as tmp:
+        build(tmp, *args)
+    return store.path(key)
+
+def build_pair(root, key, idx, f, n_epoch, threads=None):
+    'Train pair `idx` and store its artifact under `key`'
+    # TF is only loaded when something is trained
+    from train_mlp import train_pair
+
+    va = load_arrays(f + '_test.csv')
+    with ArtifactStore(root).put(key) as dn:
+        for col in ['uID', 'jID']:
+            np.save(os.path.join(dn, col + '.npy'), va[col])
+
+        fn = os.path.join(dn, 'ests.npy')
+        np.lib.format.open_memmap(fn, mode='w+', dtype=np.float32,
+                                  shape=(n_epoch, len(va['uID']))).flush()
+        mae_tr, mae_va = train_pair(idx, f, n_epoch, fn, None, threads)
+
+        np.save(os.path.join(dn, 'mae_tr.npy'), mae_tr)
+        np.save(os.path.join(dn, 'mae_va.npy'), mae_va)
+
+def _build_pair(args):
+    'Unpack the arguments of build_pair for Pool.map'
+    return build_pair(*args)
+
+def train_pairs(store, p, n_epoch, workers=1, threads=None):
+    """
+    Train the pairs of `p` that are not in the store, on a process pool if
+    workers > 1.
+
+    Returns:
+        - list of the keys of every pair.
+    """
+    pfs = pair_prefixes(p)
+    keys = [stage_key(store, 'train_pair',
+                      {'p': p, 'idx': idx, 'n_epoch': n_epoch},
+                      [store.file_digest(f + '_train.csv'),
+                       store.file_digest(f + '_test.csv')])
+            for idx, f in enumerate(pfs)]
+
+    todo = [(store.root, k, idx, f, n_epoch)
+            for idx, (k, f) in enumerate(zip(keys, pfs))
+            if store.get(k) is None]
+    print('train_pair {}: {} of {} pairs up to date'
+          .format(p, len(pfs) - len(todo), len(pfs)))
+
+    workers = min(workers, len(todo))
+    if workers <= 1:
+        for a in todo:
+            build_pair(*a, threads)
+    else:
+        from train_mlp import thread_env
+        if threads is None:
+            threads = max(1, mp.cpu_count() // workers)
+        # spawn b/c TF does not survive a fork after initialization
+        with thread_env(threads), mp.get_context('spawn').Pool(workers) as pool:
+            pool.map(_build_pair, [a + (threads,) for a in todo], chunksize=1)
+
+    return keys
+
+def build_pivot(dn, pairs):
+    """
+    Merge the artifacts of every pair of a p.
+
+    Arguments:
+        - dn: str
+            Directory to write the artifact into.
+        - pairs: list
+            Artifact directories of the pairs, in pair order.
+    """
+    def load(d, name):
+        return np.load(os.path.join(d, name + '.npy'), mmap_mode='r')
+
+    uIDs = np.unique(np.concatenate([load(d, 'uID') for d in pairs]))
+    n_epoch = load(pairs[0], 'ests').shape[0]
+
+    # Every pair fills its own cells of the cube, one pair at a time
+    cube = create_cube(os.path.join(dn, 'ests.npy'), n_epoch, len(uIDs))
+    for d in pairs:
+        rows = row_index(uIDs, load(d, 'uID'))
+        cols = load(d, 'jID').astype(np.intp) - 1 # jIDs start from 1
+        cube[:, rows, cols] = load(d, 'ests')
+    cube.flush()
+    del cube
+
+    mae_tr = np.vstack([load(d, 'mae_tr') for d in pairs])
+    mae_va = np.vstack([load(d, 'mae_va') for d in pairs])
+    n_ratings = np.array([len(load(d, 'uID')) for d in pairs])
+    for name, a in [('uID', uIDs), ('mae_tr', mae_tr), ('mae_va', mae_va),
+                    ('n_ratings', n_ratings)]:
+        np.save(os.path.join(dn, name + '.npy'), a)
+
+    epoch = int(np.dot(n_ratings, mae_va).argmin())
+    with open(os.path.join(dn, 'epochs.json'), 'w') as f:
+        json.dump({'best_epoch': epoch, 'stop_epoch': None}, f)
+
+def best_epoch(pivot_dn):
+    'Best epoch recorded in a pivot artifact'
+    with open(os.path.join(pivot_dn, 'epochs.json')) as f:
+        return json.load(f)['best_epoch']
+
+def build_format(dn, pivot_dn, out):
+    """
+    Write the outputs of format.py for the best epoch of a pivot artifact.
+
+    Arguments:
+        - dn: str
+            Directory to write the artifact into.
+        - pivot_dn: str
+            Directory of the pivot artifact.
+        - out: str
+            Output format; see outputs.write_outputs().
+    """
+    epoch = best_epoch(pivot_dn)
+    print('Optimal Epoch:', epoch)
+
+    mtx_true, testuIDs, comps = loadInputs(TESTING300)
+    assert(np.array_equal(testuIDs, np.load(os.path.join(pivot_dn, 'uID.npy'))))
+
+    report = genReport(load_epochs(os.path.join(pivot_dn, 'ests.npy'), epoch),
+                       mtx_true, comps)
+    write_outputs(dn, report, testuIDs, out)
+
+    nABC(report['TCV_mlp'])
+
+def mlp_counts(dn):
+    'Number of each ternary category of the mlp in a format artifact'
+    if os.path.exists(os.path.join(dn, BUNDLE)):
+        return tcv_counts(dn)
+    tcv = pd.read_csv(os.path.join(dn, 'TCV_mlp.csv')).values[:, 1:]
+    return np.array([np.sum(tcv == c) for c in TCV_LABELS])
+
+def build_plot(dn, runs, x_ub):
+    """
+    Arguments:
+        - dn: str
+            Directory to write the artifact into.
+        - runs: dict
+            {p: (pivot artifact directory, format artifact directory)}.
+        - x_ub: int
+            Last epoch of the zoomed in figure; see plots.mlp_mae().
+    """
+    # matplotlib is only loaded when something is plotted
+    from plots import mlp_mae
+
+    maes = {p: tuple(np.load(os.path.join(pivot_dn, n + '.npy'))
+                     for n in ['mae_tr', 'mae_va', 'n_ratings'])
+            for p, (pivot_dn, format_dn) in runs.items()}
+    mlp_mae(maes, os.path.join(dn, 'mlp_mae.png'), x_ub)
+
+    abc = {str(p): mlp_counts(format_dn).tolist()
+           for p, (pivot_dn, format_dn) in runs.items()}
+    with open(os.path.join(dn, 'abc.json'), 'w') as f:
+        json.dump(abc, f)
+
+def publish(src, dst):
+    'Copy the files of an artifact to `dst`, overwriting older versions'
+    os.makedirs(dst, exist_ok=True)
+    for name in os.listdir(src):
+        if name != 'DIGEST':
+            shutil.copy2(os.path.join(src, name), dst)
+
+def load_manifest():
+    'Runs recorded by main(), {str(p): run}'
+    try:
+        with open(MANIFEST) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def main(runs, out='both', workers=1, threads=None, plot=True, x_ub=60,
+         max_gb=8.):
+    """
+    Arguments:
+        - runs: list
+            (p, n_epoch) of every training size to build.
+        - out: str, default 'both'
+            Output format of format.py; see outputs.write_outputs().
+        - workers: int, default 1
+            Number of pairs trained in parallel.
+        - threads: int, default None
+            Max number of TF/BLAS threads per worker.
+        - plot: boolean, default True
+            Whether to plot the figures of every p in the manifest.
+        - x_ub: int, default 60
+            Last epoch of the zoomed in MAE figure.
+        - max_gb: float, default 8.
+            Size of the store above which old artifacts are evicted.
+    """
+    store = ArtifactStore(STORE, int(max_gb * 2**30))
+    manifest = load_manifest()
+
+    for p, n_epoch in runs:
+        keys = train_pairs(store, p, n_epoch, workers, threads)
+        pairs = [store.path(k) for k in keys]
+
+        key = stage_key(store, 'pivot', {'p': p},
+                        [store.digest(k) for k in keys])
+        pivot_dn = run_stage(store, key, 'pivot {}'.format(p),
+                             build_pivot, pairs)
+        pivot_key = key
+
+        inputs = [store.digest(pivot_key), store.file_digest(TESTING300)]
+        inputs += [store.file_digest(COMPARE[n]) for n in sorted(COMPARE)]
+        key = stage_key(store, 'format', {'out': out}, inputs)
+        format_dn = run_stage(store, key, 'format {}'.format(p),
+                              build_format, pivot_dn, out)
+
+        epoch = best_epoch(pivot_dn)
+        output = 'output/{}_{}/'.format(p, epoch)
+        publish(format_dn, output)
+
+        manifest[str(p)] = {'n_epoch': n_epoch, 'best_epoch': epoch,
+                            'pairs': keys, 'pivot': pivot_key, 'format': key,
+                            'output': output}
+
+    if plot and manifest:
+        ps = sorted(manifest, key=int)
+        key = stage_key(store, 'plot', {'x_ub': x_ub},
+                        [store.digest(manifest[p][k]) for p in ps
+                         for k in ['pivot', 'format']])
+        plot_dn = run_stage(store, key, 'plot', build_plot,
+                            {int(p): (store.path(manifest[p]['pivot']),
+                                      store.path(manifest[p]['format']))
+                             for p in ps},
+                            x_ub)
+        publish(plot_dn, '../tex/fig/')
+        manifest['plot'] = key
+
+    os.makedirs(os.path.dirname(MANIFEST), exist_ok=True)
+    with open(MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    # Keep everything the manifest refers to
+    keep = [manifest['plot']] if 'plot' in manifest else []
+    for p, run in manifest.items():
+        if p != 'plot':
+            keep += run['pairs'] + [run['pivot'], run['format']]
+    store.evict(keep)
+
+def parse_run(s):
+    'p:n_epoch, e.g. 30:100'
+    p, n_epoch = s.split(':')
+    if int(p) not in [30, 60, 90]:
+        raise argparse.ArgumentTypeError('p must be 30, 60, or 90')
+    return int(p), int(n_epoch)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('runs', type=parse_run, nargs='+',
+                        help='p:n_epoch, e.g. 30:100 60:100 90:150')
+    parser.add_argument('--out', choices=['npz', 'csv', 'both'],
+                        default='both')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=None,
+                        help='threads per worker')
+    parser.add_argument('--no-plot', action='store_true')
+    parser.add_argument('--x-ub', type=int, default=60)
+    parser.add_argument('--max-gb', type=float, default=8.,
+                        help='evict old artifacts above this store size')
+    a = parser.parse_args()
+
+    main(a.runs, a.out, a.workers, a.threads, not a.no_plot, a.x_ub,
+         a.max_gb)
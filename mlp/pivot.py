@@ -0,0 +1,70 @@
+import numpy as np
+
+# Conversions between the 3-column (uID, jID, rating) estimates and the
+#   user x joke matrices of the epoch cube and format.py.
+
+def row_index(keys, ids):
+    """
+    Look up the row of every ID in a sorted array of unique IDs.
+
+    Arguments:
+        - keys: np.array
+            Sorted unique IDs; keys[r] is the ID of row r.
+        - ids: np.array
+            IDs to look up. Every ID must be in `keys`.
+    Returns:
+        - np.array of row indices with the same shape as `ids`.
+    """
+    rows = np.searchsorted(keys, ids)
+    assert(np.all(keys[np.minimum(rows, len(keys) - 1)] == ids))
+    return rows
+
+def pivot(ests3, uIDs=None, n_jokes=100):
+    """
+    Convert the 3-column estimates of every epoch to user x joke matrices.
+
+    The uID -> row lookup is built once from the first epoch, so every epoch
+    must list the same (uID, jID) pairs in the same order, which is the case
+    for the `ests3` filled by SaveResults.
+
+    Arguments:
+        - ests3: list or np.array
+            n_epoch matrices of shape n x 3 with columns uID, jID, rating.
+        - uIDs: np.array, default None
+            Sorted user IDs of the output rows. Defaults to the sorted unique
+            uIDs in the first epoch.
+        - n_jokes: int, default 100
+            Number of output columns; jIDs start from 1.
+    Returns:
+        - np.array of shape n_epoch x len(uIDs) x n_jokes. Cells that are
+          missing from `ests3` are 0.
+    """
+    first = np.asarray(ests3[0])
+    if uIDs is None:
+        uIDs = np.unique(first[:, 0])
+
+    rows = row_index(uIDs, first[:, 0])
+    cols = first[:, 1].astype(int) - 1  # uIDs and jIDs start from 1
+
+    ests = np.zeros([len(ests3), len(uIDs), n_jokes])
+    ests[:, rows, cols] = np.stack([np.asarray(e)[:, 2] for e in ests3])
+
+    return ests
+
+def reorder(mtx, order):
+    """
+    Reorder every row of a matrix by its own column order.
+
+    Arguments:
+        - mtx: np.array
+            Matrix of shape n x m, or a stack of them of shape k x n x m.
+        - order: np.array
+            n x m matrix of 0-based column indices; row i of the output is
+            mtx[i, order[i]].
+    Returns:
+        - np.array with the same shape as `mtx`.
+    """
+    order = np.asarray(order)
+    if np.ndim(mtx) == 3:
+        order = order[np.newaxis]
+    return np.take_along_axis(np.asarray(mtx), order, axis=-1)
@@ -0,0 +1,63 @@
+import os
+import numpy as np
+import matplotlib.pyplot as plt
+
+# Figures of the MLP results, shared by pipeline.py and tex/plot.py.
+
+# Line color of each training size
+COLORS = {30: 'g', 60: '#FFA500', 90: 'r'}
+
+def mae_curves(mae_tr, mae_va, n_ratings):
+    """
+    Arguments:
+        - mae_tr, mae_va: np.array
+            Every pair's training and validation MAE at each epoch; see
+            train_mlp.py.
+        - n_ratings: np.array
+            Number of ratings in each pair's validation set.
+    Returns:
+        - tuple of the mean training MAE and the n_ratings-weighted
+          validation MAE at each epoch.
+    """
+    w = np.asarray(n_ratings, dtype=np.float64)
+    return (np.mean(np.asarray(mae_tr), 0),
+            np.dot(w / w.sum(), np.asarray(mae_va)))
+
+def mlp_mae(runs, fn, x_ub=60):
+    """
+    Plot the MAE vs Epoch figure, and again zoomed in to the first epochs.
+
+    Arguments:
+        - runs: dict
+            {p: (mae_tr, mae_va, n_ratings)}; see mae_curves().
+        - fn: str
+            Path of the figure, e.g. 'fig/mlp_mae.png'.
+        - x_ub: int, default 60
+            Last epoch of the zoomed in figure, which is saved next to `fn`
+            as e.g. 'fig/mlp_mae_xlim60.png'.
+    Returns:
+        - list of the paths of both figures.
+    """
+    plt.figure()
+    plt.xlabel('Epoch',  fontsize = 15)
+    plt.ylabel('MAE', fontsize = 15)
+    for p in sorted(runs):
+        tr, va = mae_curves(*runs[p])
+        x = np.arange(len(tr))
+        plt.plot(x, tr, '--', color=COLORS[p],
+                 label='Training MAE; {}%'.format(p))
+        plt.plot(x, va, '-', color=COLORS[p],
+                 label='Validation MAE; {}%'.format(p))
+
+    plt.legend(bbox_to_anchor=(1, 1), loc='upper right', prop={'size': 8})
+    plt.title('MLP: MAE vs Epoch')
+    plt.savefig(fn)
+
+    root, ext = os.path.splitext(fn)
+    fn_xlim = '{}_xlim{}{}'.format(root, x_ub, ext)
+    plt.xlim(-2, x_ub)
+    plt.legend(loc='lower left', prop={'size': 8})
+    plt.savefig(fn_xlim)
+    plt.clf()
+
+    return [fn, fn_xlim]
@@ -0,0 +1,219 @@
+import os
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+from cvcache import SHIFT
+
+# Ranking quality of the recommendations of any estimates against the true
+#   ratings of the test users,
+#
+#   python3 ranking.py [OUTPUT_DIR ...] [--cube CUBE] [--k 5 10 20]
+#
+# for the output directories of format.py and nmf/format.R, every epoch of
+#   an epoch cube whose estimates were written (see cube.run_epochs()), and
+#   the comparison estimates of format.py. For every user and k,
+#
+#   - precision@k: share of the top k jokes that are relevant, i.e. whose
+#     true rating is at least RELEVANT
+#   - hit@k: whether any of the top k jokes is relevant
+#   - ndcg@k: DCG of the true ratings of the top k jokes, shifted by +10 to
+#     be non-negative as NMF did, over the DCG of the k best ones
+#   - map@k: average precision of the top k jokes, over min(k, number of
+#     relevant jokes); users without a relevant joke are left out of its
+#     mean
+#
+# The top k of every row is taken with np.argpartition, O(n_jokes), and only
+#   the k jokes are sorted, so ranking is O(n_jokes + k log k) per user
+#   instead of the O(n_jokes log n_jokes) of a full argsort. Estimates of any
+#   leading shape, e.g. (n_epoch, n_users, n_jokes), are ranked CHUNK rows of
+#   the first axis at a time.
+
+RELEVANT = 5.
+KS = (5, 10, 20)
+CHUNK = 16
+METRICS = ['precision', 'hit', 'ndcg', 'map']
+
+def top_k(ests, k):
+    """
+    Arguments:
+        - ests: np.array
+            Estimates of shape (..., n_jokes).
+        - k: int
+    Returns:
+        - np.array of shape (..., k) of the 0-based columns of the k largest
+          estimates of every row, largest first.
+    """
+    k = min(k, ests.shape[-1])
+    top = np.argpartition(-ests, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(ests, top, -1), -1, kind='stable')
+    return np.take_along_axis(top, order, -1)
+
+def _dcg(gains):
+    'DCG of gains of shape (..., k), in rank order'
+    return (gains / np.log2(np.arange(2, gains.shape[-1] + 2))).sum(-1)
+
+def user_metrics(ests, true, k, relevant=RELEVANT):
+    """
+    Arguments:
+        - ests: np.array
+            Estimates of shape (..., n_users, n_jokes).
+        - true: np.array
+            n_users x n_jokes true ratings.
+        - k: int
+        - relevant: float, default RELEVANT
+            Lowest true rating of a relevant joke.
+    Returns:
+        - dict {metric: np.array of shape (..., n_users)} of METRICS; map is
+          NaN for users without a relevant joke.
+    """
+    true = np.asarray(true, dtype=np.float64)
+    top = top_k(ests, k)
+    k = top.shape[-1]
+    top_true = np.take_along_axis(np.broadcast_to(true, ests.shape), top, -1)
+    rel = top_true >= relevant
+
+    ideal = _dcg(np.take_along_axis(true, top_k(true, k), -1) + SHIFT)
+    n_rel = (true >= relevant).sum(-1)
+    hits = np.cumsum(rel, -1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ap = (((hits / np.arange(1, k + 1)) * rel).sum(-1)
+              / np.minimum(k, n_rel))
+    ap = np.where(n_rel > 0, ap, np.nan)
+
+    return {'precision': rel.mean(-1),
+            'hit': rel.any(-1).astype(float),
+            'ndcg': _dcg(top_true + SHIFT) / ideal,
+            'map': ap}
+
+def evaluate(ests, true, ks=KS, relevant=RELEVANT, chunk=CHUNK):
+    """
+    Arguments:
+        - ests: np.array
+            Estimates of shape (..., n_users, n_jokes), e.g. an epoch cube;
+            memory mapped arrays are read CHUNK rows of the first axis at a
+            time.
+        - true: np.array
+            n_users x n_jokes true ratings.
+        - ks: tuple, default KS
+        - relevant: float, default RELEVANT
+            See user_metrics().
+        - chunk: int, default CHUNK
+            Rows of the first axis ranked at a time.
+    Returns:
+        - dict {'{metric}@{k}': np.array of shape (...)} of the mean over
+          the users of every metric and k.
+    """
+    lead = ests.shape[:-2]
+    out = {'{}@{}'.format(m, k): np.empty(lead) for k in ks for m in METRICS}
+    for lo in range(0, lead[0] if lead else 1, chunk):
+        e = slice(lo, lo + chunk) if lead else Ellipsis
+        part = np.asarray(ests[e], dtype=np.float64)
+        for k in ks:
+            for m, v in user_metrics(part, true, k, relevant).items():
+                out['{}@{}'.format(m, k)][e] = np.nanmean(v, -1)
+    return out
+
+def best_epochs(res, epochs=None):
+    """
+    Arguments:
+        - res: dict
+            evaluate() of an epoch cube.
+        - epochs: list, default None
+            Epochs to choose from, e.g. cube.run_epochs(); the others of a
+            cube are zero. None is every epoch.
+    Returns:
+        - dict {'{metric}@{k}': int} of the epoch with the highest mean.
+    """
+    if epochs is None:
+        epochs = np.arange(len(next(iter(res.values()))))
+    epochs = np.asarray(epochs)
+    return {c: int(epochs[np.argmax(v[epochs])]) for c, v in res.items()}
+
+def load_output(dn):
+    """
+    Estimates of an output directory of format.py or nmf/format.R, from its
+    report.npz, or from its recommendation(s).csv and EST_*.csv, which are
+    in recommendation order.
+
+    Arguments:
+        - dn: str
+            Output directory, e.g. 'output/90_7'.
+    Returns:
+        - tuple (name, ests) of the model, e.g. 'mlp', and the n_users x
+          n_jokes estimates in jID order.
+    """
+    from outputs import BUNDLE, load_bundle
+
+    if os.path.exists(os.path.join(dn, BUNDLE)):
+        report = load_bundle(dn, ['recommendation', 'EST_mlp'])
+        rec, est, name = report['recommendation'], report['EST_mlp'], 'mlp'
+    else:
+        fn, = glob.glob(os.path.join(dn, 'EST_*.csv'))
+        name = os.path.basename(fn)[4:-4]
+        est = pd.read_csv(fn).values[:, 1:]
+        fn, = (glob.glob(os.path.join(dn, 'recommendation.csv'))
+               + glob.glob(os.path.join(dn, 'recommendations.csv')))
+        rec = pd.read_csv(fn).values[:, 1:]
+
+    ests = np.empty(est.shape)
+    np.put_along_axis(ests, rec.astype(int) - 1, est, 1)
+    return name, ests
+
+def compare(models, true, ks=KS, relevant=RELEVANT):
+    """
+    Print the mean of every metric and k of some estimates.
+
+    Arguments:
+        - models: dict
+            {name: n_users x n_jokes estimates}.
+        - true, ks, relevant:
+            See evaluate().
+    Returns:
+        - dict {name: the dict of evaluate()}
+    """
+    out = {n: evaluate(ests, true, ks, relevant)
+           for n, ests in models.items()}
+    cols = ['{}@{}'.format(m, k) for k in ks for m in METRICS]
+    print('{:<16}'.format('model') + ''.join('{:>13}'.format(c)
+                                             for c in cols))
+    for n, res in out.items():
+        print('{:<16}'.format(n[-16:])
+              + ''.join('{:>13.4f}'.format(float(res[c])) for c in cols))
+    return out
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('outputs', nargs='*',
+                        help='output directories of format.py or '
+                             'nmf/format.R')
+    parser.add_argument('--cube', default=None,
+                        help='epoch cube to rank every epoch of')
+    parser.add_argument('--testing', default='../data/jester-data-testing.csv',
+                        help='true ratings')
+    parser.add_argument('--compare', default='../data',
+                        help='directory of the comparison estimates; '
+                             'empty for none')
+    parser.add_argument('--k', type=int, nargs='+', default=list(KS))
+    parser.add_argument('--relevant', type=float, default=RELEVANT)
+    a = parser.parse_args()
+
+    true = pd.read_csv(a.testing).values[:, 1:]
+    models = {}
+    for dn in a.outputs:
+        name, ests = load_output(dn)
+        models[name + ' ' + os.path.basename(os.path.normpath(dn))] = ests
+    if a.compare:
+        from baselines import FILES
+        for n, fn in sorted(FILES.items()):
+            models[n] = pd.read_csv(os.path.join(a.compare, fn)).values[:, 1:]
+    compare(models, true, a.k, a.relevant)
+
+    if a.cube:
+        from cube import open_cube, run_epochs
+        res = evaluate(open_cube(a.cube), true, a.k, a.relevant)
+        best = best_epochs(res, run_epochs(a.cube))
+        print()
+        for c in sorted(res):
+            print('{:<14}best epoch: {:>4}\t{:.4f}'
+                  .format(c, best[c], res[c][best[c]]))
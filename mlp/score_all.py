@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import multiprocessing as mp
+import numpy as np
+from serve import load_model
+from ranking import top_k
+
+# Top-N recommendations of every user of a trained Mlp, not only the 300
+#   test users of format.py,
+#
+#   python3 score_all.py MODEL [--out scores] [--n 10] [--workers 1]
+#                              [--resume]
+#
+#   scores/
+#     |____ job.json             model, N, chunk size and jIDs of the job
+#     |____ users.npy            int32, uIDs of every user scored
+#     |____ shard00000/
+#     |       |____ uID.npy      int32, uIDs of the chunk's users
+#     |       |____ jID.npy      int16, n_users x N jIDs, best first
+#     |       |____ score.npy    float32, n_users x N estimates
+#     |____ shard00001/ ...
+#     |____ meta.json            counts, time, and users/sec of the job
+#
+# MODEL is the .h5 file of Mlp.save() or a directory of npmlp.export(), as in
+#   serve.py; by default every uID of its vocabulary is scored, against
+#   every jID of its vocabulary. The users are
+#   walked CHUNK_USERS at a time: all the user x joke pairs of a chunk are
+#   packed into one predict() call, or predict_grid() for an export, the top
+#   N of every user are taken with np.argpartition, and only they are kept.
+#   Memory is bounded by a chunk instead of the ~7.3M estimates of all the
+#   users. Keras predicts in batches of PREDICT_BATCH rows; NumPy is fastest
+#   with GRID_BATCH, whose activations stay in the CPU cache.
+#
+# A shard is written to shardNNNNN.tmp/ and renamed into place, so a shard
+#   that exists is complete, and --resume scores only the missing ones after
+#   a crash. With workers > 1 the chunks are scored on a pool of processes
+#   that each load the model once; set OMP_NUM_THREADS so that the workers'
+#   BLAS threads do not outnumber the cores. meta.json is written last.
+#
+# job.json is written first, and only a directory with one is replaced by a
+#   new job, so a mistyped --out never deletes another directory.
+
+CHUNK_USERS = 4096
+PREDICT_BATCH = 65536
+GRID_BATCH = 1024
+N_TOP = 10
+COLS = {'uID': np.int32, 'jID': np.int16, 'score': np.float32}
+
+def shard_path(dn, k):
+    return os.path.join(dn, 'shard{:05d}'.format(k))
+
+def score_chunk(model, uIDs, jIDs, n, batch_size=None):
+    """
+    Arguments:
+        - model:
+            Model of serve.load_model().
+        - uIDs: np.array
+            uIDs of the chunk's users.
+        - jIDs: np.array
+            jIDs of the jokes to rank.
+        - n: int
+            Number of jokes to keep per user.
+        - batch_size: int, default None
+            Rows of every predict() batch. None is GRID_BATCH for an export
+            and PREDICT_BATCH otherwise.
+    Returns:
+        - tuple (jIDs, scores) of the len(uIDs) x n top jIDs of every user,
+          best first, and their estimates.
+    """
+    if hasattr(model, 'predict_grid'):
+        pred = model.predict_grid(uIDs, jIDs, batch_size or GRID_BATCH)
+    else:
+        pred = model.predict([np.repeat(uIDs, len(jIDs)),
+                              np.tile(jIDs, len(uIDs))],
+                             batch_size or PREDICT_BATCH)
+        pred = pred.reshape(len(uIDs), len(jIDs))
+    top = top_k(pred, n)
+    return jIDs[top], np.take_along_axis(pred, top, 1)
+
+def write_shard(dn, k, uIDs, jIDs, scores):
+    'Write shard `k` of a job directory; see above'
+    path = shard_path(dn, k)
+    shutil.rmtree(path + '.tmp', ignore_errors=True)
+    os.makedirs(path + '.tmp')
+    for c, v in zip(COLS, [uIDs, jIDs, scores]):
+        np.save(os.path.join(path + '.tmp', c + '.npy'),
+                np.asarray(v, dtype=COLS[c]))
+    os.replace(path + '.tmp', path)
+
+# Model and job of a worker process, set by _init_worker
+_job = {}
+
+def _init_worker(fn, dn, n, batch_size, model=None):
+    if model is None:
+        model = load_model(fn)
+    _job.update(model=model, dn=dn, n=n, batch_size=batch_size,
+                jIDs=model.vocabs['jID'].ids)
+
+def _score_shard(args):
+    'Score and write one shard; returns its number of users'
+    k, uIDs = args
+    jIDs, scores = score_chunk(_job['model'], uIDs, _job['jIDs'], _job['n'],
+                               _job['batch_size'])
+    write_shard(_job['dn'], k, uIDs, jIDs, scores)
+    return len(uIDs)
+
+def _resumable(out):
+    'Whether `out` holds a job that was started, with its users'
+    return all(os.path.exists(os.path.join(out, fn))
+               for fn in ['job.json', 'users.npy'])
+
+def _start(fn, out, uIDs, jIDs, n, chunk_users, resume):
+    """
+    Create the job directory, or check that the one to resume was started
+    with the same arguments.
+
+    Returns:
+        - np.array of the uIDs of the job.
+    """
+    job = {'model': os.path.abspath(fn), 'n': n, 'chunk_users': chunk_users,
+           'jokes': [int(j) for j in jIDs]}
+    if resume and _resumable(out):
+        with open(os.path.join(out, 'job.json')) as f:
+            old = json.load(f)
+        users = np.load(os.path.join(out, 'users.npy'))
+        if (old != job or (uIDs is not None
+                           and not np.array_equal(uIDs, users))):
+            raise ValueError('{} was started with other arguments'
+                             .format(out))
+        return users
+
+    if (os.path.isdir(out) and os.listdir(out)
+            and not os.path.exists(os.path.join(out, 'job.json'))):
+        raise ValueError('{} is not empty and is not a directory of '
+                         'score_all(); not replacing it'.format(out))
+    shutil.rmtree(out, ignore_errors=True)
+    os.makedirs(out)
+    with open(os.path.join(out, 'job.json'), 'w') as f:
+        json.dump(job, f, indent=1)
+    np.save(os.path.join(out, 'users.npy'), np.asarray(uIDs, np.int32))
+    return np.asarray(uIDs, np.int32)
+
+def score_all(fn, out='scores', uIDs=None, n=N_TOP, chunk_users=CHUNK_USERS,
+              workers=1, resume=False, batch_size=None):
+    """
+    Arguments:
+        - fn: str
+            .h5 file of Mlp.save(), or a directory of npmlp.export().
+        - out: str, default 'scores'
+            Directory of the shards; replaced unless resumed. It must not
+            exist, be empty, or be a directory of an earlier job.
+        - uIDs: np.array, default None
+            uIDs to score. None is every uID of the model's vocabulary.
+        - n: int, default N_TOP
+            Number of jokes recommended to every user.
+        - chunk_users: int, default CHUNK_USERS
+            Number of users per predict() call, and so per shard.
+        - workers: int, default 1
+            Number of worker processes. 1 scores in the current process.
+        - resume: boolean, default False
+            Keep the shards of an earlier run of the same job in `out` and
+            score only the missing ones.
+        - batch_size: int, default None
+            See score_chunk().
+    Returns:
+        - dict of meta.json: 'shards', 'users', 'scored', the number of
+          users scored by this run, 'seconds', and 'users_per_sec'.
+    """
+    t0 = time.perf_counter()
+    model = load_model(fn)
+    if uIDs is None and not (resume and _resumable(out)):
+        uIDs = model.vocabs['uID'].ids
+    users = _start(fn, out, uIDs, model.vocabs['jID'].ids, n, chunk_users,
+                   resume)
+
+    n_shards = -(-len(users) // chunk_users)
+    todo = [(k, users[k * chunk_users:(k + 1) * chunk_users])
+            for k in range(n_shards)
+            if not os.path.isdir(shard_path(out, k))]
+    print('users: {}\tshards: {}\tto score: {}'
+          .format(len(users), n_shards, len(todo)))
+
+    args = (fn, out, n, batch_size)
+    scored = 0
+    if workers <= 1:
+        _init_worker(*args, model=model)
+        done = map(_score_shard, todo)
+    else:
+        # spawn b/c TF does not survive a fork after initialization
+        pool = mp.get_context('spawn').Pool(workers, _init_worker, args)
+        done = pool.imap_unordered(_score_shard, todo)
+    try:
+        for i, n_users in enumerate(done):
+            scored += n_users
+            seconds = time.perf_counter() - t0
+            print('shard {}/{}\t{:.1f}s\t{:.0f} users/sec'
+                  .format(i + 1, len(todo), seconds, scored / seconds))
+    finally:
+        if workers > 1:
+            pool.close()
+            pool.join()
+
+    seconds = time.perf_counter() - t0
+    meta = {'shards': n_shards, 'users': len(users), 'scored': scored,
+            'seconds': seconds, 'users_per_sec': scored / seconds}
+    with open(os.path.join(out, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    print('users: {}\tscored: {}\ttime: {:.1f}s\t{:.0f} users/sec'
+          .format(len(users), scored, seconds, scored / seconds))
+    return meta
+
+def shards(dn='scores', mmap=True):
+    """
+    Arguments:
+        - dn: str, default 'scores'
+            Directory of score_all().
+        - mmap: boolean, default True
+            Whether to memory map the arrays instead of reading them.
+    Returns:
+        - generator of the dict {'uID', 'jID', 'score'} of np.array of every
+          shard.
+    """
+    with open(os.path.join(dn, 'meta.json')) as f:
+        meta = json.load(f)
+    for k in range(meta['shards']):
+        yield {c: np.load(os.path.join(shard_path(dn, k), c + '.npy'),
+                          mmap_mode='r' if mmap else None)
+               for c in COLS}
+
+def load(dn='scores'):
+    'Every shard of score_all() concatenated, as a dict of np.array'
+    parts = list(shards(dn, mmap=False))
+    return {c: np.concatenate([s[c] for s in parts]) for c in COLS}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', help='.h5 file of Mlp.save(), or a '
+                                      'directory of npmlp.export()')
+    parser.add_argument('--out', default='scores')
+    parser.add_argument('--n', type=int, default=N_TOP,
+                        help='number of jokes recommended to every user')
+    parser.add_argument('--chunk-users', type=int, default=CHUNK_USERS)
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='rows per predict() batch; default {} for an '
+                             'export, {} for Keras'
+                             .format(GRID_BATCH, PREDICT_BATCH))
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--resume', action='store_true',
+                        help='score only the shards missing from --out')
+    a = parser.parse_args()
+
+    score_all(a.model, a.out, None, a.n, a.chunk_users, a.workers, a.resume,
+              a.batch_size)
@@ -0,0 +1,248 @@
+import os
+import json
+import argparse
+import threading
+from collections import OrderedDict
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import vocab
+
+# HTTP service of top-N joke recommendations from a saved Mlp model, i.e. the
+#   .h5 file of Mlp.save() or its NumPy export of npmlp.py, which
+#   starts without loading keras/tensorflow.
+#
+#   GET  /recommend?uid=5&n=10  {"uID": 5, "jIDs": [...], "scores": [...]}
+#   POST /reload                reload the model file and clear the cache
+#   GET  /health                {"version": ..., "cached": ...}
+#
+# All jokes of the model's jID vocabulary are scored for a user in one
+#   predict() call, and the scores are kept in an LRU cache of users, so
+#   repeated requests only do the partial sort for their N.
+
+def load_keras(fn):
+    'Load a Keras model saved with Mlp.save() or model.save()'
+    import tensorflow as tf
+    import keras
+    import keras.backend as K
+
+    model = keras.models.load_model(fn)
+    # Build the predict function now, so the request threads only use it
+    model._make_predict_function()
+    graph, session = tf.get_default_graph(), K.get_session()
+    vocabs = vocab.load(fn) or vocab.keras_identity(model)
+
+    class Model(object):
+        'Keras model bound to its graph and session for any thread'
+        def __init__(self):
+            self.vocabs = vocabs
+
+        def predict(self, X, batch_size):
+            X = vocab.index(X, vocabs)
+            with graph.as_default(), session.as_default():
+                return model.predict(X, batch_size=batch_size)
+
+    return Model()
+
+def load_model(fn):
+    'Load a directory of npmlp.export(), or else a Keras .h5 file'
+    if os.path.isdir(fn):
+        from npmlp import NpMlp
+        return NpMlp(fn)
+    return load_keras(fn)
+
+def top_n(scores, n):
+    """
+    Arguments:
+        - scores: np.array
+            Score of each joke.
+        - n: int
+            Number of jokes to return.
+    Returns:
+        - np.array of the indices of the n highest scores, highest first.
+    """
+    n = min(n, len(scores))
+    # Partial sort: select the top n, then only sort those
+    idx = np.argpartition(-scores, n - 1)[:n]
+    return idx[np.argsort(-scores[idx], kind='stable')]
+
+class Recommender(object):
+    """
+    Model with an LRU cache of the joke scores of each user.
+    """
+    def __init__(self, fn, cache_size=10000, load=load_model):
+        """
+        Arguments:
+            - fn: str
+                Path of the saved model.
+            - cache_size: int, default 10000
+                Max number of users whose scores are cached.
+            - load: func, default load_model
+                Function that loads the model at a path. The model must have
+                predict([uIDs, jIDs], batch_size) and vocabs, the
+                vocabularies of vocab.py; uIDs not in them are unknown.
+        """
+        self.fn = fn
+        self.cache_size = cache_size
+        self.load = load
+        self.version = 0
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        'Load the model file again and drop every cached score'
+        model = self.load(self.fn)
+        with self.lock:
+            self.model = model
+            self.jIDs = model.vocabs['jID'].ids
+            self.version += 1
+            self.cache.clear()
+
+    def scores(self, uID):
+        """
+        Returns:
+            - tuple (jIDs, scores) of np.array of the jIDs of the model and
+              their estimated ratings by user `uID`.
+        """
+        with self.lock:
+            s = self.cache.get(uID)
+            if s is not None:
+                self.cache.move_to_end(uID)
+                return self.jIDs, s
+            model, jIDs, version = self.model, self.jIDs, self.version
+
+        if uID not in model.vocabs['uID']:
+            raise KeyError(uID)
+        s = model.predict([np.full(len(jIDs), uID), jIDs],
+                          batch_size=len(jIDs)).ravel()
+
+        with self.lock:
+            # Scores of a model that was reloaded meanwhile are not cached
+            if version == self.version:
+                self.cache[uID] = s
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return jIDs, s
+
+    def recommend(self, uID, n=10):
+        """
+        Arguments:
+            - uID: int
+                User ID.
+            - n: int, default 10
+                Number of jokes to recommend; more than the number of
+                jokes gives every joke.
+        Returns:
+            - tuple (jIDs, scores) of the top n jokes, best first.
+        """
+        if n <= 0:
+            raise ValueError('n must be positive, not {}'.format(n))
+        jIDs, s = self.scores(uID)
+        idx = top_n(s, min(n, len(jIDs)))
+        return jIDs[idx], s[idx]
+
+class Handler(BaseHTTPRequestHandler):
+    'Requests of the service; `server.rec` is the Recommender'
+    # Keep-alive, so clients do not reconnect for each request
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are separate writes; with Nagle, the body
+    #   waits for the client's delayed ACK of the headers (~40ms).
+    disable_nagle_algorithm = True
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        rec = self.server.rec
+        if url.path == '/health':
+            self.send_json(200, {'version': rec.version,
+                                 'cached': len(rec.cache)})
+        elif url.path == '/recommend':
+            q = parse_qs(url.query)
+            try:
+                uID = int(q['uid'][0])
+                n = int(q.get('n', ['10'])[0])
+                if n <= 0:
+                    raise ValueError(n)
+            except (KeyError, ValueError):
+                self.send_json(400, {'error': 'expected ?uid=<int>&n=<int>'})
+                return
+            try:
+                jIDs, scores = rec.recommend(uID, n)
+            except KeyError:
+                self.send_json(404, {'error': 'unknown uID {}'.format(uID)})
+                return
+            self.send_json(200, {'uID': uID, 'jIDs': jIDs.tolist(),
+                                 'scores': scores.tolist()})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if urlparse(self.path).path == '/reload':
+            self.server.rec.reload()
+            self.send_json(200, {'version': self.server.rec.version})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def log_message(self, format, *args):
+        pass    # one line per request is too slow under load
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def serve(rec, host='127.0.0.1', port=8000):
+    """
+    Serve a Recommender until interrupted.
+
+    Arguments:
+        - rec: Recommender
+        - host: str, default '127.0.0.1'
+        - port: int, default 8000
+    """
+    server = start(rec, host, port, thread=False)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def start(rec, host='127.0.0.1', port=0, thread=True):
+    """
+    Arguments:
+        - rec, host:
+            See serve().
+        - port: int, default 0
+            Port to listen on; 0 picks a free one.
+        - thread: boolean, default True
+            Whether to serve on a daemon thread.
+    Returns:
+        - Server; its URL is 'http://{}:{}'.format(*server.server_address).
+    """
+    server = Server((host, port), Handler)
+    server.rec = rec
+    if thread:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', help='.h5 file of Mlp.save(), or a '
+                                      'directory of npmlp.export()')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cache', type=int, default=10000,
+                        help='max number of users whose scores are cached')
+    a = parser.parse_args()
+
+    rec = Recommender(os.path.abspath(a.model), a.cache)
+    print('Serving {} on http://{}:{}'.format(a.model, a.host, a.port))
+    serve(rec, a.host, a.port)
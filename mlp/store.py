@@ -0,0 +1,183 @@
+import os
+import json
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+# Content-addressed artifact store.
+#
+# An artifact is a directory of files produced by a pipeline stage. It is
+#   stored under the key of the stage, a hash of the stage name, its
+#   parameters, and the digests of its inputs, so a stage whose inputs and
+#   parameters did not change finds its artifact instead of running again.
+#
+#   store/
+#     |____ 3f2a...c1/     artifact of one stage run
+#     |        |____ ...   files written by the stage
+#     |        |____ DIGEST
+#     |____ .digests.json  digests of input files, by path/size/mtime
+#
+# DIGEST holds a hash of the artifact's content; later stages key on it, so
+#   a stage that reruns but produces the same files does not invalidate
+#   the stages after it. Artifacts are evicted least recently used first
+#   once the store grows past max_bytes.
+
+DIGEST = 'DIGEST'
+INDEX = '.digests.json'
+
+def _sha1_file(fn, h=None):
+    h = h or hashlib.sha1()
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h
+
+def dir_digest(dn):
+    """
+    Arguments:
+        - dn: str
+            Directory.
+    Returns:
+        - str hash of the names and content of every file under `dn`, except
+          DIGEST.
+    """
+    h = hashlib.sha1()
+    for root, dirs, files in os.walk(dn):
+        dirs.sort()
+        for name in sorted(files):
+            fn = os.path.join(root, name)
+            if fn == os.path.join(dn, DIGEST):
+                continue
+            h.update(os.path.relpath(fn, dn).encode())
+            _sha1_file(fn, h)
+    return h.hexdigest()
+
+def _size(dn):
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, dirs, files in os.walk(dn) for f in files)
+
+class ArtifactStore(object):
+    """
+    Directory of artifacts keyed by stage, parameters, and input digests.
+    """
+    def __init__(self, root='store', max_bytes=8 * 2**30):
+        """
+        Arguments:
+            - root: str, default 'store'
+                Directory of the store.
+            - max_bytes: int, default 8 GiB
+                Size above which the least recently used artifacts are
+                evicted.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def file_digest(self, fn):
+        """
+        Hash of the content of an input file. It is only read again when
+        its size or mtime changed since the last call.
+        """
+        st = os.stat(fn)
+        stamp = [st.st_size, st.st_mtime_ns]
+        index = self._index()
+        path = os.path.abspath(fn)
+        if path in index and index[path][0] == stamp:
+            return index[path][1]
+
+        digest = _sha1_file(fn).hexdigest()
+        index[path] = [stamp, digest]
+        # Replace atomically; processes that race here only redo work
+        tmp = os.path.join(self.root, INDEX + '.{}'.format(os.getpid()))
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, os.path.join(self.root, INDEX))
+        return digest
+
+    def _index(self):
+        try:
+            with open(os.path.join(self.root, INDEX)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def key(self, stage, params, inputs):
+        """
+        Arguments:
+            - stage: str
+                Stage name.
+            - params: dict
+                JSON-serializable parameters of the stage.
+            - inputs: list
+                Digests of the stage's inputs: file_digest() of files,
+                digest() of upstream artifacts.
+        Returns:
+            - str key of the stage run.
+        """
+        blob = json.dumps({'stage': stage, 'params': params,
+                           'inputs': list(inputs)}, sort_keys=True)
+        return hashlib.sha1(blob.encode()).hexdigest()
+
+    def path(self, key):
+        'Directory of an artifact'
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """
+        Returns:
+            - str directory of the artifact, or None if it is not stored.
+              Marks the artifact as recently used.
+        """
+        dn = self.path(key)
+        if not os.path.exists(os.path.join(dn, DIGEST)):
+            return None
+        os.utime(dn)
+        return dn
+
+    def digest(self, key):
+        'Content hash of a stored artifact'
+        with open(os.path.join(self.path(key), DIGEST)) as f:
+            return f.read().strip()
+
+    @contextmanager
+    def put(self, key):
+        """
+        Context that yields an empty directory to write an artifact into.
+        The artifact is stored under `key` only if the context exits without
+        an error.
+        """
+        dn = self.path(key)
+        tmp = '{}.tmp{}'.format(dn, os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            yield tmp
+            with open(os.path.join(tmp, DIGEST), 'w') as f:
+                f.write(dir_digest(tmp))
+            shutil.rmtree(dn, ignore_errors=True)
+            os.rename(tmp, dn)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def evict(self, keep=()):
+        """
+        Remove the least recently used artifacts until the store is no
+        larger than max_bytes.
+
+        Arguments:
+            - keep: list, default ()
+                Keys that must not be evicted, e.g. the current run's.
+        """
+        entries = []
+        for e in os.scandir(self.root):
+            if e.is_dir() and os.path.exists(os.path.join(e.path, DIGEST)):
+                entries.append((e.stat().st_mtime, e.name, _size(e.path)))
+
+        total = sum(e[2] for e in entries)
+        for mtime, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            total -= size
@@ -0,0 +1,298 @@
+import os
+import sys
+import json
+import math
+import time
+import sqlite3
+import argparse
+import itertools
+import numpy as np
+
+# Hyperband sweep over the Mlp arguments of train_mlp.py.
+#
+# A search space maps Mlp.__init__ arguments to the values to try, e.g.
+#
+#   {"lr": [0.01, 0.05, 0.1],
+#    "batch_size": [1024, 4096],
+#    "layer_sizes": [[[16, 3], 200, 100], [[32, 3], 400, 200, 100]]}
+#
+# and a config is one value of each. Every bracket of Hyperband runs
+#   successive halving: n configs are trained on every pair of p for r
+#   epochs, scored by their best n_ratings-weighted validation MAE so far,
+#   and the best 1/eta of them go on for eta times as many epochs, until
+#   max_epoch. Configs continue from their checkpoints between rungs, so
+#   every epoch is trained once.
+#
+#   sweep/
+#     |____ sweeps.db           results table; see DB_SCHEMA
+#     |____ {name}/trial{k}/    cube and pair checkpoints of each config
+
+SWEEP_DIR = 'sweep'
+DB = os.path.join(SWEEP_DIR, 'sweeps.db')
+
+# One row per config and rung. epochs is what the config has been trained
+#   for so far; mae and best_epoch are of its weighted validation MAE.
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    sweep TEXT, trial INTEGER, bracket INTEGER, rung INTEGER,
+    epochs INTEGER, config TEXT, mae REAL, best_epoch INTEGER,
+    seconds REAL,
+    PRIMARY KEY (sweep, trial, rung))
+"""
+
+def configs(space, n, seed=9999):
+    """
+    Arguments:
+        - space: dict
+            {Mlp argument: list of values}.
+        - n: int
+            Number of configs, drawn at random from the grid of `space`
+            without repeats. The whole grid if n is at least its size.
+        - seed: int, default 9999
+    Returns:
+        - list of min(n, grid size) dicts {Mlp argument: value}.
+    """
+    names = sorted(space)
+    grid = list(itertools.product(*[space[k] for k in names]))
+    if n < len(grid):
+        rng = np.random.RandomState(seed)
+        grid = [grid[i] for i in sorted(rng.choice(len(grid), n, False))]
+    return [dict(zip(names, c)) for c in grid]
+
+def brackets(min_epoch, max_epoch, eta):
+    """
+    Brackets of Hyperband, most exploratory first.
+
+    Returns:
+        - list of (n_configs, first rung epochs) of every bracket.
+    """
+    s_max = int(math.floor(math.log(max_epoch / min_epoch, eta) + 1e-9))
+    return [(int(math.ceil((s_max + 1) / (s + 1) * eta**s)),
+             max(min_epoch, int(round(max_epoch / eta**s))))
+            for s in range(s_max, -1, -1)]
+
+def successive_halving(trials, epochs, max_epoch, eta, run, record=None):
+    """
+    Arguments:
+        - trials: list
+            {'trial': id, 'config': dict} of every config.
+        - epochs: int
+            Epochs of the first rung.
+        - max_epoch: int
+            Epochs of the last rung.
+        - eta: int
+            1/eta of the configs go on to the next rung.
+        - run: func
+            run(trials, epochs) trains every trial up to `epochs` epochs and
+            returns the weighted validation MAE of each at every epoch.
+        - record: func, default None
+            record(trial, rung, epochs, seconds), called for every trial of
+            every rung.
+    Returns:
+        - the trial with the lowest MAE of the last rung, with 'mae',
+          'best_epoch', and 'epochs' set.
+    """
+    rung = 0
+    while True:
+        t0 = time.perf_counter()
+        curves = run(trials, epochs)
+        seconds = (time.perf_counter() - t0) / len(trials)
+        for t, curve in zip(trials, curves):
+            t['epochs'] = epochs
+            t['best_epoch'] = int(np.argmin(curve))
+            t['mae'] = float(curve[t['best_epoch']])
+            if record is not None:
+                record(t, rung, epochs, seconds)
+
+        trials = sorted(trials, key=lambda t: t['mae'])
+        if epochs >= max_epoch or len(trials) <= 1:
+            return trials[0]
+        trials = trials[:max(1, len(trials) // eta)]
+        epochs = min(max_epoch, epochs * eta)
+        rung += 1
+
+def hyperband(space, min_epoch, max_epoch, eta, run, record=None, seed=9999):
+    """
+    Arguments:
+        - space: dict
+            {Mlp argument: list of values}.
+        - min_epoch, max_epoch: int
+            Epochs of the first rung of the most exploratory bracket, and of
+            the last rung of every bracket.
+        - eta, run, record:
+            See successive_halving(); `record` also gets the bracket as
+            trial['bracket'].
+        - seed: int, default 9999
+            Seed of the config sampling.
+    Returns:
+        - the best trial over all brackets.
+    """
+    best = None
+    k = 0
+    for b, (n, epochs) in enumerate(brackets(min_epoch, max_epoch, eta)):
+        trials = [{'trial': k + i, 'bracket': b, 'config': c}
+                  for i, c in enumerate(configs(space, n, seed + b))]
+        k += n
+        print('Bracket {}: {} configs from {} epochs'.format(b, n, epochs))
+        t = successive_halving(trials, epochs, max_epoch, eta, run, record)
+        if best is None or t['mae'] < best['mae']:
+            best = t
+    return best
+
+def mlp_args(config):
+    'Mlp arguments of a config, with JSON lists turned back into tuples'
+    args = dict(config)
+    if 'layer_sizes' in args:
+        args['layer_sizes'] = ([tuple(args['layer_sizes'][0])]
+                               + list(args['layer_sizes'][1:]))
+    return args
+
+class PairRunner(object):
+    """
+    The `run` of successive_halving() that trains every pair of p with the
+    config of each trial, one (trial, pair) per worker process.
+    """
+    def __init__(self, dn, p, max_epoch, workers=1, threads=None):
+        """
+        Arguments:
+            - dn: str
+                Directory of the sweep.
+            - p: int
+                Proportion of training set to run. Must be 30, 60, or 90.
+            - max_epoch: int
+                Most epochs any trial is trained for.
+            - workers, threads:
+                See train_mlp.run_pairs().
+        """
+        from train_mlp import pair_prefixes, val_index
+        self.dn = dn
+        self.pfs = pair_prefixes(p)
+        self.uIDs, self.n_ratings = val_index(self.pfs)
+        self.max_epoch = max_epoch
+        self.workers = workers
+        self.threads = threads
+
+    def __call__(self, trials, epochs):
+        from cube import create_cube
+        from train_mlp import map_pairs, pair_ckpt
+
+        args = []
+        for t in trials:
+            dn = os.path.join(self.dn, 'trial{}'.format(t['trial']))
+            cube = os.path.join(dn, 'ests.npy')
+            if not os.path.exists(cube):
+                os.makedirs(dn, exist_ok=True)
+                create_cube(cube, self.max_epoch)
+            # Estimates are only predicted at the last epoch; the sweep
+            #   only needs the MAEs.
+            args += [(idx, f, epochs, cube, self.uIDs, self.threads,
+                      self.max_epoch, None, pair_ckpt(dn, idx), 1, True,
+                      mlp_args(t['config']))
+                     for idx, f in enumerate(self.pfs)]
+
+        results = map_pairs(args, self.workers, self.threads)
+        n = len(self.pfs)
+        return [np.dot(self.n_ratings,
+                       np.vstack([r[1] for r in results[i*n:(i+1)*n]]))
+                / self.n_ratings.sum()
+                for i in range(len(trials))]
+
+def recorder(db, sweep):
+    'record() of successive_halving() that inserts into the trials table'
+    def record(t, rung, epochs, seconds):
+        with db:
+            db.execute('INSERT OR REPLACE INTO trials VALUES '
+                       '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (sweep, t['trial'], t.get('bracket', 0), rung, epochs,
+                        json.dumps(t['config'], sort_keys=True), t['mae'],
+                        t['best_epoch'], seconds))
+    return record
+
+def connect(fn=DB):
+    'Results database, with the trials table created if needed'
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    db = sqlite3.connect(fn)
+    db.execute(DB_SCHEMA)
+    return db
+
+def main(p, space, name=None, min_epoch=3, max_epoch=81, eta=3, workers=1,
+         threads=None):
+    """
+    Arguments:
+        - p: int
+            Proportion of training set to run. Must be 30, 60, or 90.
+        - space: dict
+            {Mlp argument: list of values}.
+        - name: str, default None
+            Name of the sweep. Defaults to a time-stamp.
+        - min_epoch, max_epoch, eta:
+            See hyperband().
+        - workers: int, default 1
+            Number of (config, pair) trained in parallel.
+        - threads: int, default None
+            Max number of TF/BLAS threads per worker.
+    Returns:
+        - the best trial.
+    """
+    name = name or hex(int(time.time()))[2:]
+    dn = os.path.join(SWEEP_DIR, name)
+    print('Sweep {}: p: {}; epochs: {} to {}; eta: {}'
+          .format(name, p, min_epoch, max_epoch, eta))
+
+    db = connect()
+    run = PairRunner(dn, p, max_epoch, workers, threads)
+    best = hyperband(space, min_epoch, max_epoch, eta, run,
+                     recorder(db, name))
+    print('Best: MAE {:.4f} at epoch {} of {}'
+          .format(best['mae'], best['best_epoch'], best['config']))
+    return best
+
+def show(name=None, top=10):
+    'Print the best configs of a sweep, by default the latest one'
+    db = connect()
+    if name is None:
+        name = db.execute('SELECT sweep FROM trials ORDER BY rowid DESC '
+                          'LIMIT 1').fetchone()[0]
+    rows = db.execute('SELECT trial, bracket, MAX(epochs), MIN(mae), config '
+                      'FROM trials WHERE sweep = ? GROUP BY trial '
+                      'ORDER BY MAX(epochs) DESC, MIN(mae) LIMIT ?',
+                      (name, top)).fetchall()
+    epochs = db.execute('SELECT SUM(e) FROM (SELECT MAX(epochs) AS e '
+                        'FROM trials WHERE sweep = ? GROUP BY trial)',
+                        (name,)).fetchone()[0]
+    print('Sweep {}: {} epochs trained'.format(name, epochs))
+    print('trial\tbracket\tepochs\tMAE\tconfig')
+    for r in rows:
+        print('{}\t{}\t{}\t{:.4f}\t{}'.format(*r))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='cmd')
+    r = sub.add_parser('run', help='run a sweep')
+    r.add_argument('p', type=int, choices=[30, 60, 90])
+    r.add_argument('space', help='JSON file of {Mlp argument: [values]}')
+    r.add_argument('--name', default=None)
+    r.add_argument('--min-epoch', type=int, default=3)
+    r.add_argument('--max-epoch', type=int, default=81)
+    r.add_argument('--eta', type=int, default=3)
+    r.add_argument('--workers', type=int, default=1)
+    r.add_argument('--threads', type=int, default=None,
+                   help='threads per worker')
+    s = sub.add_parser('show', help='print the best configs of a sweep')
+    s.add_argument('name', nargs='?', default=None)
+    s.add_argument('--top', type=int, default=10)
+    a = parser.parse_args()
+
+    if a.cmd == 'run':
+        with open(a.space) as f:
+            space = json.load(f)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))    # Set path
+
+    if a.cmd == 'run':
+        main(a.p, space, a.name, a.min_epoch, a.max_epoch, a.eta, a.workers,
+             a.threads)
+    elif a.cmd == 'show':
+        show(a.name, a.top)
+    else:
+        parser.print_help()
+        sys.exit(1)
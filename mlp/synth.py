@@ -0,0 +1,159 @@
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from cvcache import SHIFT
+from baselines import matrix_csv
+from cvsplit import _ranks, open_splits, write_pairs
+
+# Synthetic Jester-shaped dataset of any number of users and jokes, written
+#   in the layout of the real one,
+#
+#   {out}/
+#     |____ cvout/{p}_{i}_train.csv, {p}_{i}_test.csv   for p = 30, 60, 90
+#     |____ data/jester-data-testing.csv
+#     |____ data/compare_uniform.csv, compare_totalAVG.csv, compare_userAVG.csv
+#
+# so that train_mlp.py and format.py can be run on it, e.g. with 1M users or
+#   1,000 jokes.
+#
+# Ratings come from a latent-factor model,
+#
+#   r = MU + b_u + b_j + U_u . V_j + noise, clipped to [-10, 10],
+#
+#   rounded to 2 decimals like Jester's. Which jokes a user rated follows
+#   Jester's pattern: a gauge set of jokes everyone rated, a share of users
+#   who rated every joke, and the rest rating at least MIN_RATED of the
+#   jokes, picked by joke popularity. N_TEST random users who rated every
+#   joke are the test users.
+#
+# The pairs of each p are split as by cvsplit.py, which follows nmf/CV.R.
+#   As in the real jester-data-testing.csv, UserIDs of the data/ CSVs are
+#   the uIDs minus 1.
+#
+# Users are generated CHUNK_CELLS / n_jokes at a time and appended to every
+#   file, so memory does not grow with the number of users. The output
+#   depends on the seed and the chunk size.
+
+MU = 0.8            # global mean of Jester's ratings
+S_USER = 2.5        # std of the user biases
+S_JOKE = 1.5        # std of the joke biases
+S_FACTOR = 1.1      # std of the entries of U and V
+S_NOISE = 2.5       # std of the rating noise
+RANK = 8            # number of latent factors
+
+GAUGE = 0.1         # share of the jokes every user rated
+FULL = 0.25         # share of the users who rated every joke
+MIN_RATED = 0.15    # share of the jokes every user rated at least
+POPULARITY = 0.5    # Zipf exponent of the joke popularity
+
+N_TEST = 300
+CHUNK_CELLS = 2000000
+
+def generate(out, n_users=73421, n_jokes=100, ps=(30, 60, 90), rank=RANK,
+             seed=9999, chunk_cells=CHUNK_CELLS):
+    """
+    Arguments:
+        - out: str
+            Output directory; cvout/ and data/ are created in it.
+        - n_users: int, default 73421
+            Number of users; uIDs are 1 to n_users.
+        - n_jokes: int, default 100
+            Number of jokes; jIDs are 1 to n_jokes.
+        - ps: tuple, default (30, 60, 90)
+            Training sizes to write the pairs of.
+        - rank: int, default RANK
+            Number of latent factors.
+        - seed: int, default 9999
+        - chunk_cells: int, default CHUNK_CELLS
+            Number of user x joke cells generated at a time.
+    Returns:
+        - dict {'ratings', 'rows', 'seconds'} of the number of ratings, the
+          number of rows written to cvout, and the time taken.
+    """
+    assert(n_users >= N_TEST)
+    t0 = time.perf_counter()
+    rs = np.random.RandomState(seed)
+
+    # Jokes: biases, factors, popularity, and the gauge set
+    b_joke = rs.randn(n_jokes) * S_JOKE
+    V = rs.randn(n_jokes, rank) * S_FACTOR
+    log_w = -POPULARITY * np.log1p(rs.permutation(n_jokes))
+    log_w[rs.choice(n_jokes, max(1, int(round(GAUGE * n_jokes))),
+                    replace=False)] = np.inf
+    min_rated = max(int(np.ceil(MIN_RATED * n_jokes)),
+                    int(np.isinf(log_w).sum()))
+    testuIDs = np.sort(rs.choice(n_users, N_TEST, replace=False) + 1)
+
+    files = open_splits(os.path.join(out, 'cvout'), ps)
+
+    test_rows = []
+    total, n_ratings, n_rows = 0., 0, 0
+    step = max(1, chunk_cells // n_jokes)
+    for k, lo in enumerate(range(0, n_users, step)):
+        # Every chunk has its own stream, seeded from the chunk's index
+        crs = np.random.RandomState([seed, k])
+        uIDs = np.arange(lo + 1, min(lo + step, n_users) + 1)
+        m = len(uIDs)
+        is_test = np.isin(uIDs, testuIDs)
+
+        R = (MU + crs.randn(m, 1) * S_USER + b_joke
+             + (crs.randn(m, rank) * S_FACTOR) @ V.T
+             + crs.randn(m, n_jokes) * S_NOISE)
+        R = np.round(np.clip(R, -10, 10), 2)
+
+        # Number of rated jokes, the most popular ones being likelier
+        n_rated = np.where(crs.rand(m) < FULL, n_jokes,
+                           min_rated + np.floor((n_jokes - min_rated + 1)
+                                                * crs.beta(0.8, 1.2, m)))
+        n_rated = np.minimum(n_rated, n_jokes).astype(int)
+        n_rated[is_test] = n_jokes
+        keys = log_w + crs.gumbel(size=(m, n_jokes))
+        rated = _ranks(-keys) < n_rated[:, np.newaxis]
+
+        cents = np.rint((R + SHIFT) * 100).astype(int)
+        total += R[rated].sum()
+        n_ratings += int(rated.sum())
+        test_rows.append(R[is_test])
+
+        n_rows += write_pairs(files, crs, ps, uIDs, rated, is_test, cents)
+
+    for f in files.values():
+        f.close()
+
+    dn = os.path.join(out, 'data')
+    os.makedirs(dn, exist_ok=True)
+    test_rows = np.concatenate(test_rows)
+    userIDs = testuIDs - 1      # UserIDs start from 0
+    matrix_csv(os.path.join(dn, 'jester-data-testing.csv'), userIDs,
+                test_rows, 2)
+    matrix_csv(os.path.join(dn, 'compare_uniform.csv'), userIDs,
+                rs.uniform(-10, 10, test_rows.shape), 2)
+    matrix_csv(os.path.join(dn, 'compare_totalAVG.csv'), userIDs,
+                np.full(test_rows.shape, total / n_ratings), 3)
+    matrix_csv(os.path.join(dn, 'compare_userAVG.csv'), userIDs,
+                np.repeat(test_rows.mean(1, keepdims=True), n_jokes, 1), 4)
+
+    seconds = time.perf_counter() - t0
+    print('users: {}\tjokes: {}\tratings: {}\trows written: {}\t'
+          'time: {:.1f}s\t{:.0f} rows/sec'
+          .format(n_users, n_jokes, n_ratings, n_rows, seconds,
+                  n_rows / seconds))
+    return {'ratings': n_ratings, 'rows': n_rows, 'seconds': seconds}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('out', help='output directory')
+    parser.add_argument('--users', type=int, default=73421)
+    parser.add_argument('--jokes', type=int, default=100)
+    parser.add_argument('--p', type=int, nargs='+', choices=[30, 60, 90],
+                        default=[30, 60, 90])
+    parser.add_argument('--rank', type=int, default=RANK)
+    parser.add_argument('--seed', type=int, default=9999)
+    parser.add_argument('--chunk-cells', type=int, default=CHUNK_CELLS,
+                        help='user x joke cells generated at a time')
+    a = parser.parse_args()
+
+    generate(a.out, a.users, a.jokes, tuple(a.p), a.rank, a.seed,
+             a.chunk_cells)
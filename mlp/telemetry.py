@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# Telemetry of training runs, one JSON object per line,
+#
+#   {"event": "stage", "stage": "predict", "seconds": 0.41, "pair": 3, ...}
+#   {"event": "epoch", "epoch": 7, "seconds": 12.3, "fit": 11.8,
+#    "stages": {"predict": 0.41, "checkpoint": 0.09},
+#    "samples_per_sec": 127000.5, "rss_kb": ..., "peak_rss_kb": ..., ...}
+#   {"event": "profile", "samples": 2500, "top_self": [[frame, count], ...],
+#    "top_total": ...}
+#
+# with "time" and "pid", and the context of the Telemetry, e.g. the pair, in
+#   every line. Worker processes append to the same file; every line is one
+#   write(). The epoch lines are written by train_mlp.EpochTelemetry; the
+#   time of the stages timed during an epoch is taken out of its "fit".
+#
+#   python3 telemetry.py FILE [--top N]
+#
+# prints the hottest stages, the epochs of every pair, and the hottest frames
+#   of the sampling profiler.
+
+def rss_kb():
+    'Resident memory of this process in kB; None where /proc is missing'
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def peak_rss_kb():
+    'Peak resident memory of this process in kB; None where unknown'
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+class Telemetry(object):
+    """
+    Writer of a telemetry JSONL file; see above. With no file, nothing is
+    written, but the timers still run, so callers need no checks.
+    """
+    def __init__(self, fn=None, **context):
+        """
+        Arguments:
+            - fn: str, default None
+                JSONL file to append to. None disables the telemetry.
+            - context: keyword arguments
+                Fields of every line, e.g. pair=3.
+        """
+        self.fn = fn
+        self.context = context
+        self.lock = threading.Lock()
+        # Seconds of each stage since the last pop_stages()
+        self.stages = Counter()
+
+    def record(self, event, **fields):
+        'Append a line of `event` with `fields`'
+        if self.fn is None:
+            return
+        line = dict(self.context, event=event, time=time.time(),
+                    pid=os.getpid(), **fields)
+        data = (json.dumps(line) + '\n').encode()
+        with self.lock:
+            # One write() of O_APPEND, so lines of processes do not interleave
+            fd = os.open(self.fn, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        """
+        Time the body as `stage`, and record it with `fields` and the memory
+        after it.
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - t0
+            with self.lock:
+                self.stages[stage] += seconds
+            self.record('stage', stage=stage, seconds=seconds,
+                        rss_kb=rss_kb(), peak_rss_kb=peak_rss_kb(), **fields)
+
+    def pop_stages(self):
+        'Seconds of each stage timed since the last call'
+        with self.lock:
+            stages, self.stages = dict(self.stages), Counter()
+        return stages
+
+    @contextmanager
+    def profile(self, interval=None):
+        """
+        Run a SamplingProfiler on the calling thread during the body and
+        record its hottest frames. A no-op without an interval or a file.
+
+        Arguments:
+            - interval: float, default None
+                Seconds between samples.
+        """
+        if not interval or self.fn is None:
+            yield
+            return
+        prof = SamplingProfiler(interval)
+        prof.start()
+        try:
+            yield
+        finally:
+            prof.stop()
+            self.record('profile', interval=interval, samples=prof.samples,
+                        top_self=prof.top(prof.self_counts),
+                        top_total=prof.top(prof.total_counts))
+
+# Telemetry that records nothing
+NULL = Telemetry()
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '{}:{}:{}'.format(os.path.basename(code.co_filename),
+                             code.co_name, code.co_firstlineno)
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler of one thread: a background thread takes its stack
+    from sys._current_frames() every `interval` seconds, and counts the
+    functions on top (self) and anywhere on it (total).
+    """
+    def __init__(self, interval=0.005, thread_id=None):
+        """
+        Arguments:
+            - interval: float, default 0.005
+                Seconds between samples.
+            - thread_id: int, default None
+                threading.get_ident() of the thread to sample. None is the
+                calling thread.
+        """
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples = 0
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.self_counts[_frame_name(frame)] += 1
+            names = set()
+            while frame is not None:
+                names.add(_frame_name(frame))
+                frame = frame.f_back
+            self.total_counts.update(names)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def top(self, counts, n=20):
+        'The n most sampled frames of `counts`, as [[frame, count], ...]'
+        return [[k, v] for k, v in counts.most_common(n)]
+
+def load(fn):
+    'Lines of a telemetry file'
+    with open(fn) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def summarize(fn, top=10):
+    """
+    Print the stages by total time, the epochs of every pair, and the
+    hottest frames of the profiles in a telemetry file.
+
+    Arguments:
+        - fn: str
+            Telemetry JSONL file.
+        - top: int, default 10
+            Number of stages and frames to print.
+    Returns:
+        - dict {stage: total seconds}, with 'fit' from the epoch lines.
+    """
+    lines = load(fn)
+    epochs = [l for l in lines if l['event'] == 'epoch']
+
+    totals, calls = Counter(), Counter()
+    for l in lines:
+        if l['event'] == 'stage':
+            totals[l['stage']] += l['seconds']
+            calls[l['stage']] += 1
+    for l in epochs:
+        totals['fit'] += l['fit']
+        calls['fit'] += 1
+
+    grand = sum(totals.values()) or 1.
+    print('{:<16}{:>8}{:>12}{:>12}{:>8}'
+          .format('stage', 'calls', 'total s', 'mean ms', 'share'))
+    for stage, total in totals.most_common(top):
+        print('{:<16}{:>8}{:>12.2f}{:>12.1f}{:>7.1%}'
+              .format(stage, calls[stage], total,
+                      1000 * total / calls[stage], total / grand))
+
+    if epochs:
+        print()
+        print('{:<6}{:>8}{:>12}{:>12}{:>16}{:>14}'
+              .format('pair', 'epochs', 'mean s', 'fit s', 'samples/sec',
+                      'peak RSS MB'))
+        for pair in sorted({l.get('pair') for l in epochs},
+                           key=lambda p: (p is None, p)):
+            es = [l for l in epochs if l.get('pair') == pair]
+            peak = max(l['peak_rss_kb'] or 0 for l in es)
+            print('{:<6}{:>8}{:>12.2f}{:>12.2f}{:>16.0f}{:>14.1f}'
+                  .format(str(pair), len(es),
+                          sum(l['seconds'] for l in es) / len(es),
+                          sum(l['fit'] for l in es) / len(es),
+                          sum(l['samples_per_sec'] for l in es) / len(es),
+                          peak / 1024))
+
+    counts, samples = Counter(), 0
+    for l in lines:
+        if l['event'] == 'profile':
+            samples += l['samples']
+            counts.update(dict(l['top_self']))
+    if samples:
+        print()
+        print('{:<60}{:>8}{:>8}'.format('frame (self)', 'samples', 'share'))
+        for frame, n in counts.most_common(top):
+            print('{:<60}{:>8}{:>7.1%}'.format(frame[-60:], n, n / samples))
+
+    return dict(totals)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fn', help='telemetry JSONL file')
+    parser.add_argument('--top', type=int, default=10)
+    a = parser.parse_args()
+
+    summarize(a.fn, a.top)
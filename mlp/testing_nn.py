@@ -5,9 +5,11 @@ from keras.models import load_model
 from keras import optimizers
 import numpy as np
 import pandas as pd
+from cvcache import load_split
 
-tr = pd.read_csv('./cvout/90_12_train.csv')
-va = pd.read_csv('./cvout/90_12_test.csv')
+# Ratings with the NMF shift, as this model was trained on them
+tr = load_split('./cvout/90_12_train.csv', unshift=False)
+va = load_split('./cvout/90_12_test.csv', unshift=False)
 
 n_users = len(tr.uID.unique())
 n_jokes = len(tr.jID.unique())
@@ -18,4 +20,4 @@ model = load_model("model_90_12_epoch50.h5")
 predictions = model.predict([va.uID, va.jID])
 predictions = np.array([a[0] for a in predictions])
 mean_abs_error = np.mean(np.abs(predictions.T - va.rating))
-print "MAE for 90_12_test epoch 50 = ", mean_abs_error
+print("MAE for 90_12_test epoch 50 = ", mean_abs_error)
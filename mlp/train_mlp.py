@@ -1,76 +1,717 @@
 import sys
+import json
+import time
+import glob
 import pickle
+import argparse
+import multiprocessing as mp
+from contextlib import contextmanager
+import tensorflow as tf
 from mlp import *
+from cube import create_cube, open_cube, predict_due, predicted_epochs
+from cvcache import load_arrays, load_split, pair_prefixes
+from pivot import row_index
+from telemetry import NULL, Telemetry, rss_kb, peak_rss_kb
+import vocab
+
+# Seed of the first pair; pair i is seeded with SEED + i so that each pair's
+#   result does not depend on which process trained it or in what order.
+SEED = 9999
+
+# Mlp arguments of every pair; see Mlp.__init__. sweep.py searches over them.
+MLP_ARGS = {'lr': 0.1, 'batch_size': 4096, 'layer_sizes': [(16, 3), 200, 100]}
+
+# Environment variables read by the BLAS/OpenMP runtimes at import time.
+THREAD_ENV = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
 
 class SaveResults(keras.callbacks.Callback):
     """
     Save results to estimates, mae_tr, and mae_va after each epoch.
     """
-    def __init__(self, ests3, mae_tr, mae_va, cur_row, idx_pair, model):
+    def __init__(self, ests, mae_tr, mae_va, uIDs, idx_pair, model,
+                 predict_every=1, predict_batch_size=None, telemetry=NULL):
         """
         Arguments:
-            - ests3: list
-                Three column version of `ests`
+            - ests: np.memmap
+                Epoch cube of estimates; see cube.py. Without `uIDs`, an
+                n_epoch x len(model.va) array with one column per validation
+                rating instead.
             - mae_tr: np.matrix
                 Matrix of every pair's training MAE at each epoch.
             - mae_va: np.matrix
                 Matrix of every pair's validation MAE at each epoch.
-            - cur_row: int
-                Current starting row index to insert new rows.
+            - uIDs: np.array
+                Sorted test user IDs; uIDs[r] is the user of row r in `ests`.
+                None if `ests` is in the per-rating layout.
             - idx_pair: int
                 Current pair index.
             - model: Mlp object
                 Mlp object that is being used.
+            - predict_every: int, default 1
+                Predict the validation set every this many epochs (and at the
+                last epoch). The MAEs are recorded at every epoch regardless.
+            - predict_batch_size: int, default None
+                Batch size of predict(). None uses Keras' default of 32.
+            - telemetry: Telemetry, default NULL
+                Where the predict and write stages are timed.
         """
-        self.ests3 = ests3
+        self.ests = ests
         self.mae_tr = mae_tr
         self.mae_va = mae_va
-        self.i = cur_row
         self.idx_pair = idx_pair
         self.m = model
+        self.predict_every = predict_every
+        self.predict_batch_size = predict_batch_size
+        self.tel = telemetry
+
+        # Cells of `ests` that this pair's validation set fills
+        if uIDs is None:
+            self.cells = (slice(None),)
+        else:
+            self.cells = (row_index(uIDs, model.va.uID.values),
+                          model.va.jID.values - 1) # IDs start from 1
 
     def on_epoch_end(self, epoch, logs=None):
         idx = self.idx_pair
 
-        m = self.m
-        # preds_tr = (m.model.predict([m.tr.uID, m.tr.jID])).flatten()
-        preds_va = (m.model.predict([m.va.uID, m.va.jID])).flatten()
-
-        # Should be all zeros before getting written on
-        # assert(np.all(self.ests3[epoch][self.i:(self.i+m.va.shape[0]), :]
-        #               == 0))
-
-        # Insert to the pre-allocated matrix
-        self.ests3[epoch][self.i:(self.i+m.va.shape[0]), 0] = m.va.uID
-        self.ests3[epoch][self.i:(self.i+m.va.shape[0]), 1] = m.va.jID
-        self.ests3[epoch][self.i:(self.i+m.va.shape[0]), 2] = preds_va
+        if predict_due(epoch, self.ests.shape[0], self.predict_every):
+            self.save_estimates(epoch)
 
         # Training errors from predict() are supposed to be different from
         #   fit() due to training is done in batches.
         self.mae_tr[idx, epoch] = logs['mean_absolute_error']
         self.mae_va[idx, epoch] = logs['val_mean_absolute_error']
 
-def main(p, n_epoch):
+    def save_estimates(self, epoch):
+        """
+        Predict the validation set with the current weights and write the
+        estimates to `epoch` of the cube.
+        """
+        m = self.m
+        with self.tel.timer('predict', epoch=epoch, rows=len(m.va)):
+            # preds_tr = (m.predict([m.tr.uID, m.tr.jID])).flatten()
+            preds_va = (m.predict([m.va.uID, m.va.jID],
+                                  batch_size=self.predict_batch_size)
+                        ).flatten()
+
+        # Write this epoch to the cube right away, so nothing accumulates
+        #   in memory over the epochs.
+        with self.tel.timer('write', epoch=epoch):
+            self.ests[(epoch,) + self.cells] = preds_va
+            self.ests.flush()
+
+class Checkpoint(keras.callbacks.Callback):
+    """
+    Save the model, with its optimizer state, after each epoch of a pair,
+    along with the pair's MAEs so far.
+
+    The pair's checkpoint directory has
+        - epoch{e}.h5: model.save() after epoch e, with the vocabularies of
+          the Mlp, for the kept epochs,
+        - state.json: n_epoch, last_epoch, best_epoch (by the pair's
+          validation MAE), done, mae_tr, and mae_va up to last_epoch.
+    Only the last `keep_last` checkpoints and the best one are kept.
+    """
+    def __init__(self, dn, mae_tr, mae_va, n_epoch, vocabs, keep_last=2,
+                 keep_best=True, telemetry=NULL):
+        """
+        Arguments:
+            - dn: str
+                Checkpoint directory of the pair.
+            - mae_tr, mae_va: np.array
+                One-row MAE matrices filled by SaveResults, which must run
+                before this callback.
+            - n_epoch: int
+                Number of epochs the pair is trained for.
+            - vocabs: dict
+                Mlp.vocabs of the pair's Mlp.
+            - keep_last: int, default 2
+                Number of most recent checkpoints to keep; at least 1, which
+                resuming needs.
+            - keep_best: boolean, default True
+                Whether to also keep the checkpoint of the best epoch.
+            - telemetry: Telemetry, default NULL
+                Where saving the checkpoint is timed.
+        """
+        super(Checkpoint, self).__init__()
+        self.dn = dn
+        self.mae_tr = mae_tr
+        self.mae_va = mae_va
+        self.n_epoch = n_epoch
+        self.vocabs = vocabs
+        self.keep_last = max(1, keep_last)
+        self.keep_best = keep_best
+        self.tel = telemetry
+        os.makedirs(dn, exist_ok=True)
+
+    def on_epoch_end(self, epoch, logs=None):
+        with self.tel.timer('checkpoint', epoch=epoch):
+            self.save(epoch)
+
+    def save(self, epoch):
+        'Save the checkpoint of `epoch` and remove the ones not kept'
+        # The model is saved before the state that refers to it
+        fn = ckpt_path(self.dn, epoch)
+        self.model.save(fn)
+        vocab.save(fn, self.vocabs)
+
+        mae_va = self.mae_va[0, :epoch+1]
+        state = {'n_epoch': self.n_epoch, 'last_epoch': epoch,
+                 'best_epoch': int(mae_va.argmin()),
+                 'done': epoch == self.n_epoch - 1,
+                 'mae_tr': self.mae_tr[0, :epoch+1].tolist(),
+                 'mae_va': mae_va.tolist()}
+        write_state(self.dn, state)
+
+        keep = set(range(epoch - self.keep_last + 1, epoch + 1))
+        if self.keep_best:
+            keep.add(state['best_epoch'])
+        for fn in glob.glob(os.path.join(self.dn, 'epoch*.h5')):
+            if int(os.path.basename(fn)[5:-3]) not in keep:
+                os.remove(fn)
+
+def ckpt_path(dn, epoch):
+    'Path of the checkpoint of `epoch` in a pair\'s checkpoint directory'
+    return os.path.join(dn, 'epoch{}.h5'.format(epoch))
+
+def write_state(dn, state):
+    'Replace the state.json of a pair\'s checkpoint directory atomically'
+    fn = os.path.join(dn, 'state.json')
+    with open(fn + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(fn + '.tmp', fn)
+
+def read_state(dn):
+    'state.json of a pair\'s checkpoint directory; None if there is none'
+    try:
+        with open(os.path.join(dn, 'state.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class EpochTelemetry(keras.callbacks.Callback):
+    """
+    Record every epoch to a Telemetry: its wall time, the time of the stages
+    timed during it (SaveResults' predict and write, Checkpoint), the time
+    of fit, i.e. the rest, the training samples/sec of fit, the MAEs, and
+    the memory. Must come after the callbacks whose stages it takes out.
+    """
+    def __init__(self, telemetry, n_samples):
+        """
+        Arguments:
+            - telemetry: Telemetry
+            - n_samples: int
+                Number of training ratings per epoch.
+        """
+        super(EpochTelemetry, self).__init__()
+        self.tel = telemetry
+        self.n_samples = n_samples
+        self.t0 = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.tel.pop_stages()
+        self.t0 = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        seconds = time.perf_counter() - self.t0
+        stages = self.tel.pop_stages()
+        fit = seconds - sum(stages.values())
+        logs = logs or {}
+        self.tel.record('epoch', epoch=epoch, seconds=seconds, fit=fit,
+                        stages=stages,
+                        samples_per_sec=self.n_samples / max(fit, 1e-9),
+                        mae=float(logs.get('mean_absolute_error', np.nan)),
+                        val_mae=float(logs.get('val_mean_absolute_error',
+                                               np.nan)),
+                        rss_kb=rss_kb(), peak_rss_kb=peak_rss_kb())
+
+class StopPolicy(object):
+    """
+    Early stopping on a score that is fed one epoch at a time, e.g. the
+    weighted validation MAE over all pairs.
+    """
+    def __init__(self, patience, min_delta=0.):
+        """
+        Arguments:
+            - patience: int
+                Number of epochs without improvement before stopping.
+            - min_delta: float, default 0.
+                Minimum decrease of the score that counts as an improvement.
+        """
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best = np.inf
+        self.best_epoch = None
+        self.stop_epoch = None
+        self.wait = 0
+
+    def update(self, epoch, score):
+        """
+        Arguments:
+            - epoch: int
+                Index of the epoch that just finished.
+            - score: float
+                Score of that epoch; lower is better.
+        Returns:
+            - tuple (improved, stop) of booleans.
+        """
+        improved = score < self.best - self.min_delta
+        if improved:
+            self.best = score
+            self.best_epoch = epoch
+            self.wait = 0
+        else:
+            self.wait += 1
+
+        stop = self.wait >= self.patience
+        if stop:
+            self.stop_epoch = epoch
+
+        return improved, stop
+
+def val_index(pfs):
+    """
+    Arguments:
+        - pfs: list
+            Prefixes of the pairs' files.
+    Returns:
+        - tuple (uIDs, n_ratings) of the sorted unique uIDs of all validation
+          sets, and the number of ratings in each validation set.
+    """
+    vas = [load_arrays(f + '_test.csv')['uID'] for f in pfs]
+    return np.unique(np.concatenate(vas)), np.array([len(v) for v in vas])
+
+def reset_session(threads=None):
+    """
+    Start a new Keras session.
+
+    Arguments:
+        - threads: int, default None
+            Max number of TF intra-op threads. None leaves TF's default.
+    """
+    K.clear_session()
+    if threads is not None:
+        K.set_session(tf.Session(config=tf.ConfigProto(
+            intra_op_parallelism_threads=threads,
+            inter_op_parallelism_threads=1)))
+
+@contextmanager
+def thread_env(threads):
+    """
+    Set the BLAS/OpenMP thread counts in the environment for the processes
+    spawned inside the context. The runtimes read them when they are loaded,
+    so they have to be there when the workers start.
+    """
+    env = {k: os.environ.get(k) for k in THREAD_ENV}
+    for k in THREAD_ENV:
+        os.environ[k] = str(threads)
+    try:
+        yield
+    finally:
+        for k, v in env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+class PairTrainer(object):
+    """
+    Mlp of a single training/validation pair, with the SaveResults callback
+    that writes its results.
+    """
+    def __init__(self, idx, f, n_epoch, cube, uIDs, predict_every=1,
+                 predict_batch_size=None, ckpt=None, keep_last=2,
+                 resume=False, mlp_args=None, telemetry=None):
+        """
+        Arguments:
+            - idx: int
+                Pair index; the seed used is SEED + idx.
+            - f: str
+                Prefix of the pair's files, e.g. 'cvout/30_1'.
+            - n_epoch: int
+                Number of epochs to train.
+            - cube: str
+                Path of the epoch cube to write this pair's estimates to.
+            - uIDs: np.array
+                Sorted test user IDs, i.e. the rows of the cube. None if the
+                cube is in the per-rating layout of SaveResults.
+            - predict_every, predict_batch_size:
+                See SaveResults.
+            - ckpt: str, default None
+                Checkpoint directory of the pair; None saves no checkpoints.
+            - keep_last: int, default 2
+                See Checkpoint.
+            - resume: boolean, default False
+                Continue from the last checkpoint in `ckpt`, if any, with
+                its optimizer state and MAEs.
+            - mlp_args: dict, default None
+                Mlp arguments that replace the ones in MLP_ARGS.
+            - telemetry: str, default None
+                JSONL file to record the pair's epochs and stages to; see
+                telemetry.py. None records nothing.
+        """
+        print('########## Pair {} ##########'.format(idx))
+        np.random.seed(SEED + idx)
+        set_random_seed(SEED + idx)
+        self.tel = Telemetry(telemetry, pair=idx)
+
+        # The cache has the rating shift done in NMF undone already
+        with self.tel.timer('load'):
+            tr = load_split(f + '_train.csv')   # training
+            va = load_split(f + '_test.csv')    # validation
+
+        self.n_epoch = n_epoch
+
+        # One-row MAE matrices, so SaveResults can be used as it is.
+        self.mae_tr = np.zeros([1, n_epoch])
+        self.mae_va = np.zeros([1, n_epoch])
+
+        args = dict(MLP_ARGS, verbose=True, verbose_fit=1)
+        args.update(mlp_args or {})
+        with self.tel.timer('build'):
+            self.m = Mlp(tr, va, **args)
+            self.m.new_model()
+        self.cb = SaveResults(open_cube(cube, 'r+'), self.mae_tr, self.mae_va,
+                              uIDs, 0, self.m, predict_every,
+                              predict_batch_size, self.tel)
+        self.callbacks = [self.cb]
+        if ckpt is not None:
+            self.callbacks.append(Checkpoint(ckpt, self.mae_tr, self.mae_va,
+                                             n_epoch, self.m.vocabs,
+                                             keep_last, telemetry=self.tel))
+        if telemetry is not None:
+            self.callbacks.append(EpochTelemetry(self.tel, len(tr)))
+
+        # Epoch to start from; estimates of earlier epochs are in the cube
+        self.initial_epoch = 0
+        state = read_state(ckpt) if resume and ckpt is not None else None
+        if state is not None:
+            last = state['last_epoch']
+            print('Resuming from Epoch {}'.format(last))
+            # Compiled, with the optimizer state of that epoch; the
+            #   vocabularies of the same training set are the same.
+            with self.tel.timer('resume'):
+                self.m.model = keras.models.load_model(ckpt_path(ckpt, last))
+            self.mae_tr[0, :last+1] = state['mae_tr']
+            self.mae_va[0, :last+1] = state['mae_va']
+            self.initial_epoch = last + 1
+
+    def train(self):
+        'Train all epochs, or the ones left when resuming'
+        if self.initial_epoch < self.n_epoch:
+            self.m.train_model(self.n_epoch, callbacks=self.callbacks,
+                               initial_epoch=self.initial_epoch)
+
+    def step(self, epoch):
+        """
+        Train a single epoch.
+        Returns:
+            - tuple (mae_tr, mae_va) of that epoch.
+        """
+        self.m.train_model(epoch + 1, callbacks=self.callbacks,
+                           initial_epoch=epoch)
+        return self.mae_tr[0, epoch], self.mae_va[0, epoch]
+
+    def save(self, epoch):
+        'Write the estimates of the current weights to `epoch` of the cube'
+        self.cb.save_estimates(epoch)
+
+def train_pair(idx, f, n_epoch, cube, uIDs, threads=None, predict_every=1,
+               predict_batch_size=None, ckpt=None, keep_last=2, resume=False,
+               mlp_args=None, telemetry=None, profile=None):
+    """
+    Train a fresh Mlp on a single training/validation pair.
+
+    The Keras session and the numpy/TF seeds are reset before the model is
+    built, so a pair gives the same result whether it is trained in the
+    calling process or in a worker of `run_pairs`.
+
+    Arguments:
+        - idx, f, n_epoch, cube, uIDs, predict_every, predict_batch_size,
+          ckpt, keep_last, resume, mlp_args, telemetry:
+            See PairTrainer.
+        - threads: int, default None
+            Max number of TF intra-op threads. None leaves TF's default.
+        - profile: float, default None
+            Seconds between the samples of a SamplingProfiler run during
+            training, whose hottest frames go to `telemetry`. None does not
+            profile.
+    Returns:
+        - tuple (mae_tr, mae_va) of this pair's rows of the MAE matrices.
+    """
+    state = read_state(ckpt) if resume and ckpt is not None else None
+    if state is not None and state['last_epoch'] >= n_epoch - 1:
+        print('########## Pair {}: done ##########'.format(idx))
+        return (np.array(state['mae_tr'][:n_epoch]),
+                np.array(state['mae_va'][:n_epoch]))
+
+    reset_session(threads)
+    t = PairTrainer(idx, f, n_epoch, cube, uIDs, predict_every,
+                    predict_batch_size, ckpt, keep_last, resume, mlp_args,
+                    telemetry)
+    with t.tel.profile(profile):
+        t.train()
+    t.m.close()
+
+    return t.mae_tr[0], t.mae_va[0]
+
+def _train_pair(args):
+    'Unpack the arguments of train_pair for Pool.map'
+    return train_pair(*args)
+
+def map_pairs(args, workers=1, threads=None):
+    """
+    Run train_pair on every tuple of arguments in `args`, either one after
+    another or on a process pool.
+
+    Arguments:
+        - args: list
+            Arguments of each train_pair call.
+        - workers: int, default 1
+            Number of worker processes. 1 trains in the current process.
+        - threads: int, default None
+            Max number of BLAS threads per worker, set in their environment.
+    Returns:
+        - list of the results of train_pair, in the order of `args`.
+    """
+    if workers <= 1:
+        return [_train_pair(a) for a in args]
+    if threads is None:
+        threads = max(1, mp.cpu_count() // workers)
+
+    # spawn b/c TF does not survive a fork after initialization
+    with thread_env(threads), mp.get_context('spawn').Pool(workers) as pool:
+        return pool.map(_train_pair, args, chunksize=1)
+
+def pair_ckpt(ckpt, idx):
+    'Checkpoint directory of pair `idx` in the checkpoint directory of a run'
+    return None if ckpt is None else os.path.join(ckpt, 'pair{}'.format(idx))
+
+def run_pairs(pfs, n_epoch, cube, workers=1, threads=None, predict_every=1,
+              predict_batch_size=None, ckpt=None, keep_last=2, resume=False,
+              telemetry=None, profile=None):
+    """
+    Train every pair, either one after another or on a process pool, and
+    merge the results in the order of `pfs`.
+
+    Arguments:
+        - pfs: list
+            Prefixes of the pairs' files.
+        - n_epoch: int
+            Number of epochs to train.
+        - cube: str
+            Path of an epoch cube made by create_cube(). Every pair writes
+            its own cells, so the workers write to it directly.
+        - workers: int, default 1
+            Number of worker processes. 1 trains in the current process.
+        - threads: int, default None
+            Max number of TF/BLAS threads per worker. Defaults to
+            cpu_count() // workers when workers > 1.
+        - predict_every, predict_batch_size:
+            See SaveResults.
+        - ckpt: str, default None
+            Checkpoint directory of the run, with a pair{idx} subdirectory
+            per pair; None saves no checkpoints.
+        - keep_last: int, default 2
+            See Checkpoint.
+        - resume: boolean, default False
+            Skip the pairs that are done and continue the others from their
+            last checkpoint.
+        - telemetry, profile:
+            See train_pair().
+    Returns:
+        - tuple (mae_tr, mae_va) in the format used by `main`.
+    """
+    uIDs = val_index(pfs)[0]
+
+    workers = min(workers, len(pfs))
+    if workers > 1 and threads is None:
+        threads = max(1, mp.cpu_count() // workers)
+    args = [(idx, f, n_epoch, cube, uIDs, threads, predict_every,
+             predict_batch_size, pair_ckpt(ckpt, idx), keep_last, resume,
+             None, telemetry, profile)
+            for idx, f in enumerate(pfs)]
+    results = map_pairs(args, workers, threads)
+
+    mae_tr = np.vstack([r[0] for r in results])
+    mae_va = np.vstack([r[1] for r in results])
+
+    return mae_tr, mae_va
+
+class _LocalPairs(object):
+    'PairTrainers in the current process, driven like _RemotePairs'
+    def __init__(self, args, threads):
+        reset_session(threads)
+        self.trainers = [PairTrainer(*a) for a in args]
+        self.result = None
+
+    def send(self, cmd, epoch):
+        self.result = [getattr(t, cmd)(epoch) for t in self.trainers]
+
+    def recv(self):
+        return self.result
+
+    def close(self):
+        for t in self.trainers:
+            t.m.close()
+
+def _serve_pairs(conn, args, threads):
+    'Body of a _RemotePairs worker: run commands on its PairTrainers'
+    pairs = _LocalPairs(args, threads)
+    while True:
+        cmd, epoch = conn.recv()
+        if cmd is None:
+            pairs.close()
+            break
+        pairs.send(cmd, epoch)
+        conn.send(pairs.recv())
+
+class _RemotePairs(object):
+    'PairTrainers in a worker process, driven over a pipe'
+    def __init__(self, args, threads):
+        ctx = mp.get_context('spawn')
+        self.conn, conn = ctx.Pipe()
+        self.proc = ctx.Process(target=_serve_pairs, args=(conn, args, threads))
+        self.proc.start()
+
+    def send(self, cmd, epoch):
+        self.conn.send((cmd, epoch))
+
+    def recv(self):
+        return self.conn.recv()
+
+    def close(self):
+        self.conn.send((None, None))
+        self.proc.join()
+
+def run_lockstep(pfs, n_epoch, cube, policy, workers=1, threads=None,
+                 predict_every=1, predict_batch_size=None, ckpt=None,
+                 keep_last=2, telemetry=None):
+    """
+    Train every pair one epoch at a time, so the n_ratings-weighted
+    validation MAE over all pairs is known as each epoch finishes, and stop
+    once `policy` says so. The estimates of the best epoch so far are always
+    in the cube, even when it is not a `predict_every` epoch.
+
+    Pairs that share a worker share a TF graph, so results are reproducible
+    for a given number of workers but differ from run_pairs(). Checkpoints
+    are saved, but a run that stops early cannot be resumed.
+
+    Arguments:
+        - policy: StopPolicy
+            Stopping policy; its best_epoch and stop_epoch are set on return.
+        - Others: see run_pairs; pairs are not profiled.
+    Returns:
+        - tuple (mae_tr, mae_va) with a column for each epoch that was run.
+    """
+    uIDs, n_ratings = val_index(pfs)
+
+    workers = min(workers, len(pfs))
+    if workers > 1 and threads is None:
+        threads = max(1, mp.cpu_count() // workers)
+    args = [(idx, f, n_epoch, cube, uIDs, predict_every, predict_batch_size,
+             pair_ckpt(ckpt, idx), keep_last, False, None, telemetry)
+            for idx, f in enumerate(pfs)]
+    # Pairs of worker w are w, w + workers, w + 2*workers, ...
+    groups = [list(range(w, len(pfs), workers)) for w in range(workers)]
+
+    mae_tr = np.zeros([len(pfs), n_epoch])
+    mae_va = np.zeros([len(pfs), n_epoch])
+
+    if workers <= 1:
+        hosts = [_LocalPairs(args, threads)]
+    else:
+        with thread_env(threads):
+            hosts = [_RemotePairs([args[i] for i in g], threads)
+                     for g in groups]
+
+    def call(cmd, epoch):
+        for h in hosts:
+            h.send(cmd, epoch)
+        return [h.recv() for h in hosts]
+
+    epoch = -1      # last epoch run; none if n_epoch is 0
+    try:
+        for epoch in range(n_epoch):
+            for g, res in zip(groups, call('step', epoch)):
+                for i, (tr, va) in zip(g, res):
+                    mae_tr[i, epoch] = tr
+                    mae_va[i, epoch] = va
+
+            score = np.dot(n_ratings, mae_va[:, epoch]) / n_ratings.sum()
+            improved, stop = policy.update(epoch, score)
+            print('Epoch {}: weighted val MAE {:.4f}{}'
+                  .format(epoch, score, ' (best)' if improved else ''))
+
+            # Keep the best epoch's estimates while its weights are around
+            if improved and not predict_due(epoch, n_epoch, predict_every):
+                call('save', epoch)
+            if stop:
+                break
+    finally:
+        for h in hosts:
+            h.close()
+
+    return mae_tr[:, :epoch+1], mae_va[:, :epoch+1]
+
+def main(p, n_epoch, workers=1, threads=None, patience=None, min_delta=0.,
+         predict_every=1, predict_batch_size=None, checkpoint=True,
+         keep_last=2, resume=None, telemetry=None, profile=None):
     """
     Arguments:
         - p: int
             Proportion of training set to run. Must be 30, 60, or 90.
         - n_epoch: int
             Number of epochs to train.
+        - workers: int, default 1
+            Number of pairs trained in parallel.
+        - threads: int, default None
+            Max number of TF/BLAS threads per worker.
+        - patience: int, default None
+            Stop once the weighted validation MAE has not improved for this
+            many epochs. None trains all n_epoch epochs.
+        - min_delta: float, default 0.
+            Minimum decrease of the weighted validation MAE that counts as an
+            improvement.
+        - predict_every, predict_batch_size:
+            See SaveResults.
+        - checkpoint: boolean, default True
+            Whether to save the checkpoints of every pair in
+            pkl/ckpt_{p}_{n_epoch}_{ts}/; see Checkpoint.
+        - keep_last: int, default 2
+            See Checkpoint.
+        - resume: str, default None
+            Time-stamp of an earlier run of the same p and n_epoch to resume:
+            finished pairs are skipped and the others continue from their
+            last checkpoint. Resumed pairs do not reproduce the random state
+            of an uninterrupted run.
+        - telemetry: str, default None
+            JSONL file to record the epochs and stages of every pair to; see
+            telemetry.py. None records nothing.
+        - profile: float, default None
+            Seconds between the samples of the profiler of every pair; see
+            train_pair(). Ignored with `patience`.
     """
     assert(p in [30, 60, 90])
-    print('p: {}; n_epoch: {}'.format(p, n_epoch))
-    n_pairs = {'30':2, '60':3, '90':12}[str(p)]
+    assert(resume is None or patience is None)
+    print('p: {}; n_epoch: {}; workers: {}'.format(p, n_epoch, workers))
 
-    # prefixes for the files
-    pfs = [['cvout/30_' + str(i+1) for i in range(2)],
-           ['cvout/60_' + str(i+1) for i in range(3)],
-           ['cvout/90_' + str(i+1) for i in range(12)]]
     # Choose the corresponding prefixes
-    pfs = pfs[int(p/30-1)]
+    pfs = pair_prefixes(p)
+
+    dn = 'pkl/'
+    try:
+        os.mkdir(dn)
+    except FileExistsError:
+        pass
+
+    # Time-stamp for saving to avoid overwrite
+    ts = resume or hex(int((datetime.now()).timestamp()))[2:]
+    ckpt = '{}ckpt_{}_{}_{}'.format(dn, p, n_epoch, ts) if checkpoint else None
+    print('Time-stamp: {}'.format(ts))
 
-    # List of estimates made by the model by combining all pairs results at
-    #   each epoch.
+    # Epoch cube of estimates made by the model by combining all pairs
+    #   results at each epoch.
     #
     #  ests
     #   |____ [epoch 1]
@@ -85,85 +726,94 @@ def main(p, n_epoch):
     # testuID1     x     x     x   ...   x
     #   ...        x     x     x   ...   x
     # testuID300   x     x     x   ...   x
-    ests = []
-
-    # Similar to `ests`; however, each element stores a 30K*3 matrix, and
-    #   it will be used to form `ests`.
-    ests3 = []
-
-    for i in range(n_epoch):
-        ests.append(np.zeros([300, 100]))
-        ests3.append(np.zeros([300*100, 3]))
-
-    # Matrix of every pair's training MAE at each epoch from Keras fit().
     #
-    #         epoch1 epoch2 ...
-    # pair1     x      x   ...
-    # pair2     x      x   ...
-    #  ...
-    mae_tr = np.zeros([n_pairs, n_epoch])
+    # pkl/ests.npy
+    cube = '{}ests_{}_{}_{}.npy'.format(dn, p, n_epoch, ts)
+    if resume is None:
+        create_cube(cube, n_epoch)
+    elif not os.path.exists(cube):
+        raise FileNotFoundError('No run to resume: {}'.format(cube))
 
-    # Matrix of every pair's validation MAE at each epoch.
+    # mae_tr: matrix of every pair's training MAE at each epoch from Keras
+    #   fit().
     #
     #         epoch1 epoch2 ...
     # pair1     x      x   ...
     # pair2     x      x   ...
     #  ...
-    mae_va = np.zeros([n_pairs, n_epoch])
-
-    cur_row = 0
-
-    # for prefix of each pair in the set
-    for idx, f in enumerate(pfs):
-        print('########## Pair {} ##########'.format(idx))
-        tr = pd.read_csv(f + '_train.csv')  # training
-        va = pd.read_csv(f + '_test.csv')   # validation
-        # unshift the rating done in NMF
-        tr.rating -= 10
-        va.rating -= 10
-
-        m = Mlp(tr, va, lr=0.1, batch_size=4096,
-                layer_sizes=[(16, 3), 200, 100], verbose=True, verbose_fit=1)
-        m.new_model()
-        m.train_model(n_epoch, callbacks=[SaveResults(ests3, mae_tr, mae_va,
-                                                      cur_row, idx, m)])
-        cur_row += va.shape[0]
-
-    # Sorted unique test user IDs, so we can perform quick row # lookup.
-    uIDs = np.sort(np.unique(ests3[0][:, 0]))
-
-    for n in range(n_epoch):
-        # assert(np.all(uIDs == np.sort(np.unique(ests3[n][:, 0]))))
-        mtx3 = ests3[n] # 3-col matrix
-        # convert to the format of `ests`
-        for i in range(mtx3.shape[0]):
-            (u, j, r) = mtx3[i, :] # uID, jID, rating
-            u = np.where(uIDs == u)[0][0]
-            j = int(j) - 1  # uIDs and jIDs start from 1
-            ests[n][u, j] = r
+    #
+    # mae_va: matrix of every pair's validation MAE at each epoch; same
+    #   format as mae_tr.
+    if patience is None:
+        mae_tr, mae_va = run_pairs(pfs, n_epoch, cube, workers, threads,
+                                   predict_every, predict_batch_size, ckpt,
+                                   keep_last, resume is not None, telemetry,
+                                   profile)
 
-    dn = 'pkl/'
-    try:
-        os.mkdir(dn)
-    except FileExistsError:
-        pass
+        # Best of the epochs whose estimates are in the cube
+        n_ratings = val_index(pfs)[1]
+        predicted = predicted_epochs(n_epoch, predict_every)
+        best_epoch = predicted[np.dot(n_ratings, mae_va[:, predicted])
+                               .argmin()]
+        stop_epoch = None
+    else:
+        policy = StopPolicy(patience, min_delta)
+        mae_tr, mae_va = run_lockstep(pfs, n_epoch, cube, policy, workers,
+                                      threads, predict_every,
+                                      predict_batch_size, ckpt, keep_last,
+                                      telemetry)
+        best_epoch = policy.best_epoch
+        stop_epoch = policy.stop_epoch
 
-    # Time-stamp for saving to avoid overwrite
-    ts = hex(int((datetime.now()).timestamp()))[2:]
+    print('Best Epoch: {}; Stop Epoch: {}'.format(best_epoch, stop_epoch))
 
-    # pkl/ests.pkl
-    with open('{}ests_{}_{}_{}.pkl'.format(dn, p, n_epoch, ts), 'wb') as f:
-        pickle.dump(ests, f)
     # pkl/mae_tr.pkl
     with open('{}mae_tr_{}_{}_{}.pkl'.format(dn, p, n_epoch, ts), 'wb') as f:
         pickle.dump(mae_tr, f)
     # pkl/mae_va.pkl
     with open('{}mae_va_{}_{}_{}.pkl'.format(dn, p, n_epoch, ts), 'wb') as f:
         pickle.dump(mae_va, f)
+    # pkl/epochs.pkl: the epoch format.py should use, where training
+    #   stopped early (None if it ran all n_epoch epochs), and predict_every,
+    #   so that the epochs in the cube are known.
+    with open('{}epochs_{}_{}_{}.pkl'.format(dn, p, n_epoch, ts), 'wb') as f:
+        pickle.dump({'best_epoch': best_epoch, 'stop_epoch': stop_epoch,
+                     'predict_every': predict_every}, f)
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print('Must follow the following format:')
-        print('python3 train_mlp.py {30, 60, 90} {n_epoch}')
-    else:
-        main(int(sys.argv[1]), int(sys.argv[2]))
+    parser = argparse.ArgumentParser()
+    parser.add_argument('p', type=int, choices=[30, 60, 90])
+    parser.add_argument('n_epoch', type=int)
+    parser.add_argument('workers', type=int, nargs='?', default=1)
+    parser.add_argument('threads', type=int, nargs='?', default=None,
+                        help='threads per worker')
+    parser.add_argument('--patience', type=int, default=None,
+                        help='stop early after this many epochs without '
+                             'improvement of the weighted validation MAE')
+    parser.add_argument('--min-delta', type=float, default=0.)
+    parser.add_argument('--predict-every', type=int, default=1,
+                        help='predict the validation set every k epochs')
+    parser.add_argument('--predict-batch-size', type=int, default=None)
+    parser.add_argument('--no-checkpoint', action='store_true',
+                        help='do not save a checkpoint after every epoch')
+    parser.add_argument('--keep-last', type=int, default=2,
+                        help='number of recent checkpoints kept per pair, '
+                             'besides the best one')
+    parser.add_argument('--resume', metavar='TIMESTAMP', default=None,
+                        help='resume the run with this time-stamp')
+    parser.add_argument('--telemetry', metavar='FILE', default=None,
+                        help='record the epochs and stages of every pair to '
+                             'this JSONL file')
+    parser.add_argument('--profile', metavar='SECONDS', type=float,
+                        default=None,
+                        help='sample the stack of every pair this often; '
+                             'needs --telemetry')
+    a = parser.parse_args()
+    if a.n_epoch < 1:
+        parser.error('n_epoch must be at least 1')
+    if a.resume is not None and a.patience is not None:
+        parser.error('--resume cannot be used with --patience')
+
+    main(a.p, a.n_epoch, a.workers, a.threads, a.patience, a.min_delta,
+         a.predict_every, a.predict_batch_size, not a.no_checkpoint,
+         a.keep_last, a.resume, a.telemetry, a.profile)
@@ -0,0 +1,141 @@
+import os
+import numpy as np
+
+# Dense indices of the uIDs and jIDs of a training set, so that the embedding
+#   tables of Mlp, and Adam's two moment tables of each, have a row per ID
+#   that is actually trained instead of one per ID up to the largest.
+#
+#   ID:     1   4   5   9   ...   (sorted IDs in the training set)
+#   index:  1   2   3   4   ...
+#
+# Index OOV (0) is reserved for every other ID; its row is never trained and
+#   keeps its initial weights, like the rows of untrained IDs did before.
+#
+# The vocabularies of a model are saved with it: in a 'vocab' group of its
+#   .h5 file, which keras.models.load_model() ignores, or as vocab_uID.npy and
+#   vocab_jID.npy in a directory of npmlp.py. A model saved without them used
+#   the IDs as indices; identity() is its vocabulary.
+
+OOV = 0
+COLS = ['uID', 'jID']
+
+class Vocab(object):
+    'Dense index of a set of IDs, with OOV for every other ID'
+    def __init__(self, ids):
+        """
+        Arguments:
+            - ids: np.array
+                Non-negative IDs, in any order and with repeats.
+        """
+        self.ids = np.unique(np.asarray(ids, dtype=np.int64))
+        # Lookup table from ID to index; ~300KB for all 73,421 uIDs
+        self.table = np.zeros(self.ids[-1] + 1 if len(self.ids) else 1,
+                              dtype=np.int32)
+        self.table[self.ids] = np.arange(1, len(self.ids) + 1)
+
+    def __len__(self):
+        'Number of embedding rows, including the OOV row'
+        return len(self.ids) + 1
+
+    def __contains__(self, i):
+        return 0 <= i < len(self.table) and self.table[i] != OOV
+
+    def index(self, ids):
+        """
+        Arguments:
+            - ids: np.array
+                IDs of any shape.
+        Returns:
+            - np.array of int32 of the same shape: the index of every ID, or
+              OOV if it is not in the vocabulary.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        known = (ids >= 0) & (ids < len(self.table))
+        return np.where(known, self.table[np.where(known, ids, 0)], OOV)
+
+def fit(train):
+    """
+    Arguments:
+        - train: pandas.dataframe
+            Training set in the n x 3 format.
+    Returns:
+        - dict {'uID': Vocab, 'jID': Vocab} of the IDs in `train`.
+    """
+    return {c: Vocab(train[c].values) for c in COLS}
+
+def identity(n_users, n_jokes):
+    'Vocabularies of a model whose embedding rows are the IDs themselves'
+    return {'uID': Vocab(np.arange(1, n_users)),
+            'jID': Vocab(np.arange(1, n_jokes))}
+
+def keras_identity(model):
+    """
+    identity() of the embedding sizes of a Keras model with a uID and a jID
+    input, in that order, each looked up in an Embedding layer, e.g. one of
+    Mlp.new_model() or train_model.py. The layers are found by type, as
+    their names differ between the two.
+    """
+    embs = [l for l in model.layers if type(l).__name__ == 'Embedding']
+    dims = [next(l.input_dim for l in embs if l.input is x)
+            for x in model.inputs]
+    return identity(*dims)
+
+def transform(df, vocabs):
+    'Copy of a dataframe in the n x 3 format with its IDs as indices'
+    return df.assign(**{c: vocabs[c].index(df[c].values) for c in COLS})
+
+def index(X, vocabs):
+    """
+    Arguments:
+        - X: list
+            [uIDs, jIDs] as given to predict().
+        - vocabs: dict
+            {'uID': Vocab, 'jID': Vocab}
+    Returns:
+        - list [uID indices, jID indices].
+    """
+    return [vocabs[c].index(x) for c, x in zip(COLS, X)]
+
+def save(fn, vocabs):
+    """
+    Save the vocabularies of a model with it.
+
+    Arguments:
+        - fn: str
+            .h5 file of model.save(), or directory of npmlp.py.
+        - vocabs: dict
+            {'uID': Vocab, 'jID': Vocab}
+    """
+    if os.path.isdir(fn):
+        for c in COLS:
+            np.save(os.path.join(fn, 'vocab_{}.npy'.format(c)), vocabs[c].ids)
+        return
+
+    import h5py
+    with h5py.File(fn, 'a') as f:
+        if 'vocab' in f:
+            del f['vocab']
+        g = f.create_group('vocab')
+        for c in COLS:
+            g.create_dataset(c, data=vocabs[c].ids)
+
+def load(fn):
+    """
+    Arguments:
+        - fn: str
+            See save().
+    Returns:
+        - dict {'uID': Vocab, 'jID': Vocab}; None if the model was saved
+          without them.
+    """
+    if os.path.isdir(fn):
+        fns = [os.path.join(fn, 'vocab_{}.npy'.format(c)) for c in COLS]
+        if not all(os.path.exists(f) for f in fns):
+            return None
+        return {c: Vocab(np.load(f)) for c, f in zip(COLS, fns)}
+
+    import h5py
+    with h5py.File(fn, 'r') as f:
+        if 'vocab' not in f:
+            return None
+        return {c: Vocab(f['vocab'][c][()]) for c in COLS}